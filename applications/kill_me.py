@@ -6,7 +6,7 @@ def signals():
     for num in dir(signal):
         if num.startswith(
                 'SIG'
-        ) and '_' not in num and num is not 'SIGKILL' and num is not 'SIGSTOP':
+        ) and '_' not in num and num != 'SIGKILL' and num != 'SIGSTOP':
             yield getattr(signal, num)
 
 
@@ -10,12 +10,13 @@ args = parser.parse_args()
 SOCKET = socket(AF_INET, SOCK_STREAM)
 SOCKET.connect(('localhost', args.port))
 SOCKET.send((str(getpid()) + linesep).encode())
-SOCKET.setblocking(0)
 
-buffer = stdin.buffer.read(1)
+# read1 returns as soon as some data is available, so the output stays live
+# and a blocking sendall passes backpressure from the logger to the program
+buffer = stdin.buffer.read1(4096)
 while buffer != b'':
     stdout.buffer.write(buffer)
     stdout.buffer.flush()
-    SOCKET.send(buffer)
-    buffer = stdin.buffer.read(1)
+    SOCKET.sendall(buffer)
+    buffer = stdin.buffer.read1(4096)
 SOCKET.close()
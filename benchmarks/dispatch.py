@@ -0,0 +1,97 @@
+"""
+Measures the overhead of dispatching commands through the RPC registry.
+
+Example
+-------
+    $python -m benchmarks.dispatch
+    $python -m benchmarks.dispatch --number 50000
+"""
+import argparse
+import asyncio
+import time
+
+from utils import Command
+
+from client.dispatcher import Dispatcher
+from client.rpc import RPC
+import client.command  #pylint: disable=W0611
+
+
+async def execute(number):
+    """
+    Executes `number` online commands one after another.
+    """
+    for _ in range(number):
+        await RPC.execute(Command('online'))
+
+
+async def execute_concurrent(number):
+    """
+    Executes `number` online commands in their own tasks, like the receiver.
+    """
+    await asyncio.wait([
+        asyncio.create_task(RPC.execute(Command('online')))
+        for _ in range(number)
+    ])
+
+
+async def dispatcher(number):
+    """
+    Submits `number` online commands to a Dispatcher and fetches all results.
+    All commands are outstanding at the same time.
+    """
+    commands = Dispatcher(max_running=None)
+    for _ in range(number):
+        commands.submit(Command('online'))
+
+    finished = 0
+    while finished < number:
+        await commands.wait()
+        while commands.pop_finished() is not None:
+            finished += 1
+
+
+CHAIN_LENGTH = 10
+
+
+async def chain(number):
+    """
+    Executes chains of CHAIN_LENGTH online steps, `number` steps in total.
+    """
+    for _ in range(number // CHAIN_LENGTH):
+        await RPC.execute(
+            Command(
+                'chain_execution',
+                commands=[{
+                    'method': 'online',
+                    'uuid': str(idx),
+                    'arguments': {},
+                } for idx in range(CHAIN_LENGTH)]))
+
+
+BENCHMARKS = [execute, execute_concurrent, dispatcher, chain]
+
+
+def main():
+    """
+    Runs every benchmark `repeat` times and prints the best time per command.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    for benchmark in BENCHMARKS:
+        best = None
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            asyncio.run(benchmark(args.number))
+            duration = time.perf_counter() - start
+            best = duration if best is None else min(best, duration)
+
+        print('{:<20} {:8.2f} us/command'.format(
+            benchmark.__name__, best / args.number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Measures the throughput of hash_directory on a synthetic tree for different
+hash algorithms and numbers of threads. The page cache is not dropped, so the
+first run reads from the disk and the following runs mostly from memory.
+
+Example
+-------
+    $python -m benchmarks.hashing --files 256 --size 4 --workers 1 2 4 8
+    $python -m benchmarks.hashing --workers 1 --algorithms md5 sha256 blake2b
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from client.hashcache import HASH_CACHE
+import client.shorthand as sh
+
+
+def create_tree(directory, files, size, depth):
+    """
+    Creates `files` files with `size` MiB of random data, spread over
+    directories which are nested `depth` levels.
+    """
+    block = os.urandom(1 << 20)
+
+    for index in range(files):
+        path = os.path.join(directory,
+                            *['d{}'.format(index % (level + 2))
+                              for level in range(depth)])
+        os.makedirs(path, exist_ok=True)
+
+        with open(os.path.join(path, 'f{}'.format(index)), 'wb') as fil:
+            for _ in range(size):
+                fil.write(block)
+
+
+def main():
+    """
+    Creates the tree, hashes it once per algorithm and number of threads and
+    prints the throughput.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=256)
+    parser.add_argument('--size', type=int, default=4, help='MiB per file')
+    parser.add_argument('--depth', type=int, default=3)
+    parser.add_argument(
+        '--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument(
+        '--algorithms',
+        nargs='+',
+        choices=sh.HASH_ALGORITHMS,
+        default=[sh.HASH_ALGORITHM])
+    parser.add_argument(
+        '--buffer-size', type=int, default=sh.HASH_BUFFER_SIZE)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        create_tree(directory, args.files, args.size, args.depth)
+        total = args.files * args.size
+
+        for algorithm in args.algorithms:
+            expected = None
+            for workers in args.workers:
+                best = None
+                for _ in range(args.repeat):
+                    HASH_CACHE.clear()
+                    start = time.perf_counter()
+                    result = sh.hash_directory(
+                        directory,
+                        workers=workers,
+                        buffer_size=args.buffer_size,
+                        algorithm=algorithm)
+                    duration = time.perf_counter() - start
+                    best = duration if best is None else min(best, duration)
+
+                if expected is None:
+                    expected = result
+                elif expected != result:
+                    raise AssertionError(
+                        'The hash depends on the number of threads.')
+
+                print('{:8} {:3} threads: {:8.1f} MiB/s ({:.3f} s)'.format(
+                    algorithm, workers, total / best, best))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
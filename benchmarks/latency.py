@@ -0,0 +1,98 @@
+"""
+Measures the latency of online while a big file is moved by filesystem_move.
+
+Example
+-------
+    $python -m benchmarks.latency --size 1024
+    $python -m benchmarks.latency --size 1024 --inline
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+
+from utils import Command
+
+from client.rpc import RPC
+import client.command
+
+
+async def measure(source, destination, inline):
+    """
+    Moves the source to the destination and executes online every
+    millisecond until the move finished.
+
+    Returns
+    -------
+        list of latencies in seconds
+    """
+    arguments = {
+        'source_path': source,
+        'source_type': 'file',
+        'destination_path': destination,
+        'destination_type': 'file',
+        'backup_ending': '_BACK',
+    }
+
+    if inline:
+        # blocks the event loop like a filesystem command without a lane
+        async def move():
+            client.command.filesystem_move.__wrapped__(**arguments)
+
+        task = asyncio.create_task(move())
+    else:
+        task = asyncio.create_task(
+            RPC.execute(Command('filesystem_move', **arguments)))
+
+    # the latency is measured from the time the request was due, so a
+    # blocked event loop counts as well
+    latencies = []
+    while not task.done():
+        due = time.perf_counter() + 0.001
+        await asyncio.sleep(0.001)
+        await RPC.execute(Command('online'))
+        latencies.append(max(0, time.perf_counter() - due))
+
+    await task
+    return latencies
+
+
+def main():
+    """
+    Creates a file with `size` MiB, measures and prints the latencies.
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--size', type=int, default=256, help='MiB')
+    parser.add_argument(
+        '--inline',
+        action='store_true',
+        help='execute filesystem_move on the event loop')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        source = os.path.join(directory, 'source')
+        with open(source, 'wb') as source_file:
+            block = os.urandom(1 << 20)
+            for _ in range(args.size):
+                source_file.write(block)
+
+        latencies = sorted(
+            asyncio.run(
+                measure(source, os.path.join(directory, 'destination'),
+                        args.inline)))
+    finally:
+        shutil.rmtree(directory)
+
+    def percentile(value):
+        return latencies[min(len(latencies) - 1,
+                             int(len(latencies) * value))] * 1e3
+
+    print('{} samples, p50 {:.3f} ms, p99 {:.3f} ms, max {:.3f} ms'.format(
+        len(latencies), percentile(0.5), percentile(0.99), latencies[-1] * 1e3))
+
+
+if __name__ == '__main__':
+    main()
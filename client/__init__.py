@@ -2,6 +2,14 @@
 Init file for client module.
 """
 
+import client.cache
 import client.command
+import client.events
+import client.hashcache
+import client.health
 import client.logger
-import client.shorthand
\ No newline at end of file
+import client.outbox
+import client.receiver
+import client.rpc
+import client.shorthand
+import client.trash
\ No newline at end of file
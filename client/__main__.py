@@ -6,8 +6,19 @@ import argparse
 import asyncio
 import os
 
-from utils import RpcReceiver
+from utils import ProtocolError
+
+from . import events, shorthand as sh
+from .command import FILESYSTEM_LANE, FILESYSTEM_WORKERS
 from .logger import LOGGER
+from .events import EVENTS
+from .health import HEALTH
+from .hashcache import HASH_CACHE, HashCache
+from .trash import TRASH, Trash
+from .outbox import Outbox
+from .dispatcher import Dispatcher
+from .receiver import RpcReceiver
+from .rpc import RPC
 
 
 def generate_uri(host, port, path):
@@ -32,6 +43,49 @@ def generate_uri(host, port, path):
     )
 
 
+async def run(url, outbox, max_running, max_queued):
+    """
+    Runs the receiver and the health monitor until the receiver is closed.
+
+    Arguments
+    ---------
+        url: URL of the command websocket
+        outbox: Outbox or None
+        max_running: maximum number of running commands
+        max_queued: maximum number of queued commands
+    """
+    rpc = RpcReceiver(
+        url, outbox=outbox, max_running=max_running, max_queued=max_queued)
+    EVENTS.receiver = rpc
+    HEALTH.receiver = rpc
+
+    monitor = asyncio.create_task(HEALTH.run())
+    try:
+        await rpc.run()
+    finally:
+        monitor.cancel()
+
+
+def method_timeout(value):
+    """
+    Parses a default timeout of a method from the command line.
+
+    Arguments
+    ---------
+        value: string in the form METHOD=SECONDS
+
+    Returns
+    -------
+        (method, seconds)
+    """
+    (method, _, seconds) = value.partition('=')
+    try:
+        return (method, float(seconds))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            "'{}' is not in the form METHOD=SECONDS".format(value))
+
+
 def main():
     """
     Main function which will called if this is the main script.
@@ -50,6 +104,137 @@ def main():
         type=int,
         help='a network port',
     )
+    parser.add_argument(
+        '--log-rate-limit',
+        metavar='BYTES',
+        type=int,
+        default=LOGGER.rate_limit,
+        help='maximum logged output per program in bytes per second, '
+        'the output is not limited by default (%(default)s)',
+    )
+    parser.add_argument(
+        '--log-overflow',
+        choices=['summarize', 'backpressure'],
+        default=LOGGER.overflow,
+        help='what happens with output above the rate limit '
+        '(default: %(default)s)',
+    )
+    parser.add_argument(
+        '--outbox',
+        metavar='PATH',
+        type=str,
+        default=None,
+        help='journal for results which were not acknowledged by the master, '
+        'the master has to acknowledge results if this is set',
+    )
+    parser.add_argument(
+        '--outbox-sync-interval',
+        metavar='SECONDS',
+        type=float,
+        default=0.1,
+        help='interval in which the journal is synced to the disk '
+        '(default: %(default)s)',
+    )
+    parser.add_argument(
+        '--health-interval',
+        metavar='SECONDS',
+        type=float,
+        default=HEALTH.interval,
+        help='interval in which the health data (for example the event loop '
+        'lag) is sampled (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--progress-interval',
+        metavar='SECONDS',
+        type=float,
+        default=events.PROGRESS_INTERVAL,
+        help='minimum interval between two progress events of a filesystem '
+        'command (default: %(default)s)',
+    )
+    parser.add_argument(
+        '--max-commands',
+        metavar='N',
+        type=int,
+        default=Dispatcher.MAX_RUNNING,
+        help='maximum number of commands which run at the same time '
+        '(default: %(default)s)',
+    )
+    parser.add_argument(
+        '--max-queued-commands',
+        metavar='N',
+        type=int,
+        default=Dispatcher.MAX_QUEUED,
+        help='maximum number of commands which wait for a running command, '
+        'further commands are rejected (default: %(default)s)',
+    )
+
+    parser.add_argument(
+        '--filesystem-workers',
+        metavar='N',
+        type=int,
+        default=FILESYSTEM_WORKERS,
+        help='maximum number of filesystem commands which run at the same '
+        'time in their own threads (default: %(default)s)',
+    )
+
+    parser.add_argument(
+        '--hash-workers',
+        metavar='N',
+        type=int,
+        default=sh.HASH_WORKERS,
+        help='number of threads which hash the files of a directory '
+        '(default: %(default)s)',
+    )
+    parser.add_argument(
+        '--hash-buffer-size',
+        metavar='BYTES',
+        type=int,
+        default=sh.HASH_BUFFER_SIZE,
+        help='number of bytes which are read at once while hashing '
+        '(default: %(default)s)',
+    )
+    parser.add_argument(
+        '--hash-algorithm',
+        choices=sh.HASH_ALGORITHMS,
+        default=sh.HASH_ALGORITHM,
+        help='hash algorithm of filesystem commands which do not select one '
+        '(default: %(default)s)',
+    )
+    parser.add_argument(
+        '--hash-cache',
+        metavar='PATH',
+        type=str,
+        default=None,
+        help='file in which the hashes of unchanged files are kept between '
+        'runs of the client',
+    )
+    parser.add_argument(
+        '--hash-cache-size',
+        metavar='N',
+        type=int,
+        default=HashCache.MAX_SIZE,
+        help='maximum number of file hashes in the cache '
+        '(default: %(default)s)',
+    )
+    parser.add_argument(
+        '--trash-dir',
+        metavar='PATH',
+        type=str,
+        default=None,
+        help='directory into which filesystem_restore moves deployed files '
+        'before they are deleted in the background (default: a directory '
+        '{} next to each deleted path)'.format(Trash.TRASH_NAME),
+    )
+
+    parser.add_argument(
+        '--timeout',
+        metavar='METHOD=SECONDS',
+        type=method_timeout,
+        action='append',
+        default=[],
+        help='default timeout of a method, commands which run longer are '
+        'cancelled (can be given multiple times)',
+    )
 
     args = parser.parse_args()
 
@@ -64,17 +249,60 @@ def main():
         args.port,
         "logs",
     )
+    if args.log_rate_limit < 0:
+        parser.error('--log-rate-limit must not be negative')
+    LOGGER.rate_limit = args.log_rate_limit
+    LOGGER.overflow = args.log_overflow
     LOGGER.enable()
 
     print("Starting client.")
     if os.name == 'nt':
-        loop = asyncio.ProactorEventLoop()
-        asyncio.set_event_loop(loop)
+        # subprocesses are only supported by the proactor event loop
+        asyncio.set_event_loop_policy(
+            asyncio.WindowsProactorEventLoopPolicy())
+
+    if args.outbox:
+        outbox = Outbox(args.outbox, args.outbox_sync_interval)
     else:
-        loop = asyncio.get_event_loop()
+        outbox = None
+
+    HEALTH.interval = args.health_interval
+    if args.progress_interval < 0:
+        parser.error('--progress-interval must not be negative')
+    events.PROGRESS_INTERVAL = args.progress_interval
+    if args.filesystem_workers < 1:
+        parser.error('--filesystem-workers has to be at least 1')
+    RPC.add_lane(FILESYSTEM_LANE, args.filesystem_workers)
+    if args.hash_workers < 1:
+        parser.error('--hash-workers has to be at least 1')
+    if args.hash_buffer_size < 1:
+        parser.error('--hash-buffer-size has to be at least 1')
+    sh.HASH_WORKERS = args.hash_workers
+    sh.HASH_BUFFER_SIZE = args.hash_buffer_size
+    sh.HASH_ALGORITHM = args.hash_algorithm
+    if args.hash_cache_size < 1:
+        parser.error('--hash-cache-size has to be at least 1')
+    if args.max_commands < 1:
+        parser.error('--max-commands has to be at least 1')
+    if args.max_queued_commands < 1:
+        parser.error('--max-queued-commands has to be at least 1')
+    if args.hash_cache:
+        HASH_CACHE.load(args.hash_cache, args.hash_cache_size)
+    if args.trash_dir:
+        TRASH.root = args.trash_dir
+        # deletes what was left behind by the last run
+        TRASH.purge(TRASH.root)
+    for (method, timeout) in args.timeout:
+        try:
+            RPC.set_timeout(method, timeout)
+        except (ProtocolError, ValueError) as err:
+            parser.error('--timeout {}={}: {}'.format(method, timeout, err))
+    asyncio.run(
+        run(url, outbox, args.max_commands, args.max_queued_commands))
 
-    rpc = RpcReceiver(url)
-    loop.run_until_complete(rpc.run())
+    if outbox is not None:
+        outbox.close()
+    HASH_CACHE.close()
     print("Exit client ...")
 
 
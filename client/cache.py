@@ -0,0 +1,91 @@
+"""
+This module contains a bounded in-memory cache.
+"""
+
+from collections import OrderedDict
+from time import monotonic
+
+
+class LruCache:
+    """
+    Cache which holds at most `max_size` entries. If the cache is full the
+    least recently used entry is removed. Entries which are older than `ttl`
+    seconds are treated as missing.
+
+    ATTENTION!!! this class is not thread save.
+    """
+
+    def __init__(self, max_size, ttl=None, clock=monotonic):
+        if max_size < 1:
+            raise ValueError("The max_size has to be at least 1.")
+
+        self.__max_size = max_size
+        self.__ttl = ttl
+        self.__clock = clock
+        self.__entries = OrderedDict()
+
+    def get(self, key, default=None):
+        """
+        Returns the value for the key and marks the entry as recently used.
+
+        Arguments
+        ---------
+            key: hashable object
+            default: returned if there is no (valid) entry for the key
+
+        Returns
+        -------
+            the cached value or default
+        """
+        try:
+            (created, value) = self.__entries[key]
+        except KeyError:
+            return default
+
+        if self.__ttl is not None and self.__clock() - created > self.__ttl:
+            del self.__entries[key]
+            return default
+
+        self.__entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        """
+        Adds or replaces the entry for the key.
+
+        Arguments
+        ---------
+            key: hashable object
+            value: any object
+        """
+        self.__entries.pop(key, None)
+        self.__entries[key] = (self.__clock(), value)
+
+        while len(self.__entries) > self.__max_size:
+            self.__entries.popitem(last=False)
+
+    def items(self):
+        """
+        Returns the valid entries from the least to the most recently used.
+
+        Returns
+        -------
+            list of (key, value)
+        """
+        now = self.__clock()
+        return [(key, value)
+                for (key, (created, value)) in self.__entries.items()
+                if self.__ttl is None or now - created <= self.__ttl]
+
+    def __contains__(self, key):
+        sentinel = object()
+        return self.get(key, sentinel) is not sentinel
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def clear(self):
+        """
+        Removes all entries.
+        """
+        self.__entries.clear()
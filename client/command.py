@@ -9,22 +9,24 @@ import platform
 import subprocess
 import shutil
 import errno
+import logging
 import psutil
 
 from pathlib import PurePath
 from functools import reduce
 
-from utils import Rpc, Command, Status
-import utils.rpc
-import utils.typecheck as uty
+from utils import Command, Status
 
-from client.logger import LOGGER
+from client.logger import LOGGER, ProgramLogger
+from client.events import EVENTS, Progress
+from client.health import HEALTH
+from client.rpc import RPC, CONTROL, Cancelled, OneOf, check_timeout
+from client.trash import TRASH
 from client import shorthand as sh
 
 
-@Rpc.method
-@asyncio.coroutine
-def online():
+@RPC.method(lane=CONTROL)
+async def online():
     """
     Function that can be used by the master to
     determine if the slave is online
@@ -32,9 +34,22 @@ def online():
     pass
 
 
-@Rpc.method
-@asyncio.coroutine
-def enable_logging(target_uuid):
+@RPC.method(lane=CONTROL)
+async def health():
+    """
+    Function that can be used by the master to determine the load of the
+    slave. The returned data is sampled in the background (see
+    HealthMonitor).
+
+    Returns
+    -------
+        dict (see HealthMonitor.report)
+    """
+    return HEALTH.report()
+
+
+@RPC.method(lane=CONTROL)
+async def enable_logging(target_uuid: str):
     """
     Enables logging over websockets on the path '/logs'
 
@@ -43,12 +58,11 @@ def enable_logging(target_uuid):
     target_uuid: string
         uuid of the command for with logging gets enabled
     """
-    yield from LOGGER.program_loggers[target_uuid].enable_remote()
+    await LOGGER.program_loggers[target_uuid].enable_remote()
 
 
-@Rpc.method
-@asyncio.coroutine
-def disable_logging(target_uuid):
+@RPC.method(lane=CONTROL)
+async def disable_logging(target_uuid: str):
     """
     Disables logging over websockets on the path '/logs'
 
@@ -57,17 +71,33 @@ def disable_logging(target_uuid):
     target_uuid: string
         uuid of the command for with logging gets disabled
     """
-    yield from LOGGER.program_loggers[target_uuid].disable_remote()
+    await LOGGER.program_loggers[target_uuid].disable_remote()
 
 
-@Rpc.method
-@asyncio.coroutine
-def execute(pid, own_uuid, path, arguments):
+RESTART_POLICIES = ['never', 'on-failure', 'always']
+MAX_RESTART_DELAY = 60
+
+
+@RPC.method
+async def execute(pid,
+                  own_uuid,
+                  path: str,
+                  arguments: [str],
+                  rate_limit: int = None,
+                  overflow: OneOf(*ProgramLogger.OVERFLOW_MODES) = None,
+                  restart: OneOf(*RESTART_POLICIES) = 'never',
+                  max_restarts: int = None,
+                  backoff: (int, float) = 1):
     """
     Executes a the program with arguments in a new Terminal/CMD window.
     The output of the program gets piped into '/applications/tee.py' and logged
     by a ProgramLogger.
 
+    The program can be supervised by a restart policy. If the program
+    terminates and the policy applies, it gets restarted after a delay which
+    doubles with every restart. All runs log into the same ProgramLogger and
+    every restart is pushed as a 'restart' event to the master.
+
     Arguments
     ---------
     path: string
@@ -76,22 +106,29 @@ def execute(pid, own_uuid, path, arguments):
         which will be the arguments for the program.
     pid: int
         The ID from the master table.
+    rate_limit: int
+        Maximum logged output of the program in bytes per second, 0 disables
+        the limit (default: LOGGER.rate_limit).
+    overflow: string
+        'summarize' drops output above the rate limit, 'backpressure' blocks
+        the program until the output was logged (default: LOGGER.overflow).
+    restart: string
+        'never', 'on-failure' (restart if the exit code is not 0) or 'always'.
+    max_restarts: int
+        Maximum number of restarts, None means no limit.
+    backoff: int or float
+        Delay in seconds before the first restart (at most
+        MAX_RESTART_DELAY seconds).
 
     Returns
     -------
     Method name, exit code of the process and the pid from the master table.
     A negative value -N indicates that the child was terminated by signal N
-    (Unix only).
+    (Unix only). If the program was restarted, the exit code of the last run
+    is returned.
     """
-    if not isinstance(path, str):
-        raise ValueError("Path to program is not a string.")
-
-    if not isinstance(arguments, list):
-        raise ValueError("Arguments is not a list.")
-    else:
-        for arg in arguments:
-            if not isinstance(arg, str):
-                raise ValueError("Element in arguments is not a string.")
+    if backoff < 0:
+        raise ValueError("Backoff is not a positive number.")
 
     if os.path.isdir(str(PurePath(path).parent)):
         parent_dir = str(PurePath(path).parent)
@@ -104,122 +141,166 @@ def execute(pid, own_uuid, path, arguments):
 
     LOGGER.add_program_logger(pid, own_uuid,
                               sh.escape_path(misc_file_name + '.log'),
-                              (1 << 20) * 2)
+                              (1 << 20) * 2, rate_limit, overflow)
     PROGRAM_LOGGER = LOGGER.program_loggers[own_uuid]
-    log_task = asyncio.get_event_loop().create_task(PROGRAM_LOGGER.run())
-    try:
-        if platform.system() == 'Windows':
-            with open(misc_file_path + '.bat', mode='w') as execute_file:
-                execute_file.write('@echo off{}'.format(os.linesep))
-                execute_file.write('mode 80,60{}'.format(os.linesep))
-                execute_file.write('@echo on{}'.format(os.linesep))
-                execute_file.write('call {path} {args}'.format(
-                    path=sh.escape_path(path),
-                    args=reduce(lambda r, l: r + ' ' + l, arguments, ''),
-                ))
-                execute_file.write('{}@echo off'.format(os.linesep))
-                execute_file.write('{}echo %errorlevel% > {}'.format(
-                    os.linesep, sh.escape_path(misc_file_path + '.exit')))
-
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags = subprocess.STARTF_USESHOWWINDOW
-            startupinfo.wShowWindow = 6
-
-            command = """call {bat_file_path} 2>&1 | {python} {tee} --port {port}""".format(
-                python=sys.executable,
-                tee=os.path.join(os.getcwd(), 'applications', 'tee.py'),
-                bat_file_path=sh.escape_path(misc_file_path + '.bat'),
-                port=PROGRAM_LOGGER.port,
-            )
+    log_task = asyncio.create_task(PROGRAM_LOGGER.run(restartable=True))
 
-            print(command)
+    def read_exit_code():
+        # if the terminal/cmd window gets killed
+        if not os.path.isfile(sh.escape_path(misc_file_path + '.exit')):
+            with open(misc_file_path + '.exit', mode='w') as exit_file:
+                exit_file.write('1')
 
-            process = yield from asyncio.create_subprocess_exec(
-                *['cmd.exe', '/c', command],
-                cwd=parent_dir,
-                creationflags=subprocess.CREATE_NEW_CONSOLE,
-                startupinfo=startupinfo)
-        else:
-            command = """({path} {args}) 2>&1 | {python} {tee} --port {port}""".format(
+        with open(misc_file_path + '.exit') as exit_file:
+            return exit_file.readlines()[0].rstrip()
+
+    if platform.system() == 'Windows':
+        with open(misc_file_path + '.bat', mode='w') as execute_file:
+            execute_file.write('@echo off{}'.format(os.linesep))
+            execute_file.write('mode 80,60{}'.format(os.linesep))
+            execute_file.write('@echo on{}'.format(os.linesep))
+            execute_file.write('call {path} {args}'.format(
                 path=sh.escape_path(path),
                 args=reduce(lambda r, l: r + ' ' + l, arguments, ''),
-                python=sys.executable,
-                tee=os.path.join(os.getcwd(), 'applications', 'tee.py'),
-                port=PROGRAM_LOGGER.port,
-            )
-
-            print(command)
-
-            with open(misc_file_path + '.sh', mode='w') as execute_file:
-                execute_file.write('#!/bin/bash' + os.linesep)
-                execute_file.write(command + os.linesep)
-                execute_file.write('echo ${PIPESTATUS[0]} > ' + sh.escape_path(
-                    misc_file_path + '.exit') + os.linesep)
-
-            mode = os.stat(misc_file_path + '.sh').st_mode
-            mode |= (mode & 0o444) >> 2  # copy R bits to X
-            os.chmod(misc_file_path + '.sh', mode)
-
-            if 'DISPLAY' in os.environ and shutil.which('xterm'):
-                subprocess_arguments = [
-                    'xterm', '-e',
-                    sh.escape_path(misc_file_path + '.sh'), '-geometry', '80'
-                ]
-            else:
-                subprocess_arguments = [sh.escape_path(misc_file_path + '.sh')]
-
-            process = yield from asyncio.create_subprocess_exec(
-                *subprocess_arguments, cwd=parent_dir)
+            ))
+            execute_file.write('{}@echo off'.format(os.linesep))
+            execute_file.write('{}echo %errorlevel% > {}'.format(
+                os.linesep, sh.escape_path(misc_file_path + '.exit')))
+
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags = subprocess.STARTF_USESHOWWINDOW
+        startupinfo.wShowWindow = 6
+
+        command = """call {bat_file_path} 2>&1 | {python} {tee} --port {port}""".format(
+            python=sys.executable,
+            tee=os.path.join(os.getcwd(), 'applications', 'tee.py'),
+            bat_file_path=sh.escape_path(misc_file_path + '.bat'),
+            port=PROGRAM_LOGGER.port,
+        )
+
+        print(command)
+
+        subprocess_arguments = ['cmd.exe', '/c', command]
+        subprocess_options = {
+            'creationflags': subprocess.CREATE_NEW_CONSOLE,
+            'startupinfo': startupinfo,
+        }
+    else:
+        command = """({path} {args}) 2>&1 | {python} {tee} --port {port}""".format(
+            path=sh.escape_path(path),
+            args=reduce(lambda r, l: r + ' ' + l, arguments, ''),
+            python=sys.executable,
+            tee=os.path.join(os.getcwd(), 'applications', 'tee.py'),
+            port=PROGRAM_LOGGER.port,
+        )
+
+        print(command)
+
+        with open(misc_file_path + '.sh', mode='w') as execute_file:
+            execute_file.write('#!/bin/bash' + os.linesep)
+            execute_file.write(command + os.linesep)
+            execute_file.write('echo ${PIPESTATUS[0]} > ' + sh.escape_path(
+                misc_file_path + '.exit') + os.linesep)
+
+        mode = os.stat(misc_file_path + '.sh').st_mode
+        mode |= (mode & 0o444) >> 2  # copy R bits to X
+        os.chmod(misc_file_path + '.sh', mode)
+
+        if 'DISPLAY' in os.environ and shutil.which('xterm'):
+            subprocess_arguments = [
+                'xterm', '-e',
+                sh.escape_path(misc_file_path + '.sh'), '-geometry', '80'
+            ]
+        else:
+            subprocess_arguments = [sh.escape_path(misc_file_path + '.sh')]
+        subprocess_options = {}
 
-        yield from asyncio.wait(
-            {process.wait(), log_task}, return_when=asyncio.ALL_COMPLETED)
+    process = None
+    restarts = 0
+    try:
+        while True:
+            # an exit file of an earlier run must not be mistaken for the
+            # exit code of this run
+            if os.path.isfile(misc_file_path + '.exit'):
+                os.remove(misc_file_path + '.exit')
+
+            PROGRAM_LOGGER.expect_connection()
+            process = await asyncio.create_subprocess_exec(
+                *subprocess_arguments, cwd=parent_dir, **subprocess_options)
+
+            await asyncio.gather(process.wait(),
+                                 PROGRAM_LOGGER.wait_connection_closed())
+
+            exit_code = read_exit_code()
+
+            if restart == 'never' or (restart == 'on-failure'
+                                      and exit_code == '0'):
+                break
+            if max_restarts is not None and restarts >= max_restarts:
+                break
+
+            delay = min(backoff * (2**restarts), MAX_RESTART_DELAY)
+            restarts += 1
+
+            logging.info('Program %s exited with %s, restart %s in %ss.',
+                         path, exit_code, restarts, delay)
+            await EVENTS.push(own_uuid, 'execute', 'restart', {
+                'pid': pid,
+                'exit_code': exit_code,
+                'restarts': restarts,
+                'delay': delay,
+            })
+            await asyncio.sleep(delay)
 
     except asyncio.CancelledError:
+        if process is not None and process.returncode is None:
+
+            def children():
+                if platform.system() == 'Windows':
+                    for child in psutil.Process(process.pid).children():
+                        for grandchild in child.children(recursive=True):
+                            yield grandchild
+                else:
+                    for child in psutil.Process(
+                            process.pid).children(recursive=True):
+                        if (child.pid != process.pid
+                                and child.pid != PROGRAM_LOGGER.pid
+                                and child.name() != misc_file_name[:15]):
+                            yield child
 
-        def children():
-            if platform.system() == 'Windows':
-                for child in psutil.Process(process.pid).children():
-                    for grandchild in child.children(recursive=True):
-                        yield grandchild
-            else:
-                for child in psutil.Process(
-                        process.pid).children(recursive=True):
-                    if (child.pid != process.pid
-                            and child.pid != PROGRAM_LOGGER.pid
-                            and child.name() != misc_file_name[:15]):
-                        yield child
-
-        for child in children():
-            child.terminate()
-            print('terminated: {}'.format(child))
-
-        _, pending = yield from asyncio.wait({process.wait()}, timeout=3)
-
-        if pending:
             for child in children():
-                child.kill()
-                print('killed: {}'.format(child))
+                child.terminate()
+                print('terminated: {}'.format(child))
+
+            try:
+                await asyncio.wait_for(process.wait(), 3)
+            except asyncio.TimeoutError:
+                for child in children():
+                    child.kill()
+                    print('killed: {}'.format(child))
+
+                await asyncio.gather(process.wait(),
+                                     PROGRAM_LOGGER.wait_connection_closed())
+            else:
+                try:
+                    await asyncio.wait_for(
+                        PROGRAM_LOGGER.wait_connection_closed(), 3)
+                except asyncio.TimeoutError:
+                    pass
 
-            yield from asyncio.wait(
-                {process.wait(), log_task}, return_when=asyncio.ALL_COMPLETED)
+    PROGRAM_LOGGER.finish()
+    await log_task
 
     if platform.system() == 'Windows':
         os.remove(misc_file_path + '.bat')
     else:
         os.remove(misc_file_path + '.sh')
 
-    # if the terminal/cmd window gets killed
-    if not os.path.isfile(sh.escape_path(misc_file_path + '.exit')):
-        with open(misc_file_path + '.exit', mode='w') as exit_file:
-            exit_file.write('1')
+    return read_exit_code()
 
-    with open(misc_file_path + '.exit') as exit_file:
-        return exit_file.readlines()[0].rstrip()
 
-
-@Rpc.method
-@asyncio.coroutine
-def get_log(target_uuid):
+@RPC.method(lane=CONTROL)
+async def get_log(target_uuid: str):
     """
     Returns the current log of the program that is/was executed by a Command
     with the given uuid.
@@ -237,15 +318,50 @@ def get_log(target_uuid):
     return {'log': log.decode(), 'uuid': target_uuid}
 
 
-@Rpc.method
-@asyncio.coroutine
-def chain_execution(commands):
+CHAIN_PARALLELISM = 4
+
+
+@RPC.method
+async def chain_execution(commands: [dict],
+                          parallelism: int = None,
+                          stream_steps: bool = False):
     """
-    Executes given commands sequential. If one commands fails all other commands fail
-    too.
+    Executes the given commands. A command can list the uuids of the commands
+    it depends on in 'depends_on'. A command is executed as soon as all of its
+    dependencies were successful, at most `parallelism` commands at the same
+    time. If a command fails, all commands which depend on it (directly or
+    indirectly) fail too.
+
+    If no command declares dependencies, the commands are executed sequential
+    and if one command fails all following commands fail too.
+
+    If stream_steps is True and the chain was started by a command, the
+    Status of every finished command is pushed as a 'step' event with the
+    uuid of the chain as soon as it is available.
+
+    Arguments
+    ---------
+    commands: dict[]
+        Commands with the keys 'method', 'uuid', 'arguments' and optionally
+        'depends_on' (list of uuids) and 'timeout' (seconds).
+    parallelism: int
+        Maximum number of commands which are executed at the same time
+        (default: CHAIN_PARALLELISM).
+    stream_steps: bool
+        Whether the results of the commands are pushed as 'step' events.
+
+    Returns
+    -------
+    A list with a Status (as dict) for every valid command, in the order of
+    the given commands.
     """
-    result = []
-    error = False
+    if parallelism is None:
+        parallelism = CHAIN_PARALLELISM
+    if parallelism < 1:
+        raise ValueError("Parallelism has to be at least 1.")
+
+    steps = []
+    declared = []
 
     for command in commands:
         try:
@@ -253,67 +369,169 @@ def chain_execution(commands):
                 command["method"],
                 uuid=command["uuid"],
                 **command["arguments"])
+            cmd.timeout = check_timeout(command.get("timeout"))
         except Exception as err:  #pylint: disable=W0703
             print(err)
             continue
 
-        if error:
-            ret = Status(
-                Status.ID_ERR,
-                {
-                    'method':
-                    cmd.method,
-                    'result':
-                    "Could not execute because earlier command was not successful."
-                },
-                cmd.uuid,
-            )
+        steps.append(cmd)
+        declared.append(command.get("depends_on"))
 
-            result.append(dict(ret))
-        else:
+    if all(depends_on is None for depends_on in declared):
+        # every command depends on the command before
+        dependencies = [{idx - 1} if idx else set()
+                        for idx in range(len(steps))]
+    else:
+        index = dict((cmd.uuid, idx) for (idx, cmd) in enumerate(steps))
+        dependencies = []
+
+        for (cmd, depends_on) in zip(steps, declared):
+            if depends_on is None:
+                depends_on = []
+            if not isinstance(depends_on, list):
+                raise ValueError(
+                    "depends_on of command {} has to be list.".format(
+                        cmd.uuid))
+            for uuid in depends_on:
+                if uuid not in index:
+                    raise ValueError(
+                        "Command {} depends on the unknown command {}.".format(
+                            cmd.uuid, uuid))
+            dependencies.append(set(index[uuid] for uuid in depends_on))
+
+    def fail(idx, message):
+        return Status(
+            Status.ID_ERR,
+            {
+                'method': steps[idx].method,
+                'result': message,
+            },
+            steps[idx].uuid,
+        )
+
+    chain = RPC.current_command() if stream_steps else None
+    results = [None] * len(steps)
+    finished = []
+    pending = set(range(len(steps)))
+    running = dict()
+
+    def finish(idx, result):
+        results[idx] = result
+        finished.append(result)
+
+    async def push_finished():
+        if chain is not None:
+            for result in finished:
+                await EVENTS.push(chain.uuid, chain.method, 'step',
+                                  dict(result))
+        finished.clear()
 
-            try:
-                fun = Rpc.get(cmd.method)
-                print(dict(cmd))
-                ret = yield from asyncio.coroutine(fun)(**cmd.arguments)
-
-                ret = Status(
-                    Status.ID_OK,
-                    {
-                        'method': cmd.method,
-                        'result': ret
-                    },
-                    cmd.uuid,
-                )
-
-                result.append(dict(ret))
-            except Exception as err:  #pylint: disable=W0703
-                ret = Status(
-                    Status.ID_ERR,
-                    {
-                        'method': cmd.method,
-                        'result': str(err)
-                    },
-                    cmd.uuid,
-                )
-
-                result.append(dict(ret))
-                error = True
-
-    return result
-
-
-@Rpc.method
-@asyncio.coroutine
+    try:
+        while True:
+            # fail all commands with a failed dependency (and their dependents)
+            changed = True
+            while changed:
+                changed = False
+                for idx in sorted(pending):
+                    if any(results[dep] is not None and results[dep].is_err()
+                           for dep in dependencies[idx]):
+                        finish(
+                            idx,
+                            fail(
+                                idx,
+                                "Could not execute because earlier command was not successful."
+                            ))
+                        pending.remove(idx)
+                        changed = True
+
+            for idx in sorted(pending):
+                if len(running) >= parallelism:
+                    break
+                if all(results[dep] is not None
+                       for dep in dependencies[idx]):
+                    print(dict(steps[idx]))
+                    task = asyncio.create_task(RPC.execute(steps[idx]))
+                    running[task] = idx
+                    pending.remove(idx)
+
+            await push_finished()
+
+            if not running:
+                break
+
+            done, _ = await asyncio.wait(
+                set(running), return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                finish(running.pop(task), task.result())
+
+    except asyncio.CancelledError:
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.wait(set(running))
+        raise
+
+    # the remaining commands depend on each other
+    for idx in sorted(pending):
+        finish(idx,
+               fail(idx, "Could not execute because of a cyclic dependency."))
+
+    await push_finished()
+
+    return [dict(result) for result in results]
+
+
+FILESYSTEM_LANE = 'filesystem'
+FILESYSTEM_WORKERS = 4
+
+RPC.add_lane(FILESYSTEM_LANE, FILESYSTEM_WORKERS)
+
+
+def _progress(enabled):
+    """
+    Returns a Progress which pushes 'progress' events of the current command
+    (see EventPublisher.push) or None if the progress is not reported.
+    """
+    command = RPC.current_command()
+    if not enabled or command is None:
+        return None
+
+    def send(data):
+        RPC.run_coroutine(
+            EVENTS.push(command.uuid, command.method, 'progress', data))
+
+    return Progress(send)
+
+
+@RPC.method(lane=FILESYSTEM_LANE)
 def filesystem_move(
-        source_path,
-        source_type,
-        destination_path,
-        destination_type,
-        backup_ending,
+        source_path: str,
+        source_type: OneOf(*sh.PATH_TYPE_SET),
+        destination_path: str,
+        destination_type: OneOf(*sh.PATH_TYPE_SET),
+        backup_ending: str,
+        mode: OneOf(*sh.MOVE_MODES) = sh.COPY,
+        hash_algorithm: OneOf(*sh.HASH_ALGORITHMS) = None,
+        progress: bool = False,
 ):
     """
-    Moves a file from the source to the destination.
+    Moves a file from the source to the destination. If the command is
+    cancelled (for example because its timeout expired), the partial copy is
+    removed and the backup is moved back.
+
+    In the link mode the destination is not a copy, but a hardlink to the
+    source (or a symlink if the source is on another file system), which
+    takes no time for big sources. Changes to a hardlinked destination
+    change the source as well, so this mode is meant for read-only assets.
+
+    In the sync mode an existing destination directory is updated in place,
+    only new and changed files are copied (see sh.sync_directory). Otherwise
+    it works like the copy mode.
+
+    If progress is True, the copied and hashed bytes and files are pushed as
+    'progress' events with the uuid of the command, at most once per
+    client.events.PROGRESS_INTERVAL seconds (see client.events.Progress).
 
     Arguments
     ---------
@@ -322,11 +540,17 @@ def filesystem_move(
         destination_path: path to the destination
         destination_type: Type of the destination (place it in a directory -> 'dir' or replace it -> 'file')
         backup_ending: the file ending for backup files
+        mode: 'copy', 'link' or 'sync'
+        hash_algorithm: the algorithm of the returned hash (default:
+            sh.HASH_ALGORITHM)
+        progress: whether progress events are pushed
 
     Returns
     -------
-        The hash of the source
+        The hash of the source (see sh.format_hash)
     """
+    tracker = _progress(progress)
+
     (
         source_path,
         source_type,
@@ -356,51 +580,178 @@ def filesystem_move(
                 backup_path,
             )
 
-        # move old file to backup
-        os.rename(destination_path, backup_path)
+        if (mode == sh.SYNC and source_type == 'dir'
+                and not os.path.islink(destination_path)):
+            # only the changes are moved to the backup
+            synced = True
+        else:
+            # move old file to backup
+            os.rename(destination_path, backup_path)
+            synced = False
+        backup_created = True
 
     elif os.path.exists(destination_path):
         raise ValueError(
             "Expected a {} at `{}`, but did not found one.".format(
                 "file"
                 if source_type == "file" else "directory", destination_path))
+    else:
+        backup_created = False
+        synced = False
+
+    if synced:
+        # rolls back the changes by itself if it is cancelled
+        strategies = sh.sync_directory(source_path, destination_path,
+                                       backup_path, RPC.checkpoint,
+                                       hash_algorithm, tracker)
+        hash_value = sh.hash_directory(
+            source_path,
+            RPC.checkpoint,
+            algorithm=hash_algorithm,
+            progress=tracker)
+        if tracker is not None:
+            tracker.finish()
+        logging.info('Moved %s to %s (%s strategies %s).', source_path,
+                     destination_path, mode, strategies)
+        return hash_value
 
-    if source_type == 'dir':
-        os.mkdir(destination_path)
+    try:
+        if mode == sh.LINK and source_type == 'dir':
+            strategies = sh.link_directory(source_path, destination_path,
+                                           RPC.checkpoint)
+            hash_value = sh.hash_directory(
+                source_path,
+                RPC.checkpoint,
+                algorithm=hash_algorithm,
+                progress=tracker)
+
+        elif mode == sh.LINK and source_type == 'file':
+            strategies = {sh.link_file(source_path, destination_path): 1}
+            if tracker is not None:
+                tracker.add_total(os.path.getsize(source_path), 1)
+            hash_value = sh.hash_file(
+                source_path,
+                RPC.checkpoint,
+                algorithm=hash_algorithm,
+                progress=tracker)
+
+        elif source_type == 'dir':
+            (hash_value, strategies) = sh.copy_directory(
+                source_path,
+                destination_path,
+                RPC.checkpoint,
+                algorithm=hash_algorithm,
+                progress=tracker)
 
-        for root, dirs, files in os.walk(source_path):
-            # set the prefix from source_path to destination_path
-            dest_root = os.path.join(destination_path,
-                                     root[len(source_path) + 1:])
+        elif source_type == 'file':
+            # finally link source to destination
+            if tracker is not None:
+                tracker.add_total(os.path.getsize(source_path), 1)
+            (hash_value, strategy) = sh.copy_file(
+                source_path, destination_path, RPC.checkpoint, hash_algorithm,
+                tracker)
+            strategies = {strategy: 1}
+    except Cancelled:
+        # remove the partial copy and put the backup back
+        if os.path.lexists(destination_path):
+            TRASH.discard(destination_path)
+        if backup_created:
+            os.rename(backup_path, destination_path)
+        raise
+
+    if tracker is not None:
+        tracker.finish()
+    logging.info('Moved %s to %s (%s strategies %s).', source_path,
+                 destination_path, mode, strategies)
+    return hash_value
+
+
+@RPC.method(lane=FILESYSTEM_LANE)
+def filesystem_hash(
+        path: str,
+        hash_algorithm: OneOf(*sh.HASH_ALGORITHMS) = None,
+        progress: bool = False,
+):
+    """
+    Returns the hash of a file or a directory, like filesystem_move does for
+    its source.
+
+    Arguments
+    ---------
+        path: path to a file or a directory
+        hash_algorithm: the algorithm of the hash (default:
+            sh.HASH_ALGORITHM)
+        progress: whether progress events are pushed (see filesystem_move)
+
+    Returns
+    -------
+        The hash (see sh.format_hash)
+    """
+    path = os.path.abspath(path)
+    tracker = _progress(progress)
+
+    if os.path.isdir(path):
+        hash_value = sh.hash_directory(
+            path, RPC.checkpoint, algorithm=hash_algorithm, progress=tracker)
+    elif os.path.isfile(path):
+        if tracker is not None:
+            tracker.add_total(os.path.getsize(path), 1)
+        hash_value = sh.hash_file(
+            path, RPC.checkpoint, algorithm=hash_algorithm, progress=tracker)
+    else:
+        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+
+    if tracker is not None:
+        tracker.finish()
+    return hash_value
+
+
+@RPC.method(lane=FILESYSTEM_LANE)
+def filesystem_tree(
+        path: str,
+        depth: int = 1,
+        hash_algorithm: OneOf(*sh.HASH_ALGORITHMS) = None,
+):
+    """
+    Returns the Merkle tree of a directory (see sh.hash_tree) up to the given
+    depth. Two trees can be compared by requesting the subtrees of the
+    entries with different hashes only.
 
-            for directory in dirs:
-                os.mkdir(os.path.join(dest_root, directory))
+    Arguments
+    ---------
+        path: path to the directory
+        depth: number of levels below the directory which are returned
+        hash_algorithm: the algorithm of the hashes (default:
+            sh.HASH_ALGORITHM)
 
-            for fil in files:
-                shutil.copyfile(
-                    os.path.join(root, fil),
-                    os.path.join(dest_root, fil),
-                )
-        return sh.hash_directory(destination_path)
+    Returns
+    -------
+        dict with the keys type, mode, hash and entries (dict of the same
+        structure by name, only for directories above the depth)
+    """
+    if depth < 0:
+        raise ValueError("The depth must not be negative.")
 
-    elif source_type == 'file':
-        # finally link source to destination
-        shutil.copyfile(source_path, destination_path)
-        return sh.hash_file(destination_path)
+    tree = sh.hash_tree(
+        os.path.abspath(path), RPC.checkpoint, algorithm=hash_algorithm)
+    return sh.prune_tree(tree, depth)
 
 
-@Rpc.method
-@asyncio.coroutine
+@RPC.method(lane=FILESYSTEM_LANE)
 def filesystem_restore(
-        source_path,
-        source_type,
-        destination_path,
-        destination_type,
-        backup_ending,
-        hash_value,
+        source_path: str,
+        source_type: OneOf(*sh.PATH_TYPE_SET),
+        destination_path: str,
+        destination_type: OneOf(*sh.PATH_TYPE_SET),
+        backup_ending: str,
+        hash_value: str,
 ):
     """
-    Restores a previously moved object.
+    Restores a previously moved object. A directory which was moved in the
+    sync mode is rolled back with the manifest in its backup. Otherwise the
+    destination is moved into the trash (see client.trash) and deleted in
+    the background, so the time until the backup is back in place does not
+    depend on the size of the destination.
 
     Arguments
     ---------
@@ -410,9 +761,12 @@ def filesystem_restore(
         destination_type: Type of the destination (place it in a directory -> 'dir' or
              replace it -> 'file')
         backup_ending: the file ending for backup files
+        hash_value: the hash which was returned by filesystem_move (with or
+            without the name of the algorithm in front, see sh.format_hash)
 
     """
-    uty.ensure_type("hash_value", hash_value, str)
+    # raises a ValueError for unknown algorithms
+    sh.parse_hash(hash_value)
 
     (
         source_path,
@@ -431,11 +785,13 @@ def filesystem_restore(
 
     backup_path = destination_path + backup_ending
 
-    if os.path.exists(destination_path):
-        if source_type == 'dir':
-            shutil.rmtree(destination_path)
-        elif source_type == 'file':
-            os.remove(destination_path)
+    if source_type == 'dir' and sh.is_sync_backup(backup_path):
+        sh.rollback_sync(destination_path, backup_path)
+        return None
+
+    if os.path.lexists(destination_path):
+        # links are removed without touching the source
+        TRASH.discard(destination_path)
 
     if os.path.exists(backup_path):
         os.rename(backup_path, destination_path)
@@ -443,9 +799,8 @@ def filesystem_restore(
     return None
 
 
-@Rpc.method
-@asyncio.coroutine
-def shutdown():
+@RPC.method(lane=CONTROL)
+async def shutdown():
     """
     shuts down the system
     """
@@ -0,0 +1,182 @@
+"""
+This module contains the dispatcher which executes the commands of the master
+concurrently.
+"""
+import asyncio
+import functools
+import logging
+
+from collections import deque, OrderedDict
+
+from utils import Status
+
+from client.rpc import RPC, CONTROL
+
+
+class Dispatcher:
+    """
+    Executes every command in its own task. At most `max_running` commands
+    are executed at the same time, further commands wait in a queue of at
+    most `max_queued` commands. If the queue is full, the command is
+    answered with an error. Commands of the CONTROL lane are started
+    immediately, regardless of the limits.
+
+    Finished commands are reported by done callbacks, which means a finished
+    command costs O(1), regardless of the number of running commands. The
+    results can be fetched with pop_finished() after wait() returned. The
+    results of commands which were not executed (rejected or cancelled
+    before they started) are marked, so they are not mistaken for the result
+    of the command (for example by a cache).
+
+    ATTENTION!!! this class is not thread save.
+    """
+    MAX_RUNNING = 256
+    MAX_QUEUED = 1024
+
+    def __init__(self,
+                 max_running=MAX_RUNNING,
+                 max_queued=MAX_QUEUED,
+                 registry=RPC):
+        if max_running is not None and max_running < 1:
+            raise ValueError("The max_running has to be at least 1.")
+        if max_queued < 0:
+            raise ValueError("The max_queued must not be negative.")
+
+        self.max_running = max_running
+        self.max_queued = max_queued
+        self.__registry = registry
+        self.__running = dict()
+        self.__queued = OrderedDict()
+        self.__finished = deque()
+        self.__has_finished = asyncio.Event()
+
+    @property
+    def tasks(self):
+        """
+        Returns the tasks of the running commands.
+
+        Returns
+        -------
+            dict of asyncio.Task by command uuid
+        """
+        return self.__running
+
+    @property
+    def queued(self):
+        """
+        Returns the commands which wait for a free slot.
+
+        Returns
+        -------
+            OrderedDict of Command by command uuid
+        """
+        return self.__queued
+
+    def submit(self, cmd):
+        """
+        Starts or queues a command. A command with the uuid of a running or
+        queued command cancels that command.
+
+        Arguments
+        ---------
+            cmd: Command
+        """
+        if cmd.uuid in self.__running:
+            self.__running[cmd.uuid].cancel()
+            logging.debug('Canceled command %s.', cmd.method)
+
+        elif cmd.uuid in self.__queued:
+            del self.__queued[cmd.uuid]
+            logging.debug('Canceled queued command %s.', cmd.method)
+            self.finish(
+                cmd.uuid,
+                Status(Status.ID_ERR, {
+                    'method': cmd.method,
+                    'result': 'The command was cancelled before it started.',
+                }, cmd.uuid),
+                executed=False)
+
+        elif (self.max_running is None
+              or len(self.__running) < self.max_running
+              or self.__registry.lane(cmd.method) == CONTROL):
+            self.__start(cmd)
+
+        elif len(self.__queued) < self.max_queued:
+            self.__queued[cmd.uuid] = cmd
+            logging.debug('Queued command %s.', cmd.method)
+
+        else:
+            logging.warning('Rejected command %s.', cmd.method)
+            self.finish(
+                cmd.uuid,
+                Status(Status.ID_ERR, {
+                    'method':
+                    cmd.method,
+                    'result':
+                    'The client is busy ({} commands are running and {} are '
+                    'queued).'.format(len(self.__running), len(self.__queued)),
+                }, cmd.uuid),
+                executed=False)
+
+    def finish(self, uuid, result, executed=False):
+        """
+        Reports the result of a command without executing it (for example a
+        cached result).
+
+        Arguments
+        ---------
+            uuid: string
+            result: Status or None if the command was cancelled
+            executed: True if the result was returned by the command itself
+        """
+        self.__finished.append((uuid, result, executed))
+        self.__has_finished.set()
+
+    async def wait(self):
+        """
+        Waits until a command finished.
+        """
+        await self.__has_finished.wait()
+
+    def pop_finished(self):
+        """
+        Removes the oldest finished command.
+
+        Returns
+        -------
+            (uuid, Status or None if the command was cancelled, True if the
+            command was executed) or None if no command finished
+        """
+        if not self.__finished:
+            return None
+
+        finished = self.__finished.popleft()
+        if not self.__finished:
+            self.__has_finished.clear()
+        return finished
+
+    def __start(self, cmd):
+        task = asyncio.create_task(self.__registry.execute(cmd))
+        task.add_done_callback(functools.partial(self.__done, cmd.uuid))
+        self.__running[cmd.uuid] = task
+        logging.debug('Received command %s.', cmd.to_json())
+
+    def __done(self, uuid, task):
+        del self.__running[uuid]
+
+        if task.cancelled():
+            logging.debug('Command %s was cancelled.', uuid)
+            self.finish(uuid, None, executed=True)
+        else:
+            self.finish(uuid, task.result(), executed=True)
+
+        while self.__queued and (self.max_running is None
+                                 or len(self.__running) < self.max_running):
+            (_, cmd) = self.__queued.popitem(last=False)
+            self.__start(cmd)
+
+    def __contains__(self, uuid):
+        return uuid in self.__running or uuid in self.__queued
+
+    def __len__(self):
+        return len(self.__running) + len(self.__queued)
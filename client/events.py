@@ -0,0 +1,189 @@
+"""
+This module contains a class which pushes events to the master.
+"""
+import logging
+import threading
+import time
+
+import websockets
+
+from utils import Status
+
+
+class EventPublisher:
+    """
+    Pushes events of running commands to the master over the command
+    websocket of the receiver. An event is a Status with the uuid of the
+    command it belongs to. The payload contains the method name, the name of
+    the event and additional data, which allows the master to tell events
+    apart from results.
+    """
+
+    def __init__(self):
+        self.__receiver = None
+
+    @property
+    def receiver(self):
+        return self.__receiver
+
+    @receiver.setter
+    def receiver(self, receiver):
+        self.__receiver = receiver
+
+    async def push(self, uuid, method, event, data=None):
+        """
+        Sends an event to the master. If there is no open connection the event
+        is dropped.
+
+        Arguments
+        ---------
+            uuid: string
+                uuid of the command which emitted the event
+            method: string
+                name of the method which emitted the event
+            event: string
+                name of the event
+            data: object
+                any kind of serializable value
+
+        Returns
+        -------
+            True if the event was sent, False otherwise
+        """
+        session = None
+        if self.__receiver is not None:
+            session = self.__receiver.session
+
+        if session is None or not session.open:
+            logging.debug('No connection, dropped event %s of %s.', event,
+                          uuid)
+            return False
+
+        status = Status(
+            Status.ID_OK,
+            {
+                'method': method,
+                'event': event,
+                'data': data,
+            },
+            uuid,
+        )
+
+        try:
+            await session.send(status.to_json())
+        except websockets.exceptions.ConnectionClosed:
+            logging.debug('Connection closed, dropped event %s of %s.', event,
+                          uuid)
+            return False
+
+        return True
+
+
+# seconds between two progress events of a command
+PROGRESS_INTERVAL = 1.0
+
+
+class Progress:
+    """
+    Counts the work of a long running command in bytes and files and reports
+    it by calling send(data), at most once every `interval` seconds, so
+    counting stays cheap regardless of how often it is updated. The work is
+    usually done by several threads, all methods are thread-safe.
+
+    The reported data is a dict with the keys
+
+        bytes           bytes which were processed
+        total_bytes     bytes which are known to be processed
+        files           files which were processed
+        total_files     files which are known to be processed
+        throughput      bytes per second since the last report
+        eta             estimated seconds until the known work is done (None
+                        if nothing was processed since the last report)
+
+    The totals can grow while the command runs, for example if a file turns
+    out to be changed while a directory is synced.
+    """
+
+    def __init__(self, send, interval=None, clock=time.monotonic):
+        if interval is None:
+            interval = PROGRESS_INTERVAL
+
+        self.__send = send
+        self.__interval = interval
+        self.__clock = clock
+        self.__lock = threading.Lock()
+        self.__bytes = 0
+        self.__total_bytes = 0
+        self.__files = 0
+        self.__total_files = 0
+        self.__last_time = clock()
+        self.__last_bytes = 0
+
+    def add_total(self, size, files):
+        """
+        Adds work which has to be processed.
+
+        Arguments
+        ---------
+            size: number of bytes
+            files: number of files
+        """
+        with self.__lock:
+            self.__total_bytes += size
+            self.__total_files += files
+
+    def advance(self, size, files=0):
+        """
+        Adds work which was processed and reports the progress if the last
+        report is at least `interval` seconds old.
+
+        Arguments
+        ---------
+            size: number of bytes
+            files: number of files
+        """
+        with self.__lock:
+            self.__bytes += size
+            self.__files += files
+
+            now = self.__clock()
+            if now - self.__last_time >= self.__interval:
+                self.__report(now)
+
+    def finish(self):
+        """
+        Reports the progress regardless of the interval, after the command
+        has processed all its work.
+        """
+        with self.__lock:
+            self.__report(self.__clock())
+
+    def __report(self, now):
+        elapsed = now - self.__last_time
+        throughput = 0.0
+        if elapsed > 0:
+            throughput = (self.__bytes - self.__last_bytes) / elapsed
+
+        remaining = max(0, self.__total_bytes - self.__bytes)
+        if remaining == 0:
+            eta = 0.0
+        elif throughput > 0:
+            eta = remaining / throughput
+        else:
+            eta = None
+
+        self.__last_time = now
+        self.__last_bytes = self.__bytes
+
+        # called with the lock, so the reports stay in order
+        self.__send({
+            'bytes': self.__bytes,
+            'total_bytes': self.__total_bytes,
+            'files': self.__files,
+            'total_files': self.__total_files,
+            'throughput': throughput,
+            'eta': eta,
+        })
+
+
+EVENTS = EventPublisher()
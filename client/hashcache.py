@@ -0,0 +1,197 @@
+"""
+This module contains a persistent cache for the hashes of files.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+from client.cache import LruCache
+
+
+class HashCache:
+    """
+    Caches the hashes of files by (device, inode, size, mtime_ns, ctime_ns,
+    algorithm), so an unchanged file is only stat'ed. A file which was
+    changed gets a new ctime (even if the mtime is restored, for example by
+    `cp -p`) and therefore a new key, old keys are removed if the cache holds
+    more than `max_size` entries.
+
+    Files which were modified in the last `RACY_WINDOW` seconds are not
+    cached, because they can be modified again without changing the mtime on
+    file systems with a coarse timestamp resolution.
+
+    If a path is loaded, the cache is written to that path at most every
+    `sync_interval` seconds and on close(). The entries are written without
+    holding the lock of the cache, so the hashing threads are not blocked.
+    The file is replaced atomically, so a crash leaves the old state behind.
+
+    This class is thread safe.
+    """
+    MAX_SIZE = 100000
+    RACY_WINDOW = 2
+    VERSION = 2
+
+    def __init__(self, max_size=MAX_SIZE, sync_interval=10, clock=time.time):
+        self.__entries = LruCache(max_size)
+        self.__lock = threading.Lock()
+        self.__save_lock = threading.Lock()
+        self.__path = None
+        self.__sync_interval = sync_interval
+        self.__clock = clock
+        self.__last_save = clock()
+        self.__dirty = False
+
+    @property
+    def path(self):
+        return self.__path
+
+    @staticmethod
+    def key(stat, algorithm):
+        """
+        Returns the key of a file.
+
+        Arguments
+        ---------
+            stat: os.stat_result of the file
+            algorithm: name of the hash algorithm
+
+        Returns
+        -------
+            tuple
+        """
+        return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns,
+                stat.st_ctime_ns, algorithm)
+
+    def load(self, path, max_size=None):
+        """
+        Reads the entries from the given path (if the file exists) and writes
+        the cache to this path from now on.
+
+        Arguments
+        ---------
+            path: path of the cache file
+            max_size: maximum number of entries (default: unchanged)
+        """
+        with self.__lock:
+            if max_size is not None:
+                self.__entries = LruCache(max_size)
+            self.__path = path
+
+            if not os.path.isfile(path):
+                return
+
+            try:
+                with open(path) as cache_file:
+                    content = json.load(cache_file)
+                if content['version'] != self.VERSION:
+                    raise ValueError('unknown version')
+                for (dev, ino, size, mtime_ns, ctime_ns, algorithm,
+                     value) in content['entries']:
+                    self.__entries.put(
+                        (dev, ino, size, mtime_ns, ctime_ns, algorithm),
+                        value)
+            except (ValueError, KeyError, TypeError) as err:
+                # the cache is rebuild by the next hashes
+                logging.warning('Ignored invalid hash cache %s (%s).', path,
+                                err)
+                self.__entries.clear()
+
+    def get(self, stat, algorithm):
+        """
+        Returns the cached hash of a file.
+
+        Arguments
+        ---------
+            stat: os.stat_result of the file
+            algorithm: name of the hash algorithm
+
+        Returns
+        -------
+            hash string or None
+        """
+        with self.__lock:
+            return self.__entries.get(self.key(stat, algorithm))
+
+    def put(self, stat, algorithm, value):
+        """
+        Adds the hash of a file, unless the file was modified recently.
+
+        Arguments
+        ---------
+            stat: os.stat_result of the file before it was hashed
+            algorithm: name of the hash algorithm
+            value: hash string
+        """
+        now = self.__clock()
+        if now - stat.st_mtime_ns / 1e9 < self.RACY_WINDOW:
+            return
+        if stat.st_ino == 0:
+            # the file system has no stable inode numbers
+            return
+
+        with self.__lock:
+            self.__entries.put(self.key(stat, algorithm), value)
+            self.__dirty = True
+
+            due = (self.__path is not None
+                   and now - self.__last_save >= self.__sync_interval)
+            if due:
+                # the other threads do not start saving as well
+                self.__last_save = now
+
+        if due:
+            self.save()
+
+    def save(self):
+        """
+        Writes the cache to its path, if there are new entries.
+        """
+        with self.__save_lock:
+            with self.__lock:
+                self.__last_save = self.__clock()
+                if self.__path is None or not self.__dirty:
+                    return
+                path = self.__path
+                entries = [
+                    list(key) + [value]
+                    for (key, value) in self.__entries.items()
+                ]
+                self.__dirty = False
+
+            try:
+                with open(path + '.tmp', mode='w') as cache_file:
+                    json.dump({
+                        'version': self.VERSION,
+                        'entries': entries,
+                    }, cache_file)
+                    cache_file.flush()
+                    os.fsync(cache_file.fileno())
+                os.replace(path + '.tmp', path)
+            except OSError as err:
+                logging.warning('Could not write the hash cache %s (%s).',
+                                path, err)
+                with self.__lock:
+                    self.__dirty = True
+
+    def close(self):
+        """
+        Writes the cache to its path.
+        """
+        self.save()
+
+    def clear(self):
+        """
+        Removes all entries.
+        """
+        with self.__lock:
+            self.__entries.clear()
+            self.__dirty = True
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.__entries)
+
+
+HASH_CACHE = HashCache()
@@ -0,0 +1,135 @@
+"""
+This module contains a monitor which collects health data of the client.
+"""
+import asyncio
+import logging
+import os
+
+from collections import deque
+
+import psutil
+
+from client.logger import LOGGER
+from client.shorthand import COPIED_FILES
+from client.trash import TRASH
+
+
+class HealthMonitor:
+    """
+    Collects health data of the client. The event loop lag, the memory
+    usage, the number of open file descriptors and the load average are
+    sampled every `interval` seconds by run(), so report() is cheap. The
+    event loop lag is the time a sleep of the ticker took longer than
+    requested. The maximum lag is taken over the last `window` samples.
+    """
+
+    def __init__(self, interval=1, window=60):
+        self.interval = interval
+        self.__receiver = None
+        self.__process = psutil.Process()
+        self.__lags = deque(maxlen=window)
+        self.__sample = None
+
+    @property
+    def receiver(self):
+        return self.__receiver
+
+    @receiver.setter
+    def receiver(self, receiver):
+        self.__receiver = receiver
+
+    async def run(self):
+        """
+        Samples the health data every `interval` seconds until the task is
+        cancelled.
+        """
+        loop = asyncio.get_running_loop()
+
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.__lags.append(max(0, loop.time() - expected))
+            self.sample()
+
+    def sample(self):
+        """
+        Samples the health data of the process and the system.
+        """
+        try:
+            memory = self.__process.memory_info()
+            if os.name == 'nt':
+                open_fds = self.__process.num_handles()
+            else:
+                open_fds = self.__process.num_fds()
+        except psutil.Error as err:
+            logging.warning('Could not sample process health (%s).', err)
+            memory = None
+            open_fds = None
+
+        try:
+            load_average = list(os.getloadavg())
+        except (AttributeError, OSError):
+            # not available on Windows
+            load_average = None
+
+        self.__sample = {
+            'rss': memory.rss if memory is not None else None,
+            'open_fds': open_fds,
+            'load_average': load_average,
+        }
+
+    def report(self):
+        """
+        Returns the health data of the client.
+
+        Returns
+        -------
+            dict with the keys
+                loop_lag: last event loop lag in seconds (None if run() did
+                    not sample yet)
+                max_loop_lag: maximum event loop lag of the last samples
+                in_flight: number of running commands
+                running_programs: number of running programs
+                rss: resident memory of the client in bytes
+                open_fds: number of open file descriptors (handles on
+                    Windows)
+                load_average: load average of the last 1, 5 and 15 minutes
+                    (None on Windows)
+                log_queues: bytes which wait to be send to the master by
+                    program uuid
+                copied_files: number of files which were copied by
+                    filesystem_move by copy strategy
+                trash_pending: number of deletions in the trash which did not
+                    finish yet
+        """
+        if self.__sample is None:
+            self.sample()
+
+        if self.__receiver is not None:
+            in_flight = len(self.__receiver.tasks)
+        else:
+            in_flight = 0
+
+        programs = {
+            uuid: program_logger
+            for (uuid, program_logger) in LOGGER.program_loggers.items()
+            if not program_logger.finished
+        }
+
+        report = {
+            'loop_lag': self.__lags[-1] if self.__lags else None,
+            'max_loop_lag': max(self.__lags) if self.__lags else None,
+            'in_flight': in_flight,
+            'running_programs': len(programs),
+            'log_queues': {
+                uuid: program_logger.ws_buffer_size
+                for (uuid, program_logger) in programs.items()
+            },
+            'copied_files': dict(COPIED_FILES),
+            'trash_pending': TRASH.pending,
+        }
+        report.update(self.__sample)
+        return report
+
+
+HEALTH = HealthMonitor()
@@ -19,6 +19,8 @@ from shutil import rmtree
 
 from datetime import datetime
 
+from time import monotonic
+
 from utils import Status
 
 
@@ -95,13 +97,102 @@ class RotatingFile:
         self.__file.close()
 
 
+class TokenBucket:
+    """
+    Token bucket which limits a byte stream to `rate` bytes per second. Up to
+    `capacity` bytes can be consumed at once after an idle period.
+    """
+
+    def __init__(self, rate, capacity=None, clock=monotonic):
+        if rate <= 0:
+            raise ValueError("The rate has to be greater than zero.")
+
+        self.__rate = rate
+        self.__capacity = capacity if capacity is not None else rate
+        self.__clock = clock
+        self.__tokens = self.__capacity
+        self.__last = clock()
+
+    def __refill(self):
+        now = self.__clock()
+        self.__tokens = min(
+            self.__capacity,
+            self.__tokens + (now - self.__last) * self.__rate,
+        )
+        self.__last = now
+
+    def take(self, amount):
+        """
+        Takes up to `amount` tokens without going into debt.
+
+        Arguments
+        ---------
+            amount: integer
+                number of requested tokens (bytes)
+
+        Returns
+        -------
+            integer, the number of granted tokens
+        """
+        self.__refill()
+        granted = int(min(amount, max(self.__tokens, 0)))
+        self.__tokens -= granted
+        return granted
+
+    def consume(self, amount):
+        """
+        Consumes `amount` tokens even if the bucket goes into debt.
+
+        Arguments
+        ---------
+            amount: integer
+                number of consumed tokens (bytes)
+
+        Returns
+        -------
+            float, seconds the caller has to wait until the debt is paid
+        """
+        self.__refill()
+        self.__tokens -= amount
+        if self.__tokens < 0:
+            return -self.__tokens / self.__rate
+        return 0.0
+
+    @property
+    def rate(self):
+        return self.__rate
+
+    @property
+    def capacity(self):
+        return self.__capacity
+
+
 class ProgramLogger:
     """
     Class used for logging the output of a program which gets piped into
     '/applications/tee.py'.
+
+    If a rate limit (bytes per second) is given, the output is limited by a
+    TokenBucket. Depending on `overflow` the excess output is either dropped
+    and summarised in the log ('summarize') or the logger stops reading from
+    tee until the bucket is refilled, which blocks the producing program
+    through the pipe ('backpressure').
     """
+    READ_SIZE = 4096
+    OVERFLOW_MODES = ['summarize', 'backpressure']
+
+    def __init__(self,
+                 pid_on_master,
+                 path,
+                 port,
+                 max_file_size,
+                 url,
+                 rate_limit=None,
+                 overflow='summarize'):
+        if overflow not in self.OVERFLOW_MODES:
+            raise ValueError("The overflow has to be one of {}".format(
+                self.OVERFLOW_MODES))
 
-    def __init__(self, pid_on_master, path, port, max_file_size, url):
         self.__port = port
         self.__pid = 0
         self.__pid_on_master = pid_on_master
@@ -109,69 +200,148 @@ class ProgramLogger:
 
         self.__log_file = RotatingFile(path, max_file_size)
 
+        if rate_limit:
+            # allow bursts of one second worth of output
+            self.__bucket = TokenBucket(rate_limit)
+        else:
+            self.__bucket = None
+        self.__overflow = overflow
+        self.__suppressed = 0
+
         self.__ws_connection = None
         self.__ws_buffer = b''
-        self.__ws_buffer_has_content = Event(loop=asyncio.get_event_loop())
+        self.__ws_buffer_has_content = Event()
         self.__ws_finished = False
         self.__lock = Lock()
 
-    @asyncio.coroutine
-    def run(self):
+        self.__connection_closed = Event()
+        self.__finished = Event()
+
+    async def run(self, restartable=False):
         """
-        Handles one connection with an instance of '/applications/tee.py' on
+        Handles connections with an instance of '/applications/tee.py' on
         'self.__port'. The data send by tee gets written to a RotatingFile.
         If remote logging is enabled the sending thread gets notified when new
         data arrives.
+
+        Arguments
+        ---------
+            restartable: bool
+                If False the logger finishes after the first connection was
+                closed. Otherwise it keeps listening, so a restarted program
+                logs into the same file, until finish() is called.
         """
-        finished = Event(loop=asyncio.get_event_loop())
 
-        @asyncio.coroutine
-        def handle_connection(reader, writer):
-            pid = yield from reader.readline()
+        async def handle_connection(reader, writer):
+            pid = await reader.readline()
             self.__pid = int(pid)
 
             while not reader.at_eof():
-                buffer = yield from reader.read(1)
-                with self.__lock:
-                    self.__log_file.write(buffer)
-                    if self.__ws_connection:
-                        self.__ws_buffer += buffer
-                        self.__ws_buffer_has_content.set()
+                buffer = await reader.read(self.READ_SIZE)
 
-            self.__ws_finished = True
-            self.__log_file.close()
+                if self.__bucket is not None:
+                    if self.__overflow == 'backpressure':
+                        delay = self.__bucket.consume(len(buffer))
+                        if delay:
+                            await asyncio.sleep(delay)
+                    else:
+                        buffer = self.__limit(buffer)
+
+                self.__write(buffer)
+
+            self.__write(self.__summary())
             writer.close()
-            finished.set()
+            self.__connection_closed.set()
 
-        server_coroutine = asyncio.start_server(
+            if not restartable:
+                self.finish()
+
+        server = await asyncio.start_server(
             handle_connection,
             '127.0.0.1',
             self.__port,
-            loop=asyncio.get_event_loop(),
         )
-        server = yield from asyncio.get_event_loop().create_task(
-            server_coroutine)
-        yield from finished.wait()
+        await self.__finished.wait()
         server.close()
-        yield from server.wait_closed()
+        await server.wait_closed()
+
+    def expect_connection(self):
+        """
+        Resets wait_connection_closed() before a new instance of tee connects.
+        """
+        self.__connection_closed.clear()
+
+    async def wait_connection_closed(self):
+        """
+        Waits until the current connection with tee was closed.
+        """
+        await self.__connection_closed.wait()
+
+    def finish(self):
+        """
+        Closes the log file and stops the server started by run().
+        """
+        with self.__lock:
+            self.__ws_finished = True
+            self.__log_file.close()
+        self.__ws_buffer_has_content.set()
+        self.__connection_closed.set()
+        self.__finished.set()
+
+    def __limit(self, buffer):
+        """
+        Drops the part of the buffer which exceeds the rate limit. If output
+        was dropped before and the limit allows writing again, a summary of
+        the dropped output is put in front of the buffer.
+        """
+        granted = self.__bucket.take(len(buffer))
+        if granted < len(buffer):
+            self.__suppressed += len(buffer) - granted
+            return buffer[:granted]
+        return self.__summary() + buffer
+
+    def __summary(self):
+        """
+        Returns a message which states how many bytes were suppressed since
+        the last summary and resets the counter.
+        """
+        if not self.__suppressed:
+            return b''
+
+        message = '\n[{} bytes suppressed]\n'.format(self.__suppressed)
+        self.__suppressed = 0
+        return message.encode()
 
-    @asyncio.coroutine
-    def enable_remote(self):
+    def __write(self, buffer):
+        """
+        Writes the buffer to the log file and (if enabled) to the websocket
+        buffer.
+        """
+        if not buffer:
+            return
+
+        with self.__lock:
+            self.__log_file.write(buffer)
+            if self.__ws_connection:
+                self.__ws_buffer += buffer
+                self.__ws_buffer_has_content.set()
+
+    async def enable_remote(self):
         """
         Enables remote logging to the websocket located on 'self.__url'. First
         the existing log gets send, then updates follow on every request
         (an empty message)by the receiver.
         """
         with self.__lock:
-            self.__ws_connection = yield from websockets.connect(self.__url)
+            self.__ws_connection = await websockets.connect(self.__url)
             log = self.__log_file.read()
             msg = {'log': log.decode(), 'pid': self.__pid_on_master}
 
-        yield from self.__ws_connection.send(Status.ok(msg).to_json())
-        yield from self.__ws_connection.recv()
+        await self.__ws_connection.send(Status.ok(msg).to_json())
+        await self.__ws_connection.recv()
 
         while True:
-            yield from self.__ws_buffer_has_content.wait()
+            await self.__ws_buffer_has_content.wait()
 
             with self.__lock:
                 msg = {
@@ -182,8 +352,8 @@ class ProgramLogger:
                 self.__ws_buffer_has_content.clear()
 
             try:
-                yield from self.__ws_connection.send(Status.ok(msg).to_json())
-                yield from self.__ws_connection.recv()
+                await self.__ws_connection.send(Status.ok(msg).to_json())
+                await self.__ws_connection.recv()
             except websockets.exceptions.ConnectionClosed:
                 break
 
@@ -195,15 +365,14 @@ class ProgramLogger:
             if self.__ws_finished:
                 self.__ws_buffer_has_content.set()
 
-    @asyncio.coroutine
-    def disable_remote(self):
+    async def disable_remote(self):
         """
         Instantly disables remote logging.
         """
         with self.__lock:
             self.__ws_buffer = b''
             self.__ws_buffer_has_content.clear()
-            yield from self.__ws_connection.close()
+            await self.__ws_connection.close()
 
     def get_log(self):
         """
@@ -229,6 +398,20 @@ class ProgramLogger:
     def port(self):
         return self.__port
 
+    @property
+    def finished(self):
+        """
+        Returns True if finish() was called.
+        """
+        return self.__finished.is_set()
+
+    @property
+    def ws_buffer_size(self):
+        """
+        Returns the number of bytes which wait to be send to the master.
+        """
+        return len(self.__ws_buffer)
+
 
 class ClientLogger:
     """
@@ -256,11 +439,20 @@ class ClientLogger:
         self.__stream_ch = None
         self.__program_loggers = dict()
         self.__url = None
+        # the output is not limited unless a rate limit is set
+        self.__rate_limit = 0
+        self.__overflow = 'summarize'
 
         if not isdir(join(getcwd(), 'logs')):
             mkdir('logs')
 
-    def add_program_logger(self, pid, uuid, file_name, max_file_size):
+    def add_program_logger(self,
+                           pid,
+                           uuid,
+                           file_name,
+                           max_file_size,
+                           rate_limit=None,
+                           overflow=None):
         """
         adds a new program logger
 
@@ -274,7 +466,17 @@ class ClientLogger:
                 name of the now created log file
             max_file_size: integer
                 maximum size of the log file in bytes
+            rate_limit: integer
+                maximum output in bytes per second, 0 disables the limit
+                (default: self.rate_limit)
+            overflow: string
+                'summarize' or 'backpressure' (default: self.overflow)
         """
+        if rate_limit is None:
+            rate_limit = self.__rate_limit
+        if overflow is None:
+            overflow = self.__overflow
+
         while True:
             try:
                 port = randrange(49152, 65535)
@@ -284,10 +486,12 @@ class ClientLogger:
                     port,
                     max_file_size,
                     self.__url,
+                    rate_limit,
+                    overflow,
                 )
                 break
             except OSError as err:
-                if err.errno is 98:  # port allready in use
+                if err.errno == 98:  # port allready in use
                     pass
                 else:
                     raise err
@@ -300,6 +504,25 @@ class ClientLogger:
     def url(self, url):
         self.__url = url
 
+    @property
+    def rate_limit(self):
+        return self.__rate_limit
+
+    @rate_limit.setter
+    def rate_limit(self, rate_limit):
+        self.__rate_limit = rate_limit
+
+    @property
+    def overflow(self):
+        return self.__overflow
+
+    @overflow.setter
+    def overflow(self, overflow):
+        if overflow not in ProgramLogger.OVERFLOW_MODES:
+            raise ValueError("The overflow has to be one of {}".format(
+                ProgramLogger.OVERFLOW_MODES))
+        self.__overflow = overflow
+
     @property
     def program_loggers(self):
         return self.__program_loggers
@@ -0,0 +1,169 @@
+"""
+This module contains a journal for results which were not acknowledged by the
+master yet.
+"""
+import asyncio
+import json
+import logging
+
+from collections import OrderedDict
+from os import fsync, replace
+from os.path import isfile
+
+
+class Outbox:
+    """
+    Append-only journal of results (Status as dict) which were not
+    acknowledged by the master. Every result is appended to the journal before
+    it is send. If the master acknowledges results, an acknowledgement is
+    appended and the results are removed from the outbox.
+
+    The journal is written in lines of json. Writes are buffered and synced
+    to the disk at most every `sync_interval` seconds, which means results of
+    the last interval can get lost if the client crashes. Outside of a
+    running event loop every entry is synced at once. After
+    `compact_threshold` acknowledged results the journal is rewritten with
+    only the pending results.
+
+    ATTENTION!!! this class is not thread save.
+    """
+    COMPACT_THRESHOLD = 100
+
+    def __init__(self,
+                 path,
+                 sync_interval=0.1,
+                 compact_threshold=COMPACT_THRESHOLD):
+        self.__path = path
+        self.__sync_interval = sync_interval
+        self.__compact_threshold = compact_threshold
+        self.__pending = OrderedDict()
+        self.__acknowledged = 0
+        self.__sync_handle = None
+        self.__file = None
+
+        if isfile(path):
+            self.__load()
+            self.compact()
+
+        self.__file = open(path, mode='a')
+
+    def __load(self):
+        """
+        Reads the pending results from the journal.
+        """
+        with open(self.__path) as journal:
+            for line in journal:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # a line which was written partly before a crash
+                    logging.warning('Skipped invalid line in outbox %s.',
+                                    self.__path)
+                    continue
+
+                if 'result' in entry:
+                    result = entry['result']
+                    self.__pending.pop(result['uuid'], None)
+                    self.__pending[result['uuid']] = result
+                elif 'ack' in entry:
+                    for uuid in entry['ack']:
+                        self.__pending.pop(uuid, None)
+
+    def __write(self, entry):
+        self.__file.write(json.dumps(entry) + '\n')
+
+        if self.__sync_handle is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                # there is no loop which could sync later
+                self.sync()
+                return
+            self.__sync_handle = loop.call_later(self.__sync_interval,
+                                                 self.sync)
+
+    def append(self, result):
+        """
+        Adds a result to the outbox.
+
+        Arguments
+        ---------
+            result: dict
+                a Status as dictionary
+        """
+        self.__pending.pop(result['uuid'], None)
+        self.__pending[result['uuid']] = result
+        self.__write({'result': result})
+
+    def acknowledge(self, uuids):
+        """
+        Removes the results with the given uuids from the outbox.
+
+        Arguments
+        ---------
+            uuids: list of strings
+        """
+        removed = [uuid for uuid in uuids if uuid in self.__pending]
+        if not removed:
+            return
+
+        for uuid in removed:
+            del self.__pending[uuid]
+        self.__write({'ack': removed})
+
+        self.__acknowledged += len(removed)
+        if self.__acknowledged >= self.__compact_threshold:
+            self.compact()
+
+    def pending(self):
+        """
+        Returns the results which were not acknowledged, in the order they
+        were added.
+
+        Returns
+        -------
+            list of dict
+        """
+        return list(self.__pending.values())
+
+    def sync(self):
+        """
+        Writes all buffered entries to the disk.
+        """
+        if self.__sync_handle is not None:
+            self.__sync_handle.cancel()
+            self.__sync_handle = None
+
+        if not self.__file.closed:
+            self.__file.flush()
+            fsync(self.__file.fileno())
+
+    def compact(self):
+        """
+        Rewrites the journal with the pending results only.
+        """
+        reopen = self.__file is not None and not self.__file.closed
+        if reopen:
+            self.sync()
+            self.__file.close()
+
+        with open(self.__path + '.tmp', mode='w') as journal:
+            for result in self.__pending.values():
+                journal.write(json.dumps({'result': result}) + '\n')
+            journal.flush()
+            fsync(journal.fileno())
+        replace(self.__path + '.tmp', self.__path)
+        self.__acknowledged = 0
+
+        if reopen:
+            self.__file = open(self.__path, mode='a')
+
+    def close(self):
+        """
+        Syncs and closes the journal.
+        """
+        self.sync()
+        self.__file.close()
+
+    def __len__(self):
+        return len(self.__pending)
@@ -0,0 +1,509 @@
+"""
+This module contains the websocket client which receives the commands of the
+master and executes them.
+"""
+import asyncio
+import json
+import logging
+import random
+
+import websockets
+
+from utils import Command, Status, ProtocolError
+
+from client.cache import LruCache
+from client.dispatcher import Dispatcher
+from client.rpc import check_timeout
+
+
+class RpcReceiver:
+    """
+    Represents a client which connects via websockets to a websocket server.
+    This client receives commands and executes the methods of the RPC
+    registry. Every command is executed in its own task by a Dispatcher,
+    which allows long running commands (for example sub processes) without
+    blocking the receiver. At most `max_running` commands run at the same
+    time and at most `max_queued` commands wait, further commands are
+    answered with an error. The result of every command is send back as a
+    Status with the uuid of the command. A command with the uuid of a running
+    command cancels the running command.
+
+    The master can send a list of commands in one message. The results of
+    these commands are send in lists as well (see serve()).
+
+    If the connection is lost, the receiver reconnects with an exponential
+    backoff (with jitter) until close() is called. A connection attempt whose
+    opening handshake does not finish within `open_timeout` seconds counts as
+    failed. Running commands are not affected by a lost connection, their
+    results are send after the connection was established again.
+
+    If an Outbox is given, every result is written to the outbox before it
+    is send. The master acknowledges results with a message
+    `{"ack": [uuid, ...]}`. All results which were not acknowledged are send
+    again (in order) after a reconnect or a restart of the client.
+
+    The results of the last `cache_size` commands are kept for `cache_ttl`
+    seconds. If the master sends a command with the uuid of a finished
+    command again (for example after a timeout), the cached result is send
+    instead of executing the command a second time. Commands which were not
+    executed (because the client was busy or they were cancelled before they
+    started) are not cached.
+    """
+    MAX_BATCH_SIZE = 100
+
+    def __init__(self,
+                 url,
+                 batch_window=0.005,
+                 reconnect_delay=0.1,
+                 max_reconnect_delay=30,
+                 outbox=None,
+                 cache_size=1000,
+                 cache_ttl=3600,
+                 open_timeout=10,
+                 max_running=Dispatcher.MAX_RUNNING,
+                 max_queued=Dispatcher.MAX_QUEUED):
+        self._url = url
+        self.outbox = outbox
+        self.results = LruCache(cache_size, cache_ttl)
+        self.dispatcher = Dispatcher(max_running, max_queued)
+        self.batch_window = batch_window
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.open_timeout = open_timeout
+
+        self._session = None
+        self._batched = set()
+        self._batch = []
+        self._unsent = []
+        self._connections = 0
+        self.closed = False
+
+    @property
+    def url(self):
+        """
+        Returns the URL where the results are send to and where the commands
+        are received from.
+
+        Returns
+        -------
+            string
+        """
+        return self._url
+
+    @property
+    def session(self):
+        """
+        Returns the current session.
+
+        Returns
+        -------
+            websocket.Session
+        """
+        return self._session
+
+    @property
+    def tasks(self):
+        """
+        Returns the tasks of the running commands.
+
+        Returns
+        -------
+            dict of asyncio.Task by command uuid
+        """
+        return self.dispatcher.tasks
+
+    def close(self):
+        """
+        Closes all connections and stops reconnecting.
+        """
+        logging.debug("Got close call ... closing connection.")
+        self.closed = True
+        if self.session is not None:
+            asyncio.create_task(self.session.close())
+
+    def handle_message(self, message):
+        """
+        Parses a message and starts a task for every command in it. A message
+        with the uuid of a running command cancels the running command. A
+        message with the uuid of a finished command is answered with the
+        cached result. An invalid command does not affect the other commands
+        of its message, it is answered with an error if it has a uuid and
+        dropped otherwise.
+
+        Arguments
+        ---------
+            message: json encoded command or list of commands
+        """
+        try:
+            data = json.loads(message)
+
+            if isinstance(data, dict) and 'ack' in data:
+                if self.outbox is not None:
+                    self.outbox.acknowledge(data['ack'])
+                return
+
+            (commands, invalid, batched) = split_commands(data)
+        except Exception as err:  #pylint: disable=W0703
+            logging.error('Dropped invalid message %s (%s)', message, err)
+            return
+
+        for (entry, err) in invalid:
+            if not isinstance(entry, dict):
+                logging.error('Dropped invalid command %s (%s)', entry, err)
+                continue
+
+            uuid = entry.get(Command.ID_UUID)
+            if not isinstance(uuid, str) or uuid in self.dispatcher:
+                logging.error('Dropped invalid command %s (%s)', entry, err)
+                continue
+
+            logging.error('Rejected invalid command %s (%s)', entry, err)
+            if batched:
+                self._batched.add(uuid)
+
+            method = entry.get(Command.ID_METHOD)
+            self.dispatcher.finish(
+                uuid,
+                Status(Status.ID_ERR, {
+                    'method': method if isinstance(method, str) else None,
+                    'result': str(err),
+                }, uuid))
+
+        for cmd in commands:
+            if cmd.uuid in self.dispatcher:
+                # cancels the command
+                self.dispatcher.submit(cmd)
+                continue
+
+            if batched:
+                self._batched.add(cmd.uuid)
+
+            cached = self.results.get(cmd.uuid)
+            if cached is not None:
+                # answered by serve() like every other finished command
+                self.dispatcher.finish(cmd.uuid, cached)
+                logging.debug('Answered command %s from cache.', cmd.uuid)
+            else:
+                self.dispatcher.submit(cmd)
+
+    async def send(self, message):
+        """
+        Sends a message to the master. If the connection is lost while
+        sending, the message is kept and send again after reconnecting.
+
+        Arguments
+        ---------
+            message: string
+        """
+        try:
+            await self.session.send(message)
+        except websockets.exceptions.ConnectionClosed:
+            self._unsent.append(message)
+            raise
+
+    async def send_results(self, results, batched):
+        """
+        Writes the results to the outbox (if there is one) and sends them to
+        the master.
+
+        Arguments
+        ---------
+            results: list of Status
+            batched: if True the results are send as a list, otherwise only
+                one result is allowed
+        """
+        results = [dict(result) for result in results]
+
+        if self.outbox is not None:
+            for result in results:
+                self.outbox.append(result)
+
+        if batched:
+            message = json.dumps(results)
+        else:
+            message = json.dumps(results[0])
+
+        try:
+            await self.session.send(message)
+        except websockets.exceptions.ConnectionClosed:
+            # the outbox sends the results again after reconnecting
+            if self.outbox is None:
+                self._unsent.append(message)
+            raise
+
+    async def run(self):
+        """
+        Connects to the master and serves the connection. If the connection
+        can not be established or gets lost, the receiver tries again after a
+        delay, which starts with `reconnect_delay` and doubles (up to
+        `max_reconnect_delay`) with every failed attempt. A random jitter
+        prevents all clients from reconnecting at the same time. After a
+        reconnect the client announces itself with a 'connected' event.
+        """
+        delay = self.reconnect_delay
+
+        while not self.closed:
+            try:
+                self._session = await websockets.connect(
+                    self.url, open_timeout=self.open_timeout)
+            except (OSError, asyncio.TimeoutError,
+                    websockets.exceptions.InvalidHandshake) as err:
+                wait = random.uniform(delay / 2, delay)
+                logging.info('Could not connect to %s (%s), retry in %.2fs.',
+                             self.url, err, wait)
+                await asyncio.sleep(wait)
+                delay = min(delay * 2, self.max_reconnect_delay)
+                continue
+
+            logging.debug("Opened session on %s.", self.url)
+            delay = self.reconnect_delay
+            self._connections += 1
+
+            try:
+                if self._connections > 1:
+                    await self.announce()
+                await self.serve()
+            except websockets.exceptions.ConnectionClosed as err:
+                logging.error('failed to send/receive message \n%s', str(err))
+            finally:
+                logging.debug("Closing connections.")
+                try:
+                    await self.session.close()
+                except websockets.exceptions.InvalidState:
+                    # the session is already closing (for example by close())
+                    pass
+
+    async def announce(self):
+        """
+        Pushes a 'connected' event with the uuids of all running commands to
+        the master.
+        """
+        status = Status(
+            Status.ID_OK,
+            {
+                'method': 'online',
+                'event': 'connected',
+                'data': {
+                    'running': list(self.tasks),
+                },
+            },
+        )
+        await self.send(status.to_json())
+
+    async def serve(self):
+        """
+        Listens on the receiver socket and executes the incoming commands. If
+        an execution fails a Status.err(...) with the exception is written to
+        the socket. Messages which are no valid commands are logged and
+        dropped.
+
+        A message can contain a list of commands, which are executed
+        concurrently. The results of those commands which finish within
+        `batch_window` seconds of each other are send together as a list of
+        Status. Single commands are answered with a single Status.
+
+        Returns if the connection was closed.
+        """
+        if self.outbox is not None:
+            for result in self.outbox.pending():
+                await self.session.send(json.dumps(result))
+
+        while self._unsent:
+            await self.send(self._unsent.pop(0))
+
+        receive = asyncio.create_task(self.session.recv())
+        finished = asyncio.create_task(self.dispatcher.wait())
+        flush = None
+
+        try:
+            while not self.closed:
+                logging.debug("Listen on command channel.")
+
+                waiting = {receive, finished}
+                if flush is not None:
+                    waiting.add(flush)
+
+                await asyncio.wait(
+                    waiting, return_when=asyncio.FIRST_COMPLETED)
+
+                if receive.done():
+                    self.handle_message(receive.result())
+                    receive = asyncio.create_task(self.session.recv())
+
+                if flush is not None and flush.done():
+                    flush = None
+                    if self._batch:
+                        batch = self._batch
+                        self._batch = []
+                        await self.send_results(batch, True)
+
+                if not finished.done():
+                    continue
+                finished = asyncio.create_task(self.dispatcher.wait())
+
+                while True:
+                    entry = self.dispatcher.pop_finished()
+                    if entry is None:
+                        break
+                    (uuid, result, executed) = entry
+
+                    if result is None:
+                        # cancelled while it was running
+                        self._batched.discard(uuid)
+                        continue
+
+                    # a rejected command is executed if the master retries
+                    if executed:
+                        self.results.put(uuid, result)
+
+                    if uuid in self._batched:
+                        self._batched.discard(uuid)
+                        self._batch.append(result)
+
+                        if len(self._batch) >= self.MAX_BATCH_SIZE:
+                            batch = self._batch
+                            self._batch = []
+                            await self.send_results(batch, True)
+                        elif flush is None:
+                            flush = asyncio.create_task(
+                                asyncio.sleep(self.batch_window))
+
+                    else:
+                        await self.send_results([result], False)
+        finally:
+            receive.cancel()
+            finished.cancel()
+            if flush is not None:
+                flush.cancel()
+            # results of this batch must not get lost on a reconnect
+            if self._batch:
+                if self.outbox is not None:
+                    for result in self._batch:
+                        self.outbox.append(dict(result))
+                else:
+                    self._unsent.append(
+                        json.dumps([dict(result) for result in self._batch]))
+                self._batch = []
+
+
+ID_TIMEOUT = 'timeout'
+
+
+def command_from_dict(data):
+    """
+    Maps a decoded json object to a valid command (like Command.from_json).
+    The optional key 'timeout' (seconds) is stored as `timeout` attribute of
+    the command.
+
+    Arguments
+    ---------
+        data: dict
+
+    Returns
+    -------
+        Command
+
+    Exception
+    ---------
+        ProtocolError when a key is not found or an entry has a wrong type.
+    """
+    if not isinstance(data, dict):
+        raise ProtocolError("A command has to be a dictionary.")
+
+    try:
+        if not isinstance(data[Command.ID_ARGUMENTS], dict):
+            raise ProtocolError("Args has to be a dictionary.")
+
+        if not isinstance(data[Command.ID_METHOD], str):
+            raise ProtocolError("Method has to be a string.")
+
+        if not isinstance(data[Command.ID_UUID], str):
+            raise ProtocolError("UUID has to be a string.")
+
+        try:
+            timeout = check_timeout(data.get(ID_TIMEOUT))
+        except ValueError:
+            raise ProtocolError("Timeout has to be a positive number.")
+
+        cmd = Command(
+            data[Command.ID_METHOD],
+            uuid=data[Command.ID_UUID],
+            **data[Command.ID_ARGUMENTS])
+        cmd.timeout = timeout
+        return cmd
+    except KeyError as err:
+        raise ProtocolError(
+            "The given json object has (a) missing key(s). ({})".format(
+                err.args[0]))
+
+
+def parse_commands(message):
+    """
+    Parses a message which contains a single command or a list of commands.
+
+    Arguments
+    ---------
+        message: json string
+
+    Returns
+    -------
+        (list of Command, True if the message was a list)
+
+    Exception
+    ---------
+        ProtocolError if the message or one of its commands is invalid.
+    """
+    return commands_from_data(json.loads(message))
+
+
+def commands_from_data(data):
+    """
+    Maps a decoded message which contains a single command or a list of
+    commands to commands.
+
+    Arguments
+    ---------
+        data: dict or list of dicts
+
+    Returns
+    -------
+        (list of Command, True if the message was a list)
+
+    Exception
+    ---------
+        ProtocolError if the message or one of its commands is invalid.
+    """
+    (commands, invalid, batched) = split_commands(data)
+    if invalid:
+        raise invalid[0][1]
+
+    return (commands, batched)
+
+
+def split_commands(data):
+    """
+    Maps a decoded message which contains a single command or a list of
+    commands to commands. Unlike commands_from_data, every entry is
+    validated on its own, so one invalid entry does not drop the valid
+    ones.
+
+    Arguments
+    ---------
+        data: dict or list of dicts
+
+    Returns
+    -------
+        (list of Command, list of (invalid entry, ProtocolError), True if the
+        message was a list)
+    """
+    batched = isinstance(data, list)
+    commands = []
+    invalid = []
+
+    for entry in data if batched else [data]:
+        try:
+            commands.append(command_from_dict(entry))
+        except ProtocolError as err:
+            invalid.append((entry, err))
+
+    return (commands, invalid, batched)
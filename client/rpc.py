@@ -0,0 +1,582 @@
+"""
+This module contains the registry of all rpc methods of the client.
+
+Every method is registered under its name in a dictionary. The arguments of a
+method are checked against the annotations of its signature. The checks are
+compiled once while registering, which makes dispatching and checking cheap.
+
+The following annotations are supported:
+
+    type            the argument has to be an instance of the type
+    (type, ...)     the argument has to be an instance of one of the types
+    [annotation]    the argument has to be a list and every element has to
+                    match the annotation
+    OneOf(...)      the argument has to be one of the given values
+
+If the default value of a parameter is None, None is accepted as well.
+
+Every method belongs to a lane:
+
+    CONTROL         cheap methods which are never queued by the dispatcher
+                    (for example online), the master relies on their latency
+    DEFAULT         coroutine functions which are executed on the event loop
+    other lanes     blocking functions which are executed by the bounded
+                    thread pool of the lane (see RpcRegistry.add_lane), so
+                    they do not block the event loop
+
+A command can have a timeout (in seconds), otherwise the default timeout of
+its method is used (see RpcRegistry.set_timeout). If the timeout expires, the
+command is cancelled and answered with an error. A thread can not be
+cancelled, so blocking functions have to call RpcRegistry.checkpoint()
+regularly, which raises Cancelled after the command was cancelled. Blocking
+functions can schedule coroutines on the event loop with
+RpcRegistry.run_coroutine(), for example to push events.
+"""
+
+import asyncio
+import contextvars
+import functools
+import inspect
+import logging
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+
+from utils import ProtocolError, Status
+
+
+class OneOf:
+    """
+    Annotation which only allows the given values.
+    """
+
+    def __init__(self, *values):
+        self.values = values
+
+    def __repr__(self):
+        return 'OneOf{}'.format(self.values)
+
+
+def compile_check(name, annotation):
+    """
+    Creates a function which checks a value against an annotation.
+
+    Arguments
+    ---------
+        name: name of the parameter (used in error messages)
+        annotation: see module documentation
+
+    Returns
+    -------
+        A function which takes a value and raises a ValueError if the value
+        does not match the annotation.
+
+    Exception
+    ---------
+        ValueError if the annotation is not supported
+    """
+    if isinstance(annotation, type):
+        annotation = (annotation, )
+
+    if isinstance(annotation, tuple):
+        for ty in annotation:
+            if not isinstance(ty, type):
+                raise ValueError(
+                    "The annotation of {} contains {} which is not a type.".
+                    format(name, ty))
+
+        expected = ' or '.join(map(lambda ty: ty.__name__, annotation))
+
+        def check_type(value):
+            if not isinstance(value, annotation):
+                raise ValueError("{} has to be {}. (found {})".format(
+                    name,
+                    expected,
+                    type(value).__name__,
+                ))
+
+        return check_type
+
+    elif isinstance(annotation, list) and len(annotation) == 1:
+        check_element = compile_check('element in ' + name, annotation[0])
+
+        def check_list(value):
+            if not isinstance(value, list):
+                raise ValueError("{} has to be list. (found {})".format(
+                    name,
+                    type(value).__name__,
+                ))
+            for element in value:
+                check_element(element)
+
+        return check_list
+
+    elif isinstance(annotation, OneOf):
+        values = annotation.values
+
+        def check_one_of(value):
+            if value not in values:
+                raise ValueError("{} has to be one of {}. (found {})".format(
+                    name,
+                    list(values),
+                    value,
+                ))
+
+        return check_one_of
+
+    raise ValueError("The annotation {} of {} is not supported.".format(
+        annotation, name))
+
+
+def compile_validator(function):
+    """
+    Creates a function which checks the arguments of a call of the given
+    function against its annotations. Missing or unknown arguments are not
+    checked, because the call itself raises a TypeError for them.
+
+    Arguments
+    ---------
+        function: a function with annotations
+
+    Returns
+    -------
+        A function which takes a tuple of positional arguments and a dict of
+        keyword arguments and raises a ValueError if an argument does not
+        match.
+    """
+    checks = []
+
+    for (position, parameter) in enumerate(
+            inspect.signature(function).parameters.values()):
+        if parameter.annotation is inspect.Parameter.empty:
+            continue
+
+        checks.append((
+            parameter.name,
+            position,
+            parameter.default is None,
+            compile_check(parameter.name, parameter.annotation),
+        ))
+
+    def validate(args, kwargs):
+        for (name, position, nullable, check) in checks:
+            if name in kwargs:
+                value = kwargs[name]
+            elif position < len(args):
+                value = args[position]
+            else:
+                continue
+
+            if value is None and nullable:
+                continue
+
+            check(value)
+
+    return validate
+
+
+CONTROL = 'control'
+DEFAULT = 'default'
+
+# how long a cancelled command waits for its thread to reach a checkpoint
+CANCEL_GRACE_PERIOD = 5
+
+
+class Cancelled(Exception):
+    """
+    Raised by RpcRegistry.checkpoint() in a blocking function of a cancelled
+    command.
+    """
+
+
+class RpcRegistry:
+    """
+    Maps the names of rpc methods to their handlers.
+    """
+
+    def __init__(self):
+        self.__methods = dict()
+        self.__executors = dict()
+        self.__timeouts = dict()
+        self.__command = ContextVar('command', default=None)
+        self.__cancelled = ContextVar('cancelled', default=None)
+        self.__loop = ContextVar('loop', default=None)
+
+    def add_lane(self, lane, max_workers):
+        """
+        Creates a lane with a pool of `max_workers` threads. If the lane
+        exists, the pool is replaced (running functions finish in the old
+        pool).
+
+        Arguments
+        ---------
+            lane: name of the lane
+            max_workers: maximum number of functions of this lane which are
+                executed at the same time
+
+        Exception
+        ---------
+            ValueError if the lane is CONTROL or DEFAULT
+        """
+        if lane in (CONTROL, DEFAULT):
+            raise ValueError("The lane {} has no thread pool.".format(lane))
+
+        old = self.__executors.get(lane)
+        self.__executors[lane] = ThreadPoolExecutor(
+            max_workers, thread_name_prefix=lane)
+        if old is not None:
+            old.shutdown(wait=False)
+
+    def method(self, function=None, lane=DEFAULT):
+        """
+        Decorator which registers a function as an rpc method. The returned
+        coroutine function checks the arguments before the original function
+        is called. Functions of the lanes CONTROL and DEFAULT have to be
+        coroutine functions, functions of other lanes have to be blocking
+        functions which are executed by the thread pool of the lane.
+
+        Can be used as @RPC.method or @RPC.method(lane=...).
+
+        Exception
+        ---------
+            ValueError if the function does not fit the lane, a function with
+            the same name is already registered or an annotation is not
+            supported
+        """
+        if function is None:
+            return functools.partial(self.method, lane=lane)
+
+        if lane in (CONTROL, DEFAULT):
+            if not asyncio.iscoroutinefunction(function):
+                raise ValueError("Only coroutine functions are allowed.")
+        elif lane not in self.__executors:
+            raise ValueError("The lane {} does not exist.".format(lane))
+        elif asyncio.iscoroutinefunction(function):
+            raise ValueError(
+                "Coroutine functions are not allowed in the lane {}.".format(
+                    lane))
+
+        if function.__name__ in self.__methods:
+            raise ValueError("Only functions with unique names are allowed.")
+
+        validate = compile_validator(function)
+
+        if asyncio.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def handler(*args, **kwargs):
+                validate(args, kwargs)
+                return await function(*args, **kwargs)
+        else:
+
+            @functools.wraps(function)
+            async def handler(*args, **kwargs):
+                validate(args, kwargs)
+                return await self.__run_in_thread(lane, function, args,
+                                                  kwargs)
+
+        handler.validate = validate
+        handler.lane = lane
+        self.__methods[function.__name__] = handler
+        return handler
+
+    async def __run_in_thread(self, lane, function, args, kwargs):
+        """
+        Executes a blocking function in the thread pool of the lane. If the
+        task is cancelled, the function gets CANCEL_GRACE_PERIOD seconds to
+        reach a checkpoint.
+        """
+        cancelled = threading.Event()
+        loop = asyncio.get_running_loop()
+
+        def run():
+            self.__cancelled.set(cancelled)
+            self.__loop.set(loop)
+            return function(*args, **kwargs)
+
+        # the thread sees the current command as well
+        context = contextvars.copy_context()
+        future = loop.run_in_executor(self.__executors[lane], context.run,
+                                      run)
+
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            cancelled.set()
+            (_, pending) = await asyncio.wait({future},
+                                              timeout=CANCEL_GRACE_PERIOD)
+            if pending:
+                logging.warning('%s did not stop after it was cancelled.',
+                                function.__name__)
+            elif not future.cancelled() and future.exception() is not None:
+                if not isinstance(future.exception(), Cancelled):
+                    logging.info('%s raised %s after it was cancelled.',
+                                 function.__name__, future.exception())
+            raise
+
+    def checkpoint(self):
+        """
+        Checks if the command of the current thread was cancelled. Blocking
+        functions should call this regularly, for example between chunks of
+        a copy.
+
+        Exception
+        ---------
+            Cancelled if the command was cancelled
+        """
+        cancelled = self.__cancelled.get()
+        if cancelled is not None and cancelled.is_set():
+            raise Cancelled("The command was cancelled.")
+
+    def run_coroutine(self, coroutine):
+        """
+        Schedules a coroutine on the event loop from a blocking function,
+        without waiting for its result.
+
+        Arguments
+        ---------
+            coroutine: coroutine object
+
+        Returns
+        -------
+            concurrent.futures.Future of the result of the coroutine
+
+        Exception
+        ---------
+            RuntimeError if the current thread does not execute a blocking
+            function of a lane
+        """
+        loop = self.__loop.get()
+        if loop is None:
+            coroutine.close()
+            raise RuntimeError("No blocking function is executed.")
+        return asyncio.run_coroutine_threadsafe(coroutine, loop)
+
+    def set_timeout(self, name, timeout):
+        """
+        Sets the default timeout of a method.
+
+        Arguments
+        ---------
+            name: A function identifier
+            timeout: seconds or None for no timeout
+
+        Exception
+        ---------
+            ProtocolError if the function is unknown
+            ValueError if the timeout is not positive
+        """
+        self.get(name)
+
+        if timeout is None:
+            self.__timeouts.pop(name, None)
+        elif timeout <= 0:
+            raise ValueError("The timeout has to be positive.")
+        else:
+            self.__timeouts[name] = timeout
+
+    def timeout(self, cmd):
+        """
+        Returns the timeout of a command, which is the timeout of the command
+        itself or the default timeout of its method.
+
+        Arguments
+        ---------
+            cmd: Command
+
+        Returns
+        -------
+            seconds or None
+        """
+        timeout = getattr(cmd, 'timeout', None)
+        if timeout is None:
+            timeout = self.__timeouts.get(cmd.method)
+        return timeout
+
+    def lane(self, name):
+        """
+        Returns the lane of a method.
+
+        Arguments
+        ---------
+            name: A function identifier
+
+        Returns
+        -------
+            name of the lane (DEFAULT if the method is unknown)
+        """
+        handler = self.__methods.get(name) if isinstance(name, str) else None
+        return handler.lane if handler is not None else DEFAULT
+
+    def get(self, name):
+        """
+        Searches for a function in the registry.
+
+        Arguments
+        ---------
+            name: A function identifier
+
+        Returns
+        -------
+            The handler of the function with the given name.
+
+        Exception
+        ---------
+            ProtocolError if the function is unknown
+        """
+        try:
+            return self.__methods[name]
+        except (KeyError, TypeError):
+            raise ProtocolError("unknown function '{}'".format(name))
+
+    async def execute(self, cmd):
+        """
+        Executes a command and returns its result as a Status. Exceptions
+        (including unknown methods, invalid arguments and expired timeouts)
+        are returned as Status.err(...).
+
+        Arguments
+        ---------
+            cmd: Command
+
+        Returns
+        -------
+            Status
+        """
+        token = self.__command.set(cmd)
+
+        try:
+            handler = self.get(cmd.method)
+            timeout = self.timeout(cmd)
+            if timeout is None:
+                result = await handler(**cmd.arguments)
+            else:
+                result = await run_with_timeout(handler(**cmd.arguments),
+                                                timeout)
+            status_code = Status.ID_OK
+            logging.debug(
+                'method %s with args: %s returned %s.',
+                cmd.method,
+                cmd.arguments,
+                result,
+            )
+        except (Exception, asyncio.CancelledError) as err:  #pylint: disable=W0703
+            # a cancelled command is answered as well (CancelledError is no
+            # Exception since python 3.8)
+            result = str(err)
+            status_code = Status.ID_ERR
+            logging.info('Function raise Exception(%s)', result)
+        finally:
+            self.__command.reset(token)
+
+        return Status(status_code, {
+            'method': cmd.method,
+            'result': result
+        }, cmd.uuid)
+
+    def current_command(self):
+        """
+        Returns the command which is executed by execute() in the current
+        context (tasks started by a command inherit the command).
+
+        Returns
+        -------
+            Command or None if the current task does not execute a command
+        """
+        return self.__command.get()
+
+    def __contains__(self, name):
+        return name in self.__methods
+
+    def __iter__(self):
+        return iter(self.__methods.values())
+
+    def clear(self):
+        """
+        Removes all methods from the registry.
+        """
+        self.__methods.clear()
+
+
+def check_timeout(timeout):
+    """
+    Checks the timeout of a command.
+
+    Arguments
+    ---------
+        timeout: seconds or None for no timeout
+
+    Returns
+    -------
+        the timeout
+
+    Exception
+    ---------
+        ValueError if the timeout is not None and not a positive number
+    """
+    if timeout is not None and (isinstance(timeout, bool)
+                                or not isinstance(timeout, (int, float))
+                                or timeout <= 0):
+        raise ValueError("The timeout has to be a positive number.")
+    return timeout
+
+
+async def run_with_timeout(coroutine, timeout):
+    """
+    Runs a coroutine in its own task. If it does not finish within the
+    timeout, the task is cancelled. Unlike asyncio.wait_for, a timeout is
+    detected even if the coroutine handles the cancellation and returns.
+    If the caller is cancelled, the cancellation is passed on to the task
+    and its outcome is returned, like the coroutine would do without a
+    timeout.
+
+    Arguments
+    ---------
+        coroutine: a coroutine object
+        timeout: seconds
+
+    Returns
+    -------
+        the result of the coroutine
+
+    Exception
+    ---------
+        TimeoutError if the timeout expired
+        ValueError if the timeout is not a positive number (the coroutine is
+        not started)
+    """
+    try:
+        check_timeout(timeout)
+    except ValueError:
+        if asyncio.iscoroutine(coroutine):
+            coroutine.close()
+        raise
+
+    task = asyncio.ensure_future(coroutine)
+
+    try:
+        (done, _) = await asyncio.wait({task}, timeout=timeout)
+    except asyncio.CancelledError:
+        # the coroutine decides how a cancelled command is answered (for
+        # example with the exit code of a killed process)
+        task.cancel()
+        await asyncio.wait({task})
+        return task.result()
+    except BaseException:
+        # the task must not outlive the command (for example if it was
+        # cancelled)
+        task.cancel()
+        await asyncio.wait({task})
+        raise
+
+    if not done:
+        task.cancel()
+        await asyncio.wait({task})
+        raise TimeoutError(
+            "The command timed out after {} seconds.".format(timeout))
+
+    return task.result()
+
+
+RPC = RpcRegistry()
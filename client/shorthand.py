@@ -3,14 +3,101 @@ Some shorthand functions which will be used in command.py
 """
 
 import os
+import sys
+import contextvars
+import ctypes
 import hashlib
 import errno
+import json
+import logging
+import shutil
+import stat
+import threading
+
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, wait
+
+try:
+    import fcntl
+except ImportError:
+    # Windows
+    fcntl = None
 
-import utils.typecheck as uty
 import utils.path as up
 
+from client.hashcache import HASH_CACHE
+
 PATH_TYPE_SET = ['file', 'dir']
 
+# number of threads which hash the files of a directory
+HASH_WORKERS = min(8, os.cpu_count() or 1)
+# bytes which are read at once while hashing
+HASH_BUFFER_SIZE = 1 << 20
+
+# the hash algorithms which can be selected (all are available in hashlib)
+HASH_ALGORITHMS = ['md5', 'sha1', 'sha256', 'sha512', 'blake2b', 'blake2s']
+# the algorithm which is used if none is given
+HASH_ALGORITHM = 'md5'
+
+
+def check_hash_algorithm(algorithm):
+    """
+    Returns the given algorithm or HASH_ALGORITHM if it is None.
+
+    Exceptions
+    ----------
+        ValueError: if the algorithm is not in HASH_ALGORITHMS
+    """
+    if algorithm is None:
+        return HASH_ALGORITHM
+    if algorithm not in HASH_ALGORITHMS:
+        raise ValueError("The hash algorithm `{}` is not one of {}.".format(
+            algorithm, ', '.join(HASH_ALGORITHMS)))
+    return algorithm
+
+
+def format_hash(algorithm, digest):
+    """
+    Creates the hash string of a digest. The name of the algorithm is put in
+    front of the digest (for example `blake2b:...`), except for MD5, which
+    was the only algorithm of older clients.
+
+    Arguments
+    ---------
+        algorithm: name of the hash algorithm
+        digest: hex digest
+
+    Returns
+    -------
+        hash string
+    """
+    if algorithm == 'md5':
+        return digest
+    return '{}:{}'.format(algorithm, digest)
+
+
+def parse_hash(value):
+    """
+    Splits a hash string (see format_hash) into algorithm and digest.
+
+    Arguments
+    ---------
+        value: hash string
+
+    Returns
+    -------
+        (algorithm, digest)
+
+    Exceptions
+    ----------
+        ValueError: if the algorithm is not in HASH_ALGORITHMS
+    """
+    if ':' not in value:
+        return ('md5', value)
+
+    (algorithm, digest) = value.split(':', 1)
+    return (check_hash_algorithm(algorithm), digest)
+
 
 def escape_path(path):
     """
@@ -31,62 +118,996 @@ def escape_path(path):
         return path
 
 
-def hash_file(path):
+def hash_file(path,
+              checkpoint=None,
+              buffer_size=None,
+              algorithm=None,
+              progress=None):
     """
-    Generates a hash string from a given file.
+    Generates a hash string from a given file. The hash of an unchanged file
+    is taken from the HASH_CACHE.
 
     Parameters
     ----------
         path: str
             A path to a file.
+        checkpoint: function
+            Called before every read (see RpcRegistry.checkpoint).
+        buffer_size: int
+            Bytes which are read at once (default: HASH_BUFFER_SIZE).
+        algorithm: str
+            One of HASH_ALGORITHMS (default: HASH_ALGORITHM).
+        progress: Progress
+            Counts the read bytes and the file (see client.events.Progress),
+            the caller adds the total.
 
     Returns
     -------
-        A string with an MD5 hash
+        A hash string (see format_hash)
 
     Exceptions
     ----------
-        ValueError: if the path does not point to a file
+        ValueError: if the path does not point to a file or the algorithm is
+            unknown
     """
+    algorithm = check_hash_algorithm(algorithm)
+
     if not os.path.isfile(path):
         raise ValueError("The given path `{}` is not a file.".format(path))
 
-    md5 = hashlib.md5()
+    path_stat = os.stat(path)
+    cached = HASH_CACHE.get(path_stat, algorithm)
+    if cached is not None:
+        if progress is not None:
+            progress.advance(path_stat.st_size, 1)
+        return cached
+
+    if buffer_size is None:
+        buffer_size = HASH_BUFFER_SIZE
+
+    hash_ = hashlib.new(algorithm)
 
     with open(path, 'rb') as file_:
+        before = os.fstat(file_.fileno())
         while True:
-            data = file_.read(65536)
+            if checkpoint is not None:
+                checkpoint()
+            data = file_.read(buffer_size)
             if not data:
                 break
-            md5.update(data)
+            hash_.update(data)
+            if progress is not None:
+                progress.advance(len(data))
+        after = os.fstat(file_.fileno())
+
+    if progress is not None:
+        progress.advance(0, 1)
+
+    value = format_hash(algorithm, hash_.hexdigest())
+
+    # a file which was modified while it was hashed is not cached
+    if HASH_CACHE.key(before, algorithm) == HASH_CACHE.key(after, algorithm):
+        HASH_CACHE.put(before, algorithm, value)
+
+    return value
+
+
+# thread pools by number of threads, which are shared by all commands
+_HASH_POOLS = {}
+_HASH_POOLS_LOCK = threading.Lock()
+
+
+def _hash_pool(workers):
+    """
+    Returns the shared thread pool with the given number of threads.
+    """
+    with _HASH_POOLS_LOCK:
+        if workers not in _HASH_POOLS:
+            _HASH_POOLS[workers] = ThreadPoolExecutor(
+                workers, thread_name_prefix='hash')
+        return _HASH_POOLS[workers]
+
+
+def _map_ordered(function, arguments, checkpoint, workers):
+    """
+    Calls function(*argument, checkpoint) for all arguments in a shared pool
+    of threads and yields the results in the order of the arguments. At most
+    two calls per thread are submitted at the same time by every caller, so
+    the file I/O of all commands is bounded by the size of the pool.
+
+    Arguments
+    ---------
+        function: function which is called in the threads
+        arguments: iterable of tuples
+        checkpoint: function which is called before every read (see
+            RpcRegistry.checkpoint)
+        workers: number of threads (default: HASH_WORKERS)
+    """
+    if workers is None:
+        workers = HASH_WORKERS
+
+    pool = _hash_pool(workers)
+    pending = deque()
+
+    try:
+        for argument in arguments:
+            # the threads see the cancellation of the command as well
+            pending.append(
+                pool.submit(contextvars.copy_context().run, function,
+                            *argument, checkpoint))
+
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # the calls of a failed or cancelled command are not started anymore
+        for future in pending:
+            future.cancel()
+        wait(pending)
+
+
+def _walk_tree(path, on_directory=None, checkpoint=None):
+    """
+    Walks a directory tree in sorted order. Links to directories are treated
+    as empty directories and links to files as files (like os.walk).
+
+    Arguments
+    ---------
+        path: path to the directory
+        on_directory: function(rel_path, stat) which is called for every
+            directory below path before its entries are walked
+        checkpoint: function which is called before every directory (see
+            RpcRegistry.checkpoint)
+
+    Returns
+    -------
+        (root node, list of (path, size, node) for every file in sorted
+        order)
+        A node is a dict with the keys type ('dir' or 'file'), mode and
+        entries (dict of nodes by name, only for directories).
+    """
+    root = {'type': 'dir', 'mode': None, 'entries': {}}
+    files = []
+    stack = [('', root)]
+
+    while stack:
+        (rel_root, node) = stack.pop()
+        if checkpoint is not None:
+            checkpoint()
 
-    return "{}".format(md5.hexdigest())
+        with os.scandir(os.path.join(path, rel_root)) as entries:
+            entries = sorted(entries, key=lambda entry: entry.name)
 
+        directories = []
+        for entry in entries:
+            rel_path = os.path.join(rel_root, entry.name)
+            entry_stat = entry.stat()
 
-def hash_directory(path):
+            if entry.is_dir():
+                child = {
+                    'type': 'dir',
+                    'mode': stat.S_IMODE(entry_stat.st_mode),
+                    'entries': {},
+                }
+                if on_directory is not None:
+                    on_directory(rel_path, entry_stat)
+                if not entry.is_symlink():
+                    directories.append((rel_path, child))
+            else:
+                child = {
+                    'type': 'file',
+                    'mode': stat.S_IMODE(entry_stat.st_mode),
+                }
+                files.append((entry.path, entry_stat.st_size, child))
+
+            node['entries'][entry.name] = child
+
+        # the stack is last in first out
+        stack.extend(reversed(directories))
+
+    return (root, files)
+
+
+def _digest_tree(node, algorithm):
+    """
+    Computes the hashes of all directory nodes from the hashes of the file
+    nodes (see _walk_tree). The hash of a directory is computed over the
+    type, mode, hash and name of all its entries in sorted order.
+
+    Returns
+    -------
+        the hash of the node
     """
-    Retrieves the hash for each file in this directory (recursive) and hashes all the file
-    hashes.
+    if node['type'] == 'file':
+        return node['hash']
+
+    hash_ = hashlib.new(algorithm)
+    for (name, child) in sorted(node['entries'].items()):
+        hash_.update('{} {:o} {}\0'.format(
+            child['type'], child['mode'], _digest_tree(
+                child, algorithm)).encode('utf-8'))
+        hash_.update(name.encode('utf-8', 'surrogateescape') + b'\0')
+
+    node['hash'] = format_hash(algorithm, hash_.hexdigest())
+    return node['hash']
+
+
+def hash_tree(path,
+              checkpoint=None,
+              workers=None,
+              buffer_size=None,
+              algorithm=None,
+              progress=None):
+    """
+    Computes the Merkle tree of a directory. Every file node holds the hash
+    of its content, every directory node the hash over the type, mode, hash
+    and name of its entries in sorted order. The hashes do not depend on the
+    machine or the order of the file system, and a change only changes the
+    hashes of the directories above it, so two trees can be compared by
+    descending only into directories with different hashes.
+
+    The files are hashed by a pool of threads, at most two files per thread
+    are opened at the same time. Unchanged files are taken from the
+    HASH_CACHE, so hashing an unchanged tree again only stats the files and
+    rehashes the (small) directory listings. Only the file hashes are
+    cached, a key for a directory digest would have to cover the same
+    listing which is hashed.
 
     Arguments
     ---------
         path: directory path
+        checkpoint: function which is called before every read (see
+            RpcRegistry.checkpoint)
+        workers: number of threads (default: HASH_WORKERS)
+        buffer_size: bytes which are read at once (default: HASH_BUFFER_SIZE)
+        algorithm: one of HASH_ALGORITHMS (default: HASH_ALGORITHM), which is
+            used for the files and the directories
+        progress: counts the hashed bytes and files (see
+            client.events.Progress), the total is added after the walk
 
     Returns
     -------
-        A string with an MD5 hash
+        the root node, a dict with the keys type, mode (None for the root),
+        hash and entries (dict of nodes by name, only for directories)
     """
+    algorithm = check_hash_algorithm(algorithm)
+
     if not os.path.isdir(path):
         raise ValueError(
             "The given path `{}` is not a directory.".format(path))
 
-    md5 = hashlib.md5()
+    def hash_(fil, checkpoint):
+        return hash_file(fil, checkpoint, buffer_size, algorithm, progress)
+
+    (root, files) = _walk_tree(path, checkpoint=checkpoint)
+    if progress is not None:
+        progress.add_total(sum(size for (_, size, _) in files), len(files))
+    results = _map_ordered(hash_, ((fil, ) for (fil, _, _) in files),
+                           checkpoint, workers)
+    for ((_, _, node), value) in zip(files, results):
+        node['hash'] = value
+
+    _digest_tree(root, algorithm)
+    return root
+
+
+def hash_directory(path,
+                   checkpoint=None,
+                   workers=None,
+                   buffer_size=None,
+                   algorithm=None,
+                   progress=None):
+    """
+    Computes the hash of a directory, which is the hash of the root of its
+    Merkle tree (see hash_tree). The result does not depend on the number of
+    threads or the order of the file system.
+
+    Arguments
+    ---------
+        path: directory path
+        checkpoint: function which is called before every read (see
+            RpcRegistry.checkpoint)
+        workers: number of threads (default: HASH_WORKERS)
+        buffer_size: bytes which are read at once (default: HASH_BUFFER_SIZE)
+        algorithm: one of HASH_ALGORITHMS (default: HASH_ALGORITHM), which is
+            used for the files and the directories
+        progress: counts the hashed bytes and files (see
+            client.events.Progress)
+
+    Returns
+    -------
+        A hash string (see format_hash)
+    """
+    return hash_tree(path, checkpoint, workers, buffer_size, algorithm,
+                     progress)['hash']
+
+
+def prune_tree(node, depth):
+    """
+    Removes the entries of the nodes which are deeper than `depth` levels
+    below the given node.
+
+    Arguments
+    ---------
+        node: node of hash_tree
+        depth: number of levels which are kept (0 keeps only the node)
+
+    Returns
+    -------
+        a pruned copy of the node
+    """
+    pruned = {key: value for (key, value) in node.items() if key != 'entries'}
+    if 'entries' in node and depth > 0:
+        pruned['entries'] = {
+            name: prune_tree(child, depth - 1)
+            for (name, child) in node['entries'].items()
+        }
+    return pruned
+
+
+COPY_BUFFER_SIZE = 1 << 20
+# bytes which are copied by the kernel between two checkpoints
+KERNEL_COPY_CHUNK_SIZE = 1 << 24
+
+REFLINK = 'reflink'
+COPY_FILE_RANGE = 'copy_file_range'
+SENDFILE = 'sendfile'
+BUFFER = 'buffer'
+
+# the strategies which copy_file tries in this order
+COPY_STRATEGIES = [REFLINK, COPY_FILE_RANGE, SENDFILE, BUFFER]
+
+# ioctl which clones a file on btrfs and XFS (see ioctl_ficlone(2))
+FICLONE = 0x40049409
+
+# number of copied files by strategy (see HealthMonitor.report)
+COPIED_FILES = Counter()
+_COPIED_FILES_LOCK = threading.Lock()
+
+# the buffer copy reserves the space of files with at least this size
+PREALLOCATE_MIN_SIZE = 1 << 25
+# reserves the space without changing the size (see fallocate(2))
+FALLOC_FL_KEEP_SIZE = 0x01
+
+
+def _load_fallocate():
+    """
+    Returns fallocate of the C library or None if it is not available. Unlike
+    os.posix_fallocate, it fails on file systems without native support
+    instead of writing every block.
+    """
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        fallocate = ctypes.CDLL(None, use_errno=True).fallocate64
+    except (OSError, AttributeError):
+        return None
+    fallocate.argtypes = [
+        ctypes.c_int, ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong
+    ]
+    fallocate.restype = ctypes.c_int
+    return fallocate
+
+
+_FALLOCATE = _load_fallocate()
+
+
+def _reflink(source_fd, destination_fd, size, checkpoint, progress):
+    #pylint: disable=W0613
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, os.strerror(errno.EOPNOTSUPP))
+    fcntl.ioctl(destination_fd, FICLONE, source_fd)
+
+
+def _copy_file_range(source_fd, destination_fd, size, checkpoint, progress):
+    if not hasattr(os, 'copy_file_range'):
+        raise OSError(errno.ENOSYS, os.strerror(errno.ENOSYS))
+
+    copied = 0
+    while copied < size:
+        if checkpoint is not None:
+            checkpoint()
+        count = os.copy_file_range(source_fd, destination_fd,
+                                   min(KERNEL_COPY_CHUNK_SIZE, size - copied))
+        if count == 0:
+            break
+        copied += count
+        if progress is not None:
+            progress.advance(count)
+
+
+def _sendfile(source_fd, destination_fd, size, checkpoint, progress):
+    if not sys.platform.startswith('linux'):
+        # other systems only send files to sockets
+        raise OSError(errno.ENOSYS, os.strerror(errno.ENOSYS))
+
+    copied = 0
+    while copied < size:
+        if checkpoint is not None:
+            checkpoint()
+        count = os.sendfile(destination_fd, source_fd, copied,
+                            min(KERNEL_COPY_CHUNK_SIZE, size - copied))
+        if count == 0:
+            break
+        copied += count
+        if progress is not None:
+            progress.advance(count)
+
+
+def _preallocate(destination_fd, size):
+    if size < PREALLOCATE_MIN_SIZE or _FALLOCATE is None:
+        return
+    # an error means no native support, the copy allocates the space
+    _FALLOCATE(destination_fd, FALLOC_FL_KEEP_SIZE, 0, size)
+
+
+def _buffer_copy(source_file, destination_file, checkpoint, algorithm,
+                 progress):
+    hash_ = hashlib.new(algorithm)
+    while True:
+        if checkpoint is not None:
+            checkpoint()
+        data = source_file.read(COPY_BUFFER_SIZE)
+        if not data:
+            break
+        hash_.update(data)
+        destination_file.write(data)
+        if progress is not None:
+            progress.advance(len(data))
+    return format_hash(algorithm, hash_.hexdigest())
+
+
+def copy_file(source,
+              destination,
+              checkpoint=None,
+              algorithm=None,
+              progress=None):
+    """
+    Copies the content of a file (like shutil.copyfile) and returns its hash.
+    The strategies in COPY_STRATEGIES are tried in order:
+
+        reflink             clones the file (btrfs, XFS), which shares the
+                            data with the source and takes no time
+        copy_file_range     the kernel copies the data (Linux)
+        sendfile            the kernel copies the data (Linux)
+        buffer              the data is read in chunks of COPY_BUFFER_SIZE
+                            bytes and written to the destination (the space
+                            of files with at least PREALLOCATE_MIN_SIZE
+                            bytes is reserved first, if the file system
+                            supports it)
+
+    The hash of the source is taken from the HASH_CACHE if the data is not
+    read by the client. The kernel copies are only used for sources with a
+    cached hash, otherwise the data has to be read anyway, and the buffer
+    copy hashes the chunks on the way. The hash of the source is added to the
+    HASH_CACHE.
+
+    Arguments
+    ---------
+        source: path to the source file
+        destination: path to the destination file
+        checkpoint: function which is called before every chunk (see
+            RpcRegistry.checkpoint)
+        algorithm: one of HASH_ALGORITHMS (default: HASH_ALGORITHM)
+        progress: counts the copied bytes and the file (see
+            client.events.Progress), the caller adds the total
+
+    Returns
+    -------
+        (hash string (like hash_file), the strategy)
+    """
+    algorithm = check_hash_algorithm(algorithm)
+
+    with open(source, 'rb') as source_file, \
+            open(destination, 'wb') as destination_file:
+        source_fd = source_file.fileno()
+        destination_fd = destination_file.fileno()
+        before = os.fstat(source_fd)
+        cached = HASH_CACHE.get(before, algorithm)
+        value = None
+
+        for strategy in COPY_STRATEGIES:
+            if strategy == BUFFER:
+                _preallocate(destination_fd, before.st_size)
+                value = _buffer_copy(source_file, destination_file,
+                                     checkpoint, algorithm, progress)
+                break
+
+            if cached is None and strategy != REFLINK:
+                continue
+
+            copy = {
+                REFLINK: _reflink,
+                COPY_FILE_RANGE: _copy_file_range,
+                SENDFILE: _sendfile,
+            }[strategy]
+
+            try:
+                copy(source_fd, destination_fd, before.st_size, checkpoint,
+                     progress)
+            except OSError as err:
+                logging.debug('Could not copy %s with %s (%s).', source,
+                              strategy, err)
+                # start again with the next strategy
+                os.lseek(source_fd, 0, os.SEEK_SET)
+                os.lseek(destination_fd, 0, os.SEEK_SET)
+                os.ftruncate(destination_fd, 0)
+                continue
+
+            if HASH_CACHE.key(before, algorithm) != HASH_CACHE.key(
+                    os.fstat(source_fd), algorithm):
+                # modified while copying, the data does not match the hash
+                os.lseek(source_fd, 0, os.SEEK_SET)
+                os.lseek(destination_fd, 0, os.SEEK_SET)
+                os.ftruncate(destination_fd, 0)
+                strategy = BUFFER
+                value = _buffer_copy(source_file, destination_file,
+                                     checkpoint, algorithm, progress)
+            elif cached is not None:
+                value = cached
+            break
+        else:
+            raise ValueError("No copy strategy is enabled.")
+
+        after = os.fstat(source_fd)
+
+    if value is None:
+        # a reflink without a cached hash, the data is read by hash_file
+        value = hash_file(
+            source, checkpoint, algorithm=algorithm, progress=progress)
+    else:
+        # a file which was modified while it was copied is not cached
+        if HASH_CACHE.key(before, algorithm) == HASH_CACHE.key(
+                after, algorithm):
+            HASH_CACHE.put(before, algorithm, value)
+
+        if progress is not None:
+            # a reflink copies no data by itself
+            progress.advance(before.st_size if strategy == REFLINK else 0, 1)
+
+    with _COPIED_FILES_LOCK:
+        COPIED_FILES[strategy] += 1
+    logging.debug('Copied %s to %s with %s.', source, destination, strategy)
+
+    return (value, strategy)
+
+
+def copy_directory(source,
+                   destination,
+                   checkpoint=None,
+                   workers=None,
+                   algorithm=None,
+                   progress=None):
+    """
+    Copies a directory tree with the modes of the files and directories (like
+    shutil.copytree) and returns the hash of the copy. The files are copied
+    by a pool of threads with copy_file, so the data is read at most once.
+    The copies get the mtime of the source, so a later sync_directory skips
+    the unchanged files.
+
+    Arguments
+    ---------
+        source: path to the source directory
+        destination: path to the destination, which must not exist
+        checkpoint: function which is called before every chunk (see
+            RpcRegistry.checkpoint)
+        workers: number of threads (default: HASH_WORKERS)
+        algorithm: one of HASH_ALGORITHMS (default: HASH_ALGORITHM)
+        progress: counts the copied bytes and files (see
+            client.events.Progress), the total is added after the walk
+
+    Returns
+    -------
+        (hash string (like hash_directory), dict with the number of copied
+        files by strategy)
+    """
+    algorithm = check_hash_algorithm(algorithm)
+    strategies = Counter()
+    modes = []
+
+    def create_directory(rel_path, directory_stat):
+        os.mkdir(os.path.join(destination, rel_path))
+        modes.append((rel_path, stat.S_IMODE(directory_stat.st_mode)))
+
+    def copy(source_file, checkpoint):
+        destination_file = os.path.join(destination,
+                                        os.path.relpath(source_file, source))
+        (value, strategy) = copy_file(source_file, destination_file,
+                                      checkpoint, algorithm, progress)
+        shutil.copystat(source_file, destination_file)
+        with _COPIED_FILES_LOCK:
+            strategies[strategy] += 1
+        return value
+
+    os.mkdir(destination)
+    # the directories are created before the files are copied
+    (root, files) = _walk_tree(source, create_directory, checkpoint)
+    if progress is not None:
+        progress.add_total(sum(size for (_, size, _) in files), len(files))
+    results = _map_ordered(copy, ((fil, ) for (fil, _, _) in files),
+                           checkpoint, workers)
+    for ((_, _, node), value) in zip(files, results):
+        node['hash'] = value
+
+    # after the files, read-only directories can not be filled anymore
+    for (rel_path, mode) in reversed(modes):
+        os.chmod(os.path.join(destination, rel_path), mode)
+
+    return (_digest_tree(root, algorithm), dict(strategies))
+
+
+COPY = 'copy'
+LINK = 'link'
+SYNC = 'sync'
+MOVE_MODES = [COPY, LINK, SYNC]
+
+HARDLINK = 'hardlink'
+SYMLINK = 'symlink'
+
+
+def link_file(source, destination):
+    """
+    Creates a hardlink at the destination which points to the source. If the
+    source is on another file system (or the file system has no hardlinks), a
+    symlink is created.
+
+    Arguments
+    ---------
+        source: path to the source file
+        destination: path to the link
+
+    Returns
+    -------
+        HARDLINK or SYMLINK
+    """
+    try:
+        os.link(source, destination)
+        return HARDLINK
+    except OSError as err:
+        if err.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK,
+                             errno.EOPNOTSUPP):
+            raise
+
+    os.symlink(source, destination)
+    return SYMLINK
+
+
+def link_directory(source, destination, checkpoint=None):
+    """
+    Creates the directory tree of the source (with the modes of the
+    directories) at the destination and links all files with link_file. If
+    the source is on another file system, the destination is a symlink to the
+    source directory.
+
+    Arguments
+    ---------
+        source: path to the source directory
+        destination: path to the destination, which must not exist
+        checkpoint: function which is called before every file (see
+            RpcRegistry.checkpoint)
+
+    Returns
+    -------
+        dict with the number of links by link type
+    """
+    parent = os.path.dirname(destination)
+    if os.stat(source).st_dev != os.stat(parent).st_dev:
+        os.symlink(source, destination, target_is_directory=True)
+        return {SYMLINK: 1}
+
+    links = Counter()
+    directories = []
+    os.mkdir(destination)
+
+    for root, dirs, files in os.walk(source):
+        # set the prefix from source to destination
+        dest_root = os.path.join(destination, root[len(source) + 1:])
+
+        for directory in dirs:
+            os.mkdir(os.path.join(dest_root, directory))
+            directories.append((os.path.join(root, directory),
+                                os.path.join(dest_root, directory)))
 
-    for root, _, files in os.walk(path):
         for fil in files:
-            md5.update(hash_file(os.path.join(root, fil)).encode("utf-8"))
+            if checkpoint is not None:
+                checkpoint()
+            links[link_file(
+                os.path.join(root, fil), os.path.join(dest_root, fil))] += 1
+
+    # after the links, read-only directories can not be filled anymore
+    for (source_directory, destination_directory) in reversed(directories):
+        shutil.copymode(source_directory, destination_directory)
 
-    return "{}".format(md5.hexdigest())
+    return dict(links)
+
+
+def _make_parent_writable(function, path, excinfo):
+    """
+    Error handler of shutil.rmtree, which makes the parent directory of a path
+    writable and tries again. Copies and links get the modes of the source
+    directories, so the entries of a read-only directory can not be removed
+    otherwise (unless the client runs as root).
+    """
+    if not issubclass(excinfo[0], PermissionError):
+        raise excinfo[1]
+
+    parent = os.path.dirname(path)
+    os.chmod(parent, stat.S_IMODE(os.stat(parent).st_mode) | stat.S_IRWXU)
+    function(path)
+
+
+def remove_path(path):
+    """
+    Removes a file, a link or a directory tree. A link to a directory is
+    removed without touching the directory. Read-only directories within the
+    tree are made writable first.
+
+    Arguments
+    ---------
+        path: path to remove
+    """
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path, onerror=_make_parent_writable)
+    else:
+        os.remove(path)
+
+
+# name of the manifest in the backup of a synced directory
+SYNC_MANIFEST = '.filesystem_sync.json'
+UNCHANGED = 'unchanged'
+
+
+def _unlock_directory(path):
+    """
+    Gives the owner full access to a directory, so its entries can be added,
+    moved and removed. Copies get the modes of the source directories, so a
+    destination can contain read-only directories.
+
+    Returns
+    -------
+        the original mode or None if the owner had full access before
+    """
+    mode = stat.S_IMODE(os.stat(path).st_mode)
+    if mode & stat.S_IRWXU == stat.S_IRWXU:
+        return None
+    os.chmod(path, mode | stat.S_IRWXU)
+    return mode
+
+
+def _unchanged(source_stat, destination_stat, algorithm):
+    """
+    Checks if a destination file has the content and mode of the source
+    file, by size and mtime or by the cached hashes of both.
+    """
+    if (source_stat.st_size != destination_stat.st_size
+            or stat.S_IMODE(source_stat.st_mode) != stat.S_IMODE(
+                destination_stat.st_mode)):
+        return False
+    if source_stat.st_mtime_ns == destination_stat.st_mtime_ns:
+        return True
+
+    source_hash = HASH_CACHE.get(source_stat, algorithm)
+    return (source_hash is not None
+            and source_hash == HASH_CACHE.get(destination_stat, algorithm))
+
+
+def sync_directory(source,
+                   destination,
+                   backup,
+                   checkpoint=None,
+                   algorithm=None,
+                   progress=None):
+    """
+    Updates an existing destination directory to the content of the source.
+    Only new and changed files are copied, files with the same size and mtime
+    (or the same cached hash) are kept. The copies get the mode and mtime of
+    the source, so the next sync skips them.
+
+    Replaced and removed entries are moved into the backup directory, which
+    also gets a manifest (SYNC_MANIFEST) of all changes, so rollback_sync can
+    restore the destination exactly. If the sync is cancelled, the changes
+    are rolled back. Read-only directories are made writable while they are
+    changed, their original modes are kept in the manifest.
+
+    Arguments
+    ---------
+        source: path to the source directory
+        destination: path to the existing destination directory
+        backup: path to the backup directory, which must not exist
+        checkpoint: function which is called before every file (see
+            RpcRegistry.checkpoint)
+        algorithm: one of HASH_ALGORITHMS (default: HASH_ALGORITHM), the
+            cached hashes of this algorithm are compared
+        progress: counts the copied bytes and files (see
+            client.events.Progress), the total grows with every file which
+            has to be copied
+
+    Returns
+    -------
+        dict with the number of files by copy strategy (UNCHANGED for files
+        which were kept)
+    """
+    algorithm = check_hash_algorithm(algorithm)
+    manifest = {
+        'version': 1,
+        'added_files': [],
+        'added_dirs': [],
+        'replaced': [],
+        'removed': [],
+        'modes': [],
+        'unlocked': [],
+    }
+    strategies = Counter()
+    unlocked = {}
+    os.mkdir(backup)
+
+    def unlock(rel_path):
+        mode = _unlock_directory(os.path.join(destination, rel_path))
+        if mode is not None:
+            unlocked[rel_path] = mode
+            manifest['unlocked'].append((rel_path, mode))
+
+    def move_to_backup(rel_path):
+        backup_path = os.path.join(backup, 'files', rel_path)
+        os.makedirs(os.path.dirname(backup_path), exist_ok=True)
+        path = os.path.join(destination, rel_path)
+        # moving a directory changes its entry '..'
+        if os.path.isdir(path) and not os.path.islink(path):
+            unlock(rel_path)
+        os.rename(path, backup_path)
+
+    def sync(rel_root):
+        source_root = os.path.join(source, rel_root)
+        destination_root = os.path.join(destination, rel_root)
+        unlock(rel_root)
+
+        with os.scandir(source_root) as entries:
+            source_entries = {entry.name: entry for entry in entries}
+        with os.scandir(destination_root) as entries:
+            destination_entries = {entry.name: entry for entry in entries}
+
+        # remove entries which are not in the source or have another type
+        for (name, entry) in destination_entries.items():
+            source_entry = source_entries.get(name)
+            if (source_entry is None
+                    or source_entry.is_dir() != (entry.is_dir()
+                                                 and not entry.is_symlink())):
+                move_to_backup(os.path.join(rel_root, name))
+                manifest['removed'].append(os.path.join(rel_root, name))
+                destination_entries[name] = None
+
+        for (name, entry) in sorted(source_entries.items()):
+            rel_path = os.path.join(rel_root, name)
+            destination_entry = destination_entries.get(name)
+
+            if entry.is_dir():
+                if destination_entry is None:
+                    os.mkdir(os.path.join(destination, rel_path))
+                    manifest['added_dirs'].append(rel_path)
+                # like os.walk, links to directories are not followed
+                if not entry.is_symlink():
+                    sync(rel_path)
+
+                # after the entries, read-only directories can not be
+                # filled anymore
+                mode = stat.S_IMODE(entry.stat().st_mode)
+                current_mode = stat.S_IMODE(
+                    os.stat(os.path.join(destination, rel_path)).st_mode)
+                old_mode = unlocked.get(rel_path, current_mode)
+                if old_mode != mode and destination_entry is not None:
+                    manifest['modes'].append((rel_path, old_mode))
+                if current_mode != mode:
+                    os.chmod(os.path.join(destination, rel_path), mode)
+                continue
+
+            if checkpoint is not None:
+                checkpoint()
+
+            source_stat = entry.stat()
+            if destination_entry is None:
+                manifest['added_files'].append(rel_path)
+            elif _unchanged(source_stat, destination_entry.stat(), algorithm):
+                strategies[UNCHANGED] += 1
+                continue
+            else:
+                move_to_backup(rel_path)
+                manifest['replaced'].append(rel_path)
+
+            if progress is not None:
+                progress.add_total(source_stat.st_size, 1)
+            (_, strategy) = copy_file(entry.path,
+                                      os.path.join(destination, rel_path),
+                                      checkpoint, algorithm, progress)
+            os.chmod(
+                os.path.join(destination, rel_path),
+                stat.S_IMODE(source_stat.st_mode))
+            os.utime(
+                os.path.join(destination, rel_path),
+                ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+            strategies[strategy] += 1
+
+    try:
+        sync('')
+    except BaseException:
+        rollback_sync(destination, backup, manifest)
+        raise
+
+    # the other directories got the modes of the source
+    removed = set(manifest['removed'])
+    for (rel_path, mode) in manifest['unlocked']:
+        if not rel_path:
+            os.chmod(destination, mode)
+        elif rel_path in removed:
+            os.chmod(os.path.join(backup, 'files', rel_path), mode)
+
+    with open(os.path.join(backup, SYNC_MANIFEST), 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+
+    return dict(strategies)
+
+
+def is_sync_backup(backup):
+    """
+    Checks if a backup was created by sync_directory.
+
+    Arguments
+    ---------
+        backup: path to the backup
+
+    Returns
+    -------
+        True or False
+    """
+    return os.path.isfile(os.path.join(backup, SYNC_MANIFEST))
+
+
+def rollback_sync(destination, backup, manifest=None):
+    """
+    Reverts the changes of sync_directory and removes the backup.
+
+    Arguments
+    ---------
+        destination: path to the synced directory
+        backup: path to the backup directory
+        manifest: the changes (default: read from the backup)
+    """
+    if manifest is None:
+        with open(os.path.join(backup, SYNC_MANIFEST)) as manifest_file:
+            manifest = json.load(manifest_file)
+
+    # the changed directories could be read-only now, moved directories
+    # need write access as well
+    unlocked = manifest.get('unlocked', [])
+    for rel_path in manifest['added_dirs'] + [
+            rel_path for (rel_path, _) in manifest.get('modes', []) + unlocked
+    ]:
+        for root in (destination, os.path.join(backup, 'files')):
+            path = os.path.join(root, rel_path)
+            if os.path.isdir(path) and not os.path.islink(path):
+                _unlock_directory(path)
+
+    for rel_path in manifest['added_files']:
+        path = os.path.join(destination, rel_path)
+        if os.path.lexists(path):
+            os.remove(path)
+
+    # the added directories are empty now, the deepest are removed first
+    for rel_path in reversed(manifest['added_dirs']):
+        path = os.path.join(destination, rel_path)
+        if os.path.isdir(path):
+            os.rmdir(path)
+
+    for rel_path in manifest['replaced'] + manifest['removed']:
+        backup_path = os.path.join(backup, 'files', rel_path)
+        if os.path.lexists(backup_path):
+            os.replace(backup_path, os.path.join(destination, rel_path))
+
+    for (rel_path, mode) in unlocked + manifest.get('modes', []):
+        os.chmod(os.path.join(destination, rel_path), mode)
+
+    remove_path(backup)
 
 
 def filesystem_type_check(
@@ -97,20 +1118,10 @@ def filesystem_type_check(
         backup_ending,
 ):
     """
-    Check the types of the shared input of filesystem_move and filesystem_restore.
+    Check the shared input of filesystem_move and filesystem_restore against
+    the filesystem and normalizes the paths. The types of the arguments are
+    checked by the rpc registry.
     """
-    uty.ensure_type("source_path", source_path, str)
-    uty.ensure_type("destination_path", destination_path, str)
-    uty.ensure_type("backup_ending", backup_ending, str)
-    uty.ensure_type("PATH_TYPE_SET", PATH_TYPE_SET, list)
-
-    if not source_type in PATH_TYPE_SET:
-        raise ValueError(
-            "The source_type has to be one of {}".format(PATH_TYPE_SET))
-    if not destination_type in PATH_TYPE_SET:
-        raise ValueError(
-            "The destination_type has to be one of {}".format(PATH_TYPE_SET))
-
     source_path = up.remove_trailing_path_seperator(source_path)
     destination_path = up.remove_trailing_path_seperator(destination_path)
 
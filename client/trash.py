@@ -0,0 +1,163 @@
+"""
+This module contains a trash which deletes files and directories in the
+background.
+"""
+import errno
+import logging
+import os
+import queue
+import threading
+
+from uuid import uuid4
+
+from client.shorthand import remove_path
+
+
+class Trash:
+    """
+    Deletes files and directories in a background thread. A path is moved
+    into a trash directory on the same file system first, which is atomic
+    and takes no time, regardless of the size of the path.
+
+    The trash directory is `root` if it is on the same file system as the
+    path, otherwise the directory TRASH_NAME next to the path. Entries which
+    were left behind by a crash are deleted by the next purge of the same
+    trash directory.
+
+    The background thread runs with the lowest scheduling priority (where the
+    system supports priorities of threads), so it does not slow down the
+    simulation.
+    """
+    TRASH_NAME = '.client-trash'
+
+    def __init__(self, root=None):
+        self.__root = None
+        self.__queue = queue.Queue()
+        self.__lock = threading.Lock()
+        self.__thread = None
+        self.__pending = 0
+        self.root = root
+
+    @property
+    def root(self):
+        return self.__root
+
+    @root.setter
+    def root(self, root):
+        if root is not None:
+            root = os.path.abspath(root)
+            os.makedirs(root, exist_ok=True)
+        self.__root = root
+
+    @property
+    def pending(self):
+        """
+        Returns the number of deletions which did not finish yet.
+        """
+        return self.__pending
+
+    def directory(self, path):
+        """
+        Returns the trash directory for a path.
+
+        Arguments
+        ---------
+            path: path which will be deleted
+
+        Returns
+        -------
+            path of the trash directory
+        """
+        parent = os.path.dirname(os.path.abspath(path))
+
+        if (self.__root is not None and
+                os.stat(self.__root).st_dev == os.stat(parent).st_dev):
+            return self.__root
+        return os.path.join(parent, self.TRASH_NAME)
+
+    def discard(self, path):
+        """
+        Moves a file or directory into the trash and deletes it in the
+        background. Links are removed immediately.
+
+        Arguments
+        ---------
+            path: path to delete
+        """
+        if os.path.islink(path):
+            os.remove(path)
+            return
+
+        directory = self.directory(path)
+
+        try:
+            # the background thread does not remove the directory meanwhile
+            with self.__lock:
+                os.makedirs(directory, exist_ok=True)
+                os.rename(
+                    path,
+                    os.path.join(directory, '{}-{}'.format(
+                        uuid4().hex, os.path.basename(path))))
+        except OSError as err:
+            if err.errno != errno.EXDEV:
+                raise
+            logging.warning('Could not move %s to the trash (%s).', path, err)
+            remove_path(path)
+            return
+
+        self.purge(directory)
+
+    def purge(self, directory):
+        """
+        Deletes all entries of a trash directory in the background.
+
+        Arguments
+        ---------
+            directory: path of the trash directory
+        """
+        with self.__lock:
+            self.__pending += 1
+            self.__queue.put(directory)
+
+            if self.__thread is None:
+                self.__thread = threading.Thread(
+                    target=self.__run, name='trash', daemon=True)
+                self.__thread.start()
+
+    def join(self):
+        """
+        Waits until all entries were deleted.
+        """
+        self.__queue.join()
+
+    def __run(self):
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except (AttributeError, OSError):
+            # threads have no own priority on this system
+            pass
+
+        while True:
+            directory = self.__queue.get()
+
+            try:
+                for entry in os.listdir(directory):
+                    remove_path(os.path.join(directory, entry))
+
+                with self.__lock:
+                    if directory != self.__root and not os.listdir(directory):
+                        os.rmdir(directory)
+            except FileNotFoundError as err:
+                # the directory was purged by an earlier purge meanwhile
+                logging.debug('Could not purge the trash %s (%s).',
+                              directory, err)
+            except OSError as err:
+                logging.warning('Could not purge the trash %s (%s).',
+                                directory, err)
+            finally:
+                with self.__lock:
+                    self.__pending -= 1
+                self.__queue.task_done()
+
+
+TRASH = Trash()
@@ -24,9 +24,18 @@ from urllib.request import urlretrieve
 
 from shutil import unpack_archive, rmtree
 
+from subprocess import call
+
 import pip
 import sys
 
+# the oldest supported python version
+MIN_VERSION = (3, 7)
+# the newest python version which works with bp_flugsimulator_utils in
+# ./libs, newer versions need an updated utils wheel (it still uses
+# @asyncio.coroutine, which was removed in python 3.11)
+MAX_VERSION = (3, 10)
+
 
 class Config:
     """
@@ -106,6 +115,24 @@ def git_to_filename(git_url):
             yield file
 
 
+def pip_main(args):
+    """
+    Runs pip with the given arguments in a subprocess (pip.main was removed
+    in pip 10).
+
+    Parameters
+    ----------
+    args: list
+        the arguments for pip
+
+    Returns
+    -------
+    int:
+        the exit code of pip
+    """
+    return call([sys.executable, '-m', 'pip'] + args)
+
+
 def install(lib_name):
     """
     Installes a library from a local file in ./libs
@@ -145,7 +172,7 @@ def install(lib_name):
             'file://' + getcwd() + '/libs',
         ]
 
-    if pip.main(args) != 0:
+    if pip_main(args) != 0:
         raise Exception('could not install ' + lib_name + ' from file')
 
 
@@ -195,7 +222,7 @@ def download_library(lib_name):
             remove(join('libs', file))
             print('removed ', file)
 
-    if pip.main(['download', lib_name, '-d', './libs']) != 0:
+    if pip_main(['download', lib_name, '-d', './libs']) != 0:
         raise Exception('could not download ' + lib_name)
 
 if __name__ == "__main__":
@@ -218,14 +245,16 @@ if __name__ == "__main__":
     CONFIG = Config.parse()
 
 
-    if not (3 == sys.version_info.major and  4 <= sys.version_info.minor <= 6):
-        raise Exception('only python 3.4 to 3.6 is supported, currently running ' + str(sys.version))
+    if not MIN_VERSION <= sys.version_info[:2] <= MAX_VERSION:
+        raise Exception('only python {}.{} to {}.{} is supported, currently '
+                        'running {}'.format(*MIN_VERSION, *MAX_VERSION,
+                                            sys.version))
 
     # update pip to local file
     if LooseVersion('10.0.0') < LooseVersion(pip.__version__) < LooseVersion('8.0.0'):
-        if pip.main([
+        if pip_main([
                 'install', '--upgrade', 'pip', '--no-index', '--find-links',
-                'file://' + os.getcwd() + '/libs'
+                'file://' + getcwd() + '/libs'
         ]) != 0:
             raise Exception('could not install pip from file')
 
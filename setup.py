@@ -39,12 +39,14 @@ setup(
     author="bp-flugsimulator",
     license="MIT",
     install_requires=get_requirements(),
-    python_requires=">=3.4",
+    python_requires=">=3.7",
     packages=find_packages(exclude=[
         "*.tests",
         "*.tests.*",
         "tests.*",
         "tests",
+        "benchmarks",
+        "benchmarks.*",
     ]),
     entry_points={
         'console_scripts': ['bp-flugsimulator-client=client.__main__:main']
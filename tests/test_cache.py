@@ -0,0 +1,61 @@
+"""
+Unit tests for the module client.cache.
+"""
+#pylint: disable=C0111, C0103
+import unittest
+
+from client.cache import LruCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLruCache(unittest.TestCase):
+    def test_get_put(self):
+        cache = LruCache(2)
+        cache.put('a', 1)
+        self.assertEqual(1, cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(2, cache.get('b', 2))
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+
+    def test_least_recently_used_removed(self):
+        cache = LruCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+
+        self.assertEqual(2, len(cache))
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+        self.assertEqual([('a', 1), ('c', 3)], cache.items())
+
+    def test_ttl(self):
+        clock = FakeClock()
+        cache = LruCache(2, ttl=10, clock=clock)
+        cache.put('a', 1)
+
+        clock.now = 10
+        self.assertEqual(1, cache.get('a'))
+        clock.now = 11
+        self.assertEqual([], cache.items())
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(0, len(cache))
+
+    def test_replace(self):
+        cache = LruCache(2)
+        cache.put('a', 1)
+        cache.put('a', 2)
+        self.assertEqual(2, cache.get('a'))
+        self.assertEqual(1, len(cache))
+
+    def test_invalid_size(self):
+        self.assertRaises(ValueError, LruCache, 0)
@@ -3,24 +3,32 @@ Unit tests for the module client.command.
 """
 #pylint: disable=C0111, C0103
 import unittest
+import hashlib
 import asyncio
+import errno
 import os
 import sys
 import random
 import string
+import threading
 import websockets
 import shutil
+import stat
 
 from os import remove, getcwd
 from os.path import join, isfile
 from uuid import uuid4
 
-from utils import Rpc, Status
+from utils import Command, Rpc, Status
 
 from .testcases import EventLoopTestCase, FileSystemTestCase
 import client.command
 import client.shorthand
 from client.logger import LOGGER
+from client.events import EVENTS, Progress
+from client.rpc import RPC, Cancelled
+from client.trash import TRASH
+import client.trash
 
 
 class TestCommands(EventLoopTestCase):
@@ -82,6 +90,118 @@ class TestCommands(EventLoopTestCase):
                     uuid4().hex, prog, args)),
         )
 
+    def test_execution_wrong_restart_policy(self):
+        self.assertRaises(
+            ValueError,
+            self.loop.run_until_complete,
+            client.command.execute(
+                random.choice(string.digits),
+                uuid4().hex, "calcs.exe", [], restart='sometimes'),
+        )
+
+    def test_execution_restart_on_failure(self):
+        if os.name == 'nt':
+            prog = "C:\\Windows\\System32\\cmd.exe"
+            args = ["/c", "echo run & exit 3"]
+        else:
+            prog = "/bin/sh"
+            args = ["-c", '"echo run; exit 3"']
+        uuid = uuid4().hex
+
+        self.assertEqual(
+            '3',
+            self.loop.run_until_complete(
+                client.command.execute(
+                    random.choice(string.digits),
+                    uuid,
+                    prog,
+                    args,
+                    restart='on-failure',
+                    max_restarts=2,
+                    backoff=0)),
+        )
+
+        res = self.loop.run_until_complete(client.command.get_log(uuid))
+        self.assertEqual(3, res['log'].count('run'))
+
+    def test_execution_restart_on_failure_success(self):
+        if os.name == 'nt':
+            prog = "C:\\Windows\\System32\\cmd.exe"
+            args = ["/c", "echo run"]
+        else:
+            prog = "/bin/sh"
+            args = ["-c", '"echo run"']
+        uuid = uuid4().hex
+
+        self.assertEqual(
+            '0',
+            self.loop.run_until_complete(
+                client.command.execute(
+                    random.choice(string.digits),
+                    uuid,
+                    prog,
+                    args,
+                    restart='on-failure',
+                    backoff=0)),
+        )
+
+        res = self.loop.run_until_complete(client.command.get_log(uuid))
+        self.assertEqual(1, res['log'].count('run'))
+
+    def test_execution_restart_always_event(self):
+        if os.name == 'nt':
+            prog = "C:\\Windows\\System32\\cmd.exe"
+            args = ["/c", "echo run"]
+        else:
+            prog = "/bin/sh"
+            args = ["-c", '"echo run"']
+        uuid = uuid4().hex
+        events = []
+
+        class Receiver:
+            session = None
+
+        async def websocket_handler(websocket, _path):
+            while True:
+                try:
+                    json = await websocket.recv()
+                except websockets.exceptions.ConnectionClosed:
+                    break
+                events.append(Status.from_json(json))
+
+        async def run():
+            server = await websockets.serve(
+                websocket_handler, host='127.0.0.1', port=8751)
+            Receiver.session = await websockets.connect(
+                'ws://127.0.0.1:8751/commands')
+            EVENTS.receiver = Receiver
+            try:
+                result = await client.command.execute(
+                    random.choice(string.digits),
+                    uuid,
+                    prog,
+                    args,
+                    restart='always',
+                    max_restarts=2,
+                    backoff=0)
+            finally:
+                EVENTS.receiver = None
+                await Receiver.session.close()
+                server.close()
+                await server.wait_closed()
+            return result
+
+        self.assertEqual('0', self.loop.run_until_complete(run()))
+
+        res = self.loop.run_until_complete(client.command.get_log(uuid))
+        self.assertEqual(3, res['log'].count('run'))
+
+        self.assertEqual(2, len(events))
+        for (idx, event) in enumerate(events):
+            self.assertEqual(uuid, event.uuid)
+            self.assertEqual('restart', event.payload['event'])
+            self.assertEqual(idx + 1, event.payload['data']['restarts'])
+
     def test_online(self):
         result = self.loop.run_until_complete(client.command.online())
         self.assertIsNone(result)
@@ -102,7 +222,7 @@ class TestCommands(EventLoopTestCase):
         remove(join(path, 'folder with spaces', 'test.txt'))
 
     def test_cancel_execution_with_terminate(self):
-        if os.name is 'nt':
+        if os.name == 'nt':
             prog = "C:\\Windows\\System32\\cmd.exe"
             args = ["/c", "notepad.exe"]
             return_code = '15'
@@ -111,16 +231,15 @@ class TestCommands(EventLoopTestCase):
             args = ['-c', '"sleep 100"']
             return_code = '143'  # TODO why not -15 ???
 
-        @asyncio.coroutine
-        def create_and_cancel_task():
+        async def create_and_cancel_task():
             task = self.loop.create_task(
                 client.command.execute(
                     random.choice(string.digits),
                     uuid4().hex, prog, args))
-            yield from asyncio.sleep(0.5)
+            await asyncio.sleep(0.5)
             task.cancel()
             print("canceled task")
-            result = yield from task
+            result = await task
             return result
 
         res = self.loop.run_until_complete(create_and_cancel_task())
@@ -130,26 +249,49 @@ class TestCommands(EventLoopTestCase):
         prog = sys.executable
         args = [join(getcwd(), 'applications', 'kill_me.py')]
 
-        if os.name is 'nt':
+        if os.name == 'nt':
             return_code = '15'
         else:
             return_code = '137'  # TODO why not -9 ???
 
-        @asyncio.coroutine
-        def create_and_cancel_task():
+        async def create_and_cancel_task():
             task = self.loop.create_task(
                 client.command.execute(
                     random.choice(string.digits),
                     uuid4().hex, prog, args))
-            yield from asyncio.sleep(0.5)
+            await asyncio.sleep(0.5)
             task.cancel()
             print("canceled task")
-            result = yield from task
+            result = await task
             return result
 
         res = self.loop.run_until_complete(create_and_cancel_task())
         self.assertEqual(return_code, res)
 
+    def test_execution_timeout(self):
+        if os.name == 'nt':
+            prog = "C:\\Windows\\System32\\cmd.exe"
+            args = ["/c", "ping 127.0.0.1 -n 100 >nul"]
+        else:
+            prog = "/bin/bash"
+            args = ['-c', '"sleep 100"']
+
+        cmd = Command(
+            'execute',
+            pid=random.choice(string.digits),
+            own_uuid=uuid4().hex,
+            path=prog,
+            arguments=args,
+        )
+        cmd.timeout = 0.5
+
+        start = self.loop.time()
+        status = self.loop.run_until_complete(RPC.execute(cmd))
+        self.assertLess(self.loop.time() - start, 10)
+
+        self.assertTrue(status.is_err())
+        self.assertIn('timed out after 0.5 seconds', status.payload['result'])
+
     def test_get_log(self):
         uuid = uuid4().hex
         message = ''.join([
@@ -180,12 +322,40 @@ class TestCommands(EventLoopTestCase):
             res['uuid'],
         )
 
+    def test_get_log_rate_limit_summarize(self):
+        uuid = uuid4().hex
+        self.assertEqual('0',
+                         self.loop.run_until_complete(
+                             client.command.execute(
+                                 random.choice(string.digits), uuid,
+                                 sys.executable,
+                                 ['-c', '"print(\'x\' * 100000)"'], 1000,
+                                 'summarize')))
+
+        res = self.loop.run_until_complete(client.command.get_log(uuid))
+        self.assertRegex(res['log'], r'\[\d+ bytes suppressed\]')
+        self.assertLess(len(res['log']), 100000)
+
+    def test_get_log_rate_limit_backpressure(self):
+        uuid = uuid4().hex
+        self.assertEqual('0',
+                         self.loop.run_until_complete(
+                             client.command.execute(
+                                 random.choice(string.digits), uuid,
+                                 sys.executable,
+                                 ['-c', '"print(\'x\' * 20000)"'], 20000,
+                                 'backpressure')))
+
+        res = self.loop.run_until_complete(client.command.get_log(uuid))
+        self.assertIn('x' * 20000, res['log'])
+        self.assertNotIn('suppressed', res['log'])
+
     def test_get_log_unknown_uuid(self):
         self.assertRaises(KeyError, self.loop.run_until_complete,
                           client.command.get_log('abcdefg'))
 
     def test_websocket_logging(self):
-        if os.name is 'nt':
+        if os.name == 'nt':
             prog = 'cmd'
 
             def sleep_hack(seconds):
@@ -202,65 +372,59 @@ class TestCommands(EventLoopTestCase):
             expected_log = b'0\n1\n'
         uuid = uuid4().hex
 
-        @asyncio.coroutine
-        def enable_logging():
-            yield from asyncio.sleep(1)
-            yield from client.command.enable_logging(uuid)
+        async def enable_logging():
+            await asyncio.sleep(1)
+            await client.command.enable_logging(uuid)
 
-        @asyncio.coroutine
-        def start_execution():
-            yield from client.command.execute(
+        async def start_execution():
+            await client.command.execute(
                 random.choice(string.digits), uuid, prog, args)
 
-        @asyncio.coroutine
-        def start_server():
+        async def start_server():
             finished = asyncio.Future()
 
-            @asyncio.coroutine
-            def websocket_handler(websocket, path):
+            async def websocket_handler(websocket, path):
                 self.assertEqual('/logs', path)
                 # receive log from file
-                json = yield from websocket.recv()
+                json = await websocket.recv()
                 log = Status.from_json(json).payload['log'].encode()
                 # ack
-                yield from websocket.send('')
+                await websocket.send('')
 
                 #receive dynamic log
                 while True:
-                    json = yield from websocket.recv()
+                    json = await websocket.recv()
                     # ack
                     msg = Status.from_json(json).payload['log'].encode()
                     log += msg
                     if msg == b'':
                         break
                     else:
-                        yield from websocket.send('')
+                        await websocket.send('')
                 self.assertIn(expected_log, log)
                 print('finished server')
                 finished.set_result(None)
 
-            server_handle = yield from websockets.serve(
+            server_handle = await websockets.serve(
                 websocket_handler, host='127.0.0.1', port=8750)
-            yield from finished
+            await finished
             server_handle.close()
-            yield from server_handle.wait_closed()
+            await server_handle.wait_closed()
 
-        @asyncio.coroutine
-        def wait_for_all():
-            tasks = {
+        async def wait_for_all():
+            await asyncio.gather(
                 start_server(),
                 start_execution(),
                 enable_logging(),
-            }
-            yield from asyncio.wait(tasks, return_when=asyncio.ALL_COMPLETED)
-            yield from client.command.disable_logging(uuid)
+            )
+            await client.command.disable_logging(uuid)
 
         LOGGER.url = 'ws://localhost:8750/logs'
 
         self.loop.run_until_complete(wait_for_all())
 
     def test_websocket_logging_early_disable(self):
-        if os.name is 'nt':
+        if os.name == 'nt':
             prog = 'cmd'
 
             def sleep_hack(seconds):
@@ -277,40 +441,35 @@ class TestCommands(EventLoopTestCase):
             expected_log = b'0\n'
         uuid = uuid4().hex
 
-        @asyncio.coroutine
-        def enable_logging():
-            yield from asyncio.sleep(1)
-            yield from client.command.enable_logging(uuid)
+        async def enable_logging():
+            await asyncio.sleep(1)
+            await client.command.enable_logging(uuid)
 
-        @asyncio.coroutine
-        def disable_logging():
-            yield from asyncio.sleep(4)
-            yield from client.command.disable_logging(uuid)
+        async def disable_logging():
+            await asyncio.sleep(4)
+            await client.command.disable_logging(uuid)
 
-        @asyncio.coroutine
-        def start_execution():
-            yield from client.command.execute(
+        async def start_execution():
+            await client.command.execute(
                 random.choice(string.digits), uuid, prog, args)
 
-        @asyncio.coroutine
-        def start_server():
+        async def start_server():
             finished = asyncio.Future()
 
-            @asyncio.coroutine
-            def websocket_handler(websocket, path):
+            async def websocket_handler(websocket, path):
                 self.assertEqual('/logs', path)
                 # receive log from file
-                json = yield from websocket.recv()
+                json = await websocket.recv()
                 log = Status.from_json(json).payload['log'].encode()
                 # ack
-                yield from websocket.send('')
+                await websocket.send('')
 
                 #receive dynamic log
                 while True:
                     try:
-                        json = yield from websocket.recv()
+                        json = await websocket.recv()
                         # ack
-                        yield from websocket.send('')
+                        await websocket.send('')
                         msg = Status.from_json(json).payload['log'].encode()
                         if msg == b'':
                             break
@@ -321,21 +480,19 @@ class TestCommands(EventLoopTestCase):
                 print('finished server')
                 finished.set_result(None)
 
-            server_handle = yield from websockets.serve(
+            server_handle = await websockets.serve(
                 websocket_handler, host='127.0.0.1', port=8750)
-            yield from finished
+            await finished
             server_handle.close()
-            yield from server_handle.wait_closed()
+            await server_handle.wait_closed()
 
-        @asyncio.coroutine
-        def wait_for_all():
-            tasks = {
+        async def wait_for_all():
+            await asyncio.gather(
                 start_server(),
                 start_execution(),
                 enable_logging(),
                 disable_logging(),
-            }
-            yield from asyncio.wait(tasks, return_when=asyncio.ALL_COMPLETED)
+            )
 
         LOGGER.url = 'ws://localhost:8750/logs'
 
@@ -435,6 +592,133 @@ class TestCommands(EventLoopTestCase):
         self.assertEqual(Status(**result[0]), response1)
         self.assertEqual(Status(**result[1]), response2)
 
+    def test_chain_command_dependencies(self):
+        result = self.loop.run_until_complete(
+            client.command.chain_execution(commands=[{
+                'method': 'execute',
+                'uuid': 'first',
+                'arguments': {},
+                'depends_on': [],
+            }, {
+                'method': 'online',
+                'uuid': 'second',
+                'arguments': {},
+            }, {
+                'method': 'online',
+                'uuid': 'third',
+                'arguments': {},
+                'depends_on': ['first'],
+            }, {
+                'method': 'online',
+                'uuid': 'fourth',
+                'arguments': {},
+                'depends_on': ['third', 'second'],
+            }, {
+                'method': 'online',
+                'uuid': 'fifth',
+                'arguments': {},
+                'depends_on': ['second'],
+            }]))
+
+        self.assertEqual(['first', 'second', 'third', 'fourth', 'fifth'],
+                         [Status(**res).uuid for res in result])
+        self.assertTrue(Status(**result[0]).is_err())
+        self.assertTrue(Status(**result[1]).is_ok())
+        self.assertEqual(
+            Status(**result[2]),
+            Status(
+                Status.ID_ERR,
+                {
+                    'method':
+                    'online',
+                    'result':
+                    'Could not execute because earlier command was not successful.',
+                },
+            ))
+        self.assertTrue(Status(**result[3]).is_err())
+        self.assertTrue(Status(**result[4]).is_ok())
+
+    def test_chain_command_parallel(self):
+        if os.name == 'nt':
+            prog = "C:\\Windows\\System32\\cmd.exe"
+            args = ["/c", "ping 127.0.0.1 -n 2 >nul"]
+        else:
+            prog = "/bin/sh"
+            args = ["-c", '"sleep 1"']
+
+        commands = [{
+            'method': 'execute',
+            'uuid': str(idx),
+            'arguments': {
+                'pid': idx,
+                'own_uuid': uuid4().hex,
+                'path': prog,
+                'arguments': args
+            },
+            'depends_on': [],
+        } for idx in range(3)]
+
+        start = self.loop.time()
+        result = self.loop.run_until_complete(
+            client.command.chain_execution(commands, parallelism=3))
+        duration = self.loop.time() - start
+
+        for res in result:
+            self.assertTrue(Status(**res).is_ok())
+        self.assertLess(duration, 2.5)
+
+    def test_chain_command_cycle(self):
+        result = self.loop.run_until_complete(
+            client.command.chain_execution(commands=[{
+                'method': 'online',
+                'uuid': 'first',
+                'arguments': {},
+                'depends_on': ['second'],
+            }, {
+                'method': 'online',
+                'uuid': 'second',
+                'arguments': {},
+                'depends_on': ['first'],
+            }, {
+                'method': 'online',
+                'uuid': 'third',
+                'arguments': {},
+                'depends_on': [],
+            }]))
+
+        self.assertIn('cyclic', Status(**result[0]).payload['result'])
+        self.assertIn('cyclic', Status(**result[1]).payload['result'])
+        self.assertTrue(Status(**result[2]).is_ok())
+
+    def test_chain_command_invalid_timeout(self):
+        commands = [{
+            'method': 'online',
+            'uuid': uuid,
+            'arguments': {},
+            'timeout': timeout,
+        } for (uuid, timeout) in [('word', 'soon'), ('negative', -1),
+                                  ('valid', 1)]]
+
+        result = self.loop.run_until_complete(
+            client.command.chain_execution(commands=commands))
+
+        # steps with an invalid timeout are not executed
+        self.assertEqual(['valid'], [Status(**res).uuid for res in result])
+        self.assertTrue(Status(**result[0]).is_ok())
+
+    def test_chain_command_unknown_dependency(self):
+        self.assertRaisesRegex(
+            ValueError,
+            'unknown command',
+            self.loop.run_until_complete,
+            client.command.chain_execution(commands=[{
+                'method': 'online',
+                'uuid': 'first',
+                'arguments': {},
+                'depends_on': ['second'],
+            }]),
+        )
+
 
 class FileCommandFilesTests(FileSystemTestCase):
     @classmethod
@@ -462,6 +746,43 @@ class FileCommandFilesTests(FileSystemTestCase):
 
         self.assertFilesArePresent(destination, backup, source)
 
+    def test_filesystem_move_cancelled(self):
+        (source, _, _) = self.provideFile("test.abc")
+        (destination, content, _) = self.provideFile("test.abc.link")
+        backup = destination + self.backup_ending
+
+        def copy_file(_source,
+                      destination,
+                      _checkpoint,
+                      _algorithm=None,
+                      _progress=None):
+            with open(destination, 'w') as partial:
+                partial.write('partial')
+            raise Cancelled()
+
+        original = client.command.sh.copy_file
+        client.command.sh.copy_file = copy_file
+        try:
+            self.assertRaises(
+                Cancelled,
+                self.loop.run_until_complete,
+                client.command.filesystem_move(
+                    source,
+                    "file",
+                    destination,
+                    "file",
+                    self.backup_ending,
+                ),
+            )
+        finally:
+            client.command.sh.copy_file = original
+
+        # the old destination is restored
+        self.assertFilesArePresent(source, destination)
+        self.assertFilesAreNotPresent(backup)
+        with open(destination) as restored:
+            self.assertEqual(content, restored.read())
+
     def test_filesystem_move_destination_not_exists(self):
         (source, _, _) = self.provideFile("test.abc")
         destination = self.joinPath("test.abc.link")
@@ -826,6 +1147,84 @@ class FileCommandFilesTests(FileSystemTestCase):
         self.assertFilesArePresent(source)
         self.assertFilesAreNotPresent(backup, destination)
 
+    def test_filesystem_move_link(self):
+        (source, content, _) = self.provideFile("test.abc")
+        (destination, old_content, _) = self.provideFile("test.abc.link")
+        backup = destination + self.backup_ending
+
+        self.assertEqual(
+            client.shorthand.hash_file(source),
+            self.loop.run_until_complete(
+                client.command.filesystem_move(
+                    source,
+                    "file",
+                    destination,
+                    "file",
+                    self.backup_ending,
+                    "link",
+                )),
+        )
+
+        self.assertFilesArePresent(source, destination, backup)
+        self.assertTrue(os.path.samefile(source, destination))
+        with open(destination) as linked:
+            self.assertEqual(content, linked.read())
+
+        self.loop.run_until_complete(
+            client.command.filesystem_restore(
+                source,
+                "file",
+                destination,
+                "file",
+                self.backup_ending,
+                "",
+            ))
+
+        self.assertFilesArePresent(source, destination)
+        self.assertFilesAreNotPresent(backup)
+        with open(source) as original:
+            self.assertEqual(content, original.read())
+        with open(destination) as restored:
+            self.assertEqual(old_content, restored.read())
+
+    def test_filesystem_move_symlink(self):
+        (source, content, _) = self.provideFile("test.abc")
+        destination = self.joinPath("test.abc.link")
+
+        def link(_source, _destination):
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+        original = client.shorthand.os.link
+        client.shorthand.os.link = link
+        try:
+            self.loop.run_until_complete(
+                client.command.filesystem_move(
+                    source,
+                    "file",
+                    destination,
+                    "file",
+                    self.backup_ending,
+                    "link",
+                ))
+        finally:
+            client.shorthand.os.link = original
+
+        self.assertTrue(os.path.islink(destination))
+
+        self.loop.run_until_complete(
+            client.command.filesystem_restore(
+                source,
+                "file",
+                destination,
+                "file",
+                self.backup_ending,
+                "",
+            ))
+
+        self.assertFalse(os.path.lexists(destination))
+        with open(source) as original_file:
+            self.assertEqual(content, original_file.read())
+
 
 class FileCommandDirsTests(FileSystemTestCase):
     @classmethod
@@ -1100,6 +1499,51 @@ class FileCommandDirsTests(FileSystemTestCase):
                                 files_destination,
                             )))
 
+    def test_filesystem_restore_trash(self):
+        (source, _, hash_source) = self.provideFilledDirectory(
+            "test.abc", [("sub", "first.txt"), ("", "second.txt")])
+        destination_path = self.provideDirectory("this_is_my_folder")
+        (destination, files_destination, _) = self.provideFilledDirectory(
+            "this_is_my_folder/test.abc", [("", "old.txt")])
+        trash = self.joinPath("trash")
+
+        self.loop.run_until_complete(
+            client.command.filesystem_move(
+                source,
+                "dir",
+                destination_path,
+                "dir",
+                self.backup_ending,
+            ))
+
+        removed = []
+        remove_path = client.trash.remove_path
+        client.trash.remove_path = lambda path: (removed.append(path),
+                                                 remove_path(path))
+        TRASH.root = trash
+        try:
+            self.loop.run_until_complete(
+                client.command.filesystem_restore(
+                    source,
+                    "dir",
+                    destination_path,
+                    "dir",
+                    self.backup_ending,
+                    hash_source,
+                ))
+            TRASH.join()
+        finally:
+            TRASH.root = None
+            client.trash.remove_path = remove_path
+
+        self.assertDirEqual(destination,
+                            [hash_value for (_, _, hash_value) in files_destination])
+        # the deployed directory was deleted within the trash
+        self.assertEqual(1, len(removed))
+        self.assertEqual(trash, os.path.dirname(removed[0]))
+        self.assertTrue(removed[0].endswith('-test.abc'))
+        self.assertEqual([], os.listdir(trash))
+
     def test_filesystem_restore_no_destination_with_backup(self):
         (source, _, hash_source) = self.provideFilledDirectory("test.abc")
         destination = self.joinPath("test.abc.link")
@@ -1218,6 +1662,245 @@ class FileCommandDirsTests(FileSystemTestCase):
         self.assertDirsArePresent(source)
         self.assertDirsAreNotPresent(backup, destination)
 
+    def test_filesystem_move_link(self):
+        (source, _, _) = self.provideFilledDirectory("test.abc")
+        destination = self.joinPath("test.abc.link")
+
+        self.assertEqual(
+            client.shorthand.hash_directory(source),
+            self.loop.run_until_complete(
+                client.command.filesystem_move(
+                    source,
+                    "dir",
+                    destination,
+                    "file",
+                    self.backup_ending,
+                    "link",
+                )),
+        )
+
+        self.assertDirsEqual("test.abc", "test.abc.link")
+        for root, _, fils in os.walk(destination):
+            for fil in fils:
+                self.assertGreater(
+                    os.stat(os.path.join(root, fil)).st_nlink, 1)
+
+        self.loop.run_until_complete(
+            client.command.filesystem_restore(
+                source,
+                "dir",
+                destination,
+                "file",
+                self.backup_ending,
+                "",
+            ))
+
+        self.assertDirsArePresent(source)
+        self.assertDirsAreNotPresent(destination)
+
+    def test_filesystem_restore_directory_symlink(self):
+        (source, files, _) = self.provideFilledDirectory(
+            "test.abc", [("", "a"), ("sub", "b")])
+        destination = self.joinPath("test.abc.link")
+        os.symlink(source, destination, target_is_directory=True)
+
+        self.loop.run_until_complete(
+            client.command.filesystem_restore(
+                source,
+                "dir",
+                destination,
+                "file",
+                self.backup_ending,
+                "",
+            ))
+
+        # only the link is removed
+        self.assertFalse(os.path.lexists(destination))
+        self.assertFilesArePresent(*[path for (path, _, _) in files])
+
+    def test_filesystem_move_sync(self):
+        (source, _, _) = self.provideFilledDirectory(
+            "test.abc", [("", "same"), ("", "changed"), ("", "new"),
+                         ("sub", "added"), ("", "type")])
+        (destination, _, _) = self.provideFilledDirectory(
+            "test.abc.link", [("", "changed"), ("", "removed"),
+                              ("gone", "file")])
+        backup = destination + self.backup_ending
+        os.mkdir(os.path.join(destination, "type"))
+        shutil.copy2(
+            os.path.join(source, "same"), os.path.join(destination, "same"))
+
+        def snapshot():
+            result = {}
+            for root, dirs, fils in os.walk(destination):
+                for name in dirs:
+                    result[os.path.join(root, name)] = None
+                for name in fils:
+                    with open(os.path.join(root, name)) as fil:
+                        result[os.path.join(root, name)] = fil.read()
+            return result
+
+        before = snapshot()
+        same_inode = os.stat(os.path.join(destination, "same")).st_ino
+
+        hash_value = self.loop.run_until_complete(
+            client.command.filesystem_move(
+                source,
+                "dir",
+                destination,
+                "file",
+                self.backup_ending,
+                "sync",
+            ))
+
+        self.assertEqual(client.shorthand.hash_directory(source), hash_value)
+        self.assertDirsEqual("test.abc", "test.abc.link")
+        self.assertFalse(os.path.exists(os.path.join(destination, "gone")))
+        # the unchanged file was not copied
+        self.assertEqual(same_inode,
+                         os.stat(os.path.join(destination, "same")).st_ino)
+        self.assertTrue(client.shorthand.is_sync_backup(backup))
+
+        # a second sync has nothing to copy
+        os.rename(backup, backup + "2")
+        strategies = client.shorthand.sync_directory(source, destination,
+                                                     backup)
+        self.assertEqual({client.shorthand.UNCHANGED: 5}, strategies)
+        client.shorthand.rollback_sync(destination, backup)
+        os.rename(backup + "2", backup)
+
+        self.loop.run_until_complete(
+            client.command.filesystem_restore(
+                source,
+                "dir",
+                destination,
+                "file",
+                self.backup_ending,
+                hash_value,
+            ))
+
+        self.assertEqual(before, snapshot())
+        self.assertDirsAreNotPresent(backup)
+
+    def test_filesystem_move_sync_after_copy(self):
+        (source, _, _) = self.provideFilledDirectory(
+            "test.abc", [("", "file{}".format(idx)) for idx in range(19)] +
+            [("sub", "changed")])
+        destination = self.joinPath("test.abc.link")
+
+        self.loop.run_until_complete(
+            client.command.filesystem_move(source, "dir", destination,
+                                           "file", self.backup_ending))
+
+        with open(os.path.join(source, "sub", "changed"), 'a') as fil:
+            fil.write('changed')
+
+        strategies = client.shorthand.sync_directory(
+            source, destination, destination + self.backup_ending)
+
+        # only the changed file is copied
+        self.assertEqual(19, strategies.pop(client.shorthand.UNCHANGED))
+        self.assertEqual([1], list(strategies.values()))
+        self.assertDirsEqual("test.abc", "test.abc.link")
+
+    @unittest.skipIf(os.name != 'posix' or os.geteuid() == 0,
+                     'root can write into read-only directories')
+    def test_filesystem_move_sync_read_only(self):
+        (source, _, _) = self.provideFilledDirectory(
+            "test.abc", [("ro", "changed"), ("ro", "kept"),
+                         ("ro/gone", "file")])
+        destination = self.joinPath("test.abc.link")
+        backup = destination + self.backup_ending
+        for path in ("ro/gone", "ro"):
+            os.chmod(os.path.join(source, path), 0o555)
+
+        try:
+            self.loop.run_until_complete(
+                client.command.filesystem_move(source, "dir", destination,
+                                               "file", self.backup_ending))
+            before = self.fileHashesInDir(destination)
+
+            os.chmod(os.path.join(source, "ro"), 0o755)
+            with open(os.path.join(source, "ro", "changed"), 'a') as fil:
+                fil.write('changed')
+            with open(os.path.join(source, "ro", "added"), 'w') as fil:
+                fil.write('added')
+            client.shorthand.remove_path(os.path.join(source, "ro", "gone"))
+            os.chmod(os.path.join(source, "ro"), 0o555)
+
+            hash_value = self.loop.run_until_complete(
+                client.command.filesystem_move(source, "dir", destination,
+                                               "file", self.backup_ending,
+                                               "sync"))
+
+            self.assertDirsEqual("test.abc", "test.abc.link")
+            self.assertEqual(
+                0o555,
+                stat.S_IMODE(os.stat(os.path.join(destination, "ro")).st_mode))
+            self.assertEqual(
+                0o555,
+                stat.S_IMODE(
+                    os.stat(os.path.join(backup, "files", "ro",
+                                         "gone")).st_mode))
+
+            self.loop.run_until_complete(
+                client.command.filesystem_restore(source, "dir", destination,
+                                                  "file", self.backup_ending,
+                                                  hash_value))
+
+            self.assertEqual(sorted(before),
+                             sorted(self.fileHashesInDir(destination)))
+            for path in ("ro/gone", "ro"):
+                self.assertEqual(
+                    0o555,
+                    stat.S_IMODE(
+                        os.stat(os.path.join(destination, path)).st_mode))
+            self.assertDirsAreNotPresent(backup)
+        finally:
+            for path in (source, destination, backup):
+                if os.path.lexists(path):
+                    client.shorthand.remove_path(path)
+
+    def test_filesystem_move_sync_cancelled(self):
+        (source, _, _) = self.provideFilledDirectory(
+            "test.abc", [("", "a"), ("sub", "b")])
+        (destination, _, _) = self.provideFilledDirectory(
+            "test.abc.link", [("", "a"), ("", "c")])
+        backup = destination + self.backup_ending
+        before = self.fileHashesInDir(destination)
+
+        def copy_file(_source,
+                      destination,
+                      _checkpoint,
+                      _algorithm=None,
+                      _progress=None):
+            with open(destination, 'w') as partial:
+                partial.write('partial')
+            raise Cancelled()
+
+        original = client.shorthand.copy_file
+        client.shorthand.copy_file = copy_file
+        try:
+            self.assertRaises(
+                Cancelled,
+                self.loop.run_until_complete,
+                client.command.filesystem_move(
+                    source,
+                    "dir",
+                    destination,
+                    "file",
+                    self.backup_ending,
+                    "sync",
+                ),
+            )
+        finally:
+            client.shorthand.copy_file = original
+
+        self.assertEqual(sorted(before),
+                         sorted(self.fileHashesInDir(destination)))
+        self.assertFalse(os.path.exists(os.path.join(destination, "sub")))
+        self.assertDirsAreNotPresent(backup)
+
 
 class FileCommandGenericTests(FileSystemTestCase):
     @classmethod
@@ -1244,6 +1927,379 @@ class FileCommandGenericTests(FileSystemTestCase):
             self.joinPath("test"),
         )
 
+    def test_hash_dir_parallel(self):
+        (path, _, _) = self.provideFilledDirectory("test")
+        expected = client.shorthand.hash_directory(path, workers=1)
+
+        # the result does not depend on the threads or the buffer
+        for workers in [1, 2, 8]:
+            for buffer_size in [1, 7, 1 << 20]:
+                self.assertEqual(
+                    expected,
+                    client.shorthand.hash_directory(
+                        path, workers=workers, buffer_size=buffer_size),
+                )
+
+    def test_hash_dir_merkle(self):
+        (path, _, _) = self.provideFilledDirectory(
+            "test", [("", "a"), ("sub", "b")])
+        os.chmod(os.path.join(path, "a"), 0o644)
+        os.chmod(os.path.join(path, "sub"), 0o755)
+        os.chmod(os.path.join(path, "sub", "b"), 0o600)
+
+        def digest(lines):
+            return hashlib.md5(''.join(lines).encode()).hexdigest()
+
+        hash_a = client.shorthand.hash_file(os.path.join(path, "a"))
+        hash_b = client.shorthand.hash_file(os.path.join(path, "sub", "b"))
+        hash_sub = digest(["file 600 {}\0b\0".format(hash_b)])
+        self.assertEqual(
+            digest([
+                "file 644 {}\0a\0".format(hash_a),
+                "dir 755 {}\0sub\0".format(hash_sub),
+            ]),
+            client.shorthand.hash_directory(path),
+        )
+
+        tree = client.shorthand.hash_tree(path)
+        self.assertEqual(hash_sub, tree['entries']['sub']['hash'])
+        self.assertEqual(hash_b, tree['entries']['sub']['entries']['b']['hash'])
+        self.assertNotIn('entries', client.shorthand.prune_tree(
+            tree, 1)['entries']['sub'])
+
+        # the same content with another mode or name has another hash
+        before = tree['hash']
+        os.chmod(os.path.join(path, "a"), 0o755)
+        self.assertNotEqual(before, client.shorthand.hash_directory(path))
+        os.chmod(os.path.join(path, "a"), 0o644)
+        os.rename(os.path.join(path, "a"), os.path.join(path, "c"))
+        self.assertNotEqual(before, client.shorthand.hash_directory(path))
+
+    def test_hash_dir_independent_of_order(self):
+        contents = [("a", "1"), ("b", "2"), (os.path.join("x", "c"), "3")]
+        for (directory, order) in [("first", contents),
+                                   ("second", reversed(contents))]:
+            self.provideDirectory(directory)
+            self.provideDirectory(os.path.join(directory, "x"))
+            for (name, data) in order:
+                self.provideFile(os.path.join(directory, name), data)
+
+        self.assertEqual(
+            client.shorthand.hash_directory(self.joinPath("first")),
+            client.shorthand.hash_directory(self.joinPath("second")))
+
+    def test_filesystem_tree(self):
+        (path, _, _) = self.provideFilledDirectory(
+            "test", [("", "a"), (os.path.join("sub", "deep"), "b")])
+
+        tree = self.loop.run_until_complete(
+            client.command.filesystem_tree(path))
+        self.assertEqual(client.shorthand.hash_directory(path), tree['hash'])
+        self.assertEqual(['a', 'sub'], sorted(tree['entries']))
+        self.assertNotIn('entries', tree['entries']['sub'])
+
+        subtree = self.loop.run_until_complete(
+            client.command.filesystem_tree(
+                os.path.join(path, "sub"), 2, "sha256"))
+        self.assertEqual(
+            client.shorthand.hash_directory(
+                os.path.join(path, "sub"), algorithm="sha256"),
+            subtree['hash'])
+        self.assertIn('b', subtree['entries']['deep']['entries'])
+
+        self.assertRaises(ValueError, self.loop.run_until_complete,
+                          client.command.filesystem_tree(path, -1))
+
+    def test_filesystem_hash(self):
+        (path, _, hash_value) = self.provideFile("test.abc")
+        (directory, _, _) = self.provideFilledDirectory("test")
+
+        self.assertEqual(
+            hash_value,
+            self.loop.run_until_complete(
+                client.command.filesystem_hash(path)))
+        self.assertEqual(
+            client.shorthand.hash_directory(directory, algorithm="sha1"),
+            self.loop.run_until_complete(
+                client.command.filesystem_hash(directory, "sha1")))
+        self.assertRaises(
+            FileNotFoundError, self.loop.run_until_complete,
+            client.command.filesystem_hash(self.joinPath("missing")))
+
+    def test_filesystem_commands_in_parallel(self):
+        (first, _, _) = self.provideFile("first")
+        (second, _, _) = self.provideFile("second")
+        barrier = threading.Barrier(2, timeout=5)
+
+        def copy_file(_source,
+                      destination,
+                      _checkpoint,
+                      _algorithm=None,
+                      _progress=None):
+            # only passes if both commands copy at the same time
+            barrier.wait()
+            with open(destination, 'w') as fil:
+                fil.write('copy')
+            return ('hash', client.shorthand.BUFFER)
+
+        async def run():
+            commands = [
+                RPC.execute(
+                    Command(
+                        'filesystem_move',
+                        source_path=source,
+                        source_type='file',
+                        destination_path=source + '.copy',
+                        destination_type='file',
+                        backup_ending=self.backup_ending,
+                    )) for source in [first, second]
+            ]
+            moves = asyncio.gather(*commands)
+
+            # the event loop is not blocked meanwhile
+            online = await RPC.execute(Command('online'))
+            return (online, await moves)
+
+        original = client.command.sh.copy_file
+        client.command.sh.copy_file = copy_file
+        try:
+            (online, results) = self.loop.run_until_complete(run())
+        finally:
+            client.command.sh.copy_file = original
+
+        self.assertTrue(online.is_ok())
+        for status in results:
+            self.assertTrue(status.is_ok(), status.payload)
+            self.assertEqual('hash', status.payload['result'])
+
+    def test_filesystem_move_progress(self):
+        (source, _, _) = self.provideFilledDirectory(
+            "test", [("", "a"), ("sub", "b")])
+        size = sum(
+            os.path.getsize(os.path.join(root, fil))
+            for (root, _, files) in os.walk(source) for fil in files)
+        events = []
+
+        async def push(uuid, method, event, data=None):
+            events.append((uuid, method, event, data))
+            return True
+
+        def move(destination, **kwargs):
+            cmd = Command(
+                'filesystem_move',
+                source_path=source,
+                source_type='dir',
+                destination_path=destination,
+                destination_type='file',
+                backup_ending=self.backup_ending,
+                **kwargs)
+            status = self.loop.run_until_complete(RPC.execute(cmd))
+            self.assertTrue(status.is_ok(), status.payload)
+            return cmd
+
+        EVENTS.push = push
+        try:
+            move(self.joinPath("quiet"))
+            self.assertEqual([], events)
+
+            cmd = move(self.joinPath("copy"), progress=True)
+        finally:
+            del EVENTS.push
+
+        # the last event is pushed after the copy is done
+        (uuid, method, event, data) = events[-1]
+        self.assertEqual(cmd.uuid, uuid)
+        self.assertEqual('filesystem_move', method)
+        self.assertEqual('progress', event)
+        self.assertEqual(size, data['bytes'])
+        self.assertEqual(size, data['total_bytes'])
+        self.assertEqual(2, data['files'])
+        self.assertEqual(2, data['total_files'])
+        self.assertEqual(0.0, data['eta'])
+
+    def test_copy_file_hash(self):
+        (source, data, hash_value) = self.provideFile("test.abc")
+        destination = self.joinPath("test.abc.copy")
+
+        (value, strategy) = client.shorthand.copy_file(source, destination)
+        self.assertEqual(hash_value, value)
+        self.assertIn(strategy,
+                      [client.shorthand.REFLINK, client.shorthand.BUFFER])
+        with open(destination) as fil:
+            self.assertEqual(data, fil.read())
+
+    def test_copy_file_kernel(self):
+        (source, data, hash_value) = self.provideFile("test.abc")
+        destination = self.joinPath("test.abc.copy")
+        old = os.stat(source).st_mtime - 60
+        os.utime(source, (old, old))
+
+        # the kernel only copies files with a cached hash
+        self.assertEqual(hash_value, client.shorthand.hash_file(source))
+        (value, strategy) = client.shorthand.copy_file(source, destination)
+        self.assertEqual(hash_value, value)
+        if sys.platform.startswith('linux'):
+            self.assertIn(strategy, [
+                client.shorthand.REFLINK, client.shorthand.COPY_FILE_RANGE,
+                client.shorthand.SENDFILE
+            ])
+        with open(destination) as fil:
+            self.assertEqual(data, fil.read())
+
+    def test_copy_file_strategies(self):
+        (source, data, hash_value) = self.provideFile("test.abc")
+        old = os.stat(source).st_mtime - 60
+        os.utime(source, (old, old))
+        client.shorthand.hash_file(source)
+
+        strategies = client.shorthand.COPY_STRATEGIES
+        try:
+            for strategy in strategies:
+                client.shorthand.COPY_STRATEGIES = [strategy, 'buffer']
+                destination = self.joinPath("test.abc." + strategy)
+
+                self.assertEqual(
+                    hash_value,
+                    client.shorthand.copy_file(source, destination)[0])
+                with open(destination) as fil:
+                    self.assertEqual(data, fil.read())
+
+            client.shorthand.COPY_STRATEGIES = []
+            self.assertRaises(ValueError, client.shorthand.copy_file, source,
+                              self.joinPath("test.abc.none"))
+        finally:
+            client.shorthand.COPY_STRATEGIES = strategies
+
+    def test_copy_file_preallocated(self):
+        (source, data, hash_value) = self.provideFile("test.abc")
+        destination = self.joinPath("test.abc.copy")
+        calls = []
+
+        def preallocate(destination_fd, size):
+            calls.append(size)
+            original(destination_fd, size)
+            # the reserved space does not change the size
+            self.assertEqual(0, os.fstat(destination_fd).st_size)
+
+        original = client.shorthand._preallocate
+        strategies = client.shorthand.COPY_STRATEGIES
+        min_size = client.shorthand.PREALLOCATE_MIN_SIZE
+        client.shorthand._preallocate = preallocate
+        client.shorthand.COPY_STRATEGIES = ['buffer']
+        client.shorthand.PREALLOCATE_MIN_SIZE = 1
+        try:
+            self.assertEqual(
+                hash_value,
+                client.shorthand.copy_file(source, destination)[0])
+        finally:
+            client.shorthand._preallocate = original
+            client.shorthand.COPY_STRATEGIES = strategies
+            client.shorthand.PREALLOCATE_MIN_SIZE = min_size
+
+        self.assertEqual([len(data)], calls)
+        with open(destination) as fil:
+            self.assertEqual(data, fil.read())
+
+    def test_copy_directory_hash(self):
+        (source, _, _) = self.provideFilledDirectory("test")
+        destination = self.joinPath("test.copy")
+
+        for workers in [1, 4]:
+            (value, strategies) = client.shorthand.copy_directory(
+                source, destination, workers=workers)
+            self.assertEqual(client.shorthand.hash_directory(source), value)
+            self.assertEqual(
+                len(self.fileHashesInDir("test")), sum(strategies.values()))
+            self.assertDirsEqual("test", "test.copy")
+            shutil.rmtree(destination)
+
+    def test_copy_directory_progress(self):
+        (source, _, _) = self.provideFilledDirectory(
+            "test", [("", "a"), ("sub", "b"), ("sub/deep", "c")])
+        size = sum(
+            os.path.getsize(os.path.join(root, fil))
+            for (root, _, files) in os.walk(source) for fil in files)
+        reports = []
+        progress = Progress(reports.append, interval=3600)
+
+        client.shorthand.copy_directory(
+            source, self.joinPath("test.copy"), progress=progress)
+        # unchanged files are taken from the cache and counted as well
+        client.shorthand.hash_directory(source, progress=progress)
+        self.assertEqual([], reports)
+
+        progress.finish()
+        self.assertEqual(2 * size, reports[0]['bytes'])
+        self.assertEqual(2 * size, reports[0]['total_bytes'])
+        self.assertEqual(6, reports[0]['files'])
+        self.assertEqual(6, reports[0]['total_files'])
+
+    def test_hash_algorithms(self):
+        (path, data, hash_value) = self.provideFile("test.abc")
+
+        self.assertEqual(hash_value, client.shorthand.hash_file(path))
+        for algorithm in client.shorthand.HASH_ALGORITHMS:
+            value = client.shorthand.hash_file(path, algorithm=algorithm)
+            self.assertEqual(
+                (algorithm, hashlib.new(algorithm, data.encode()).hexdigest()),
+                client.shorthand.parse_hash(value))
+            if algorithm != 'md5':
+                self.assertTrue(value.startswith(algorithm + ':'))
+
+        self.assertRaisesRegex(ValueError, "hash algorithm `crc32`",
+                               client.shorthand.hash_file, path, None, None,
+                               'crc32')
+        self.assertRaises(ValueError, client.shorthand.parse_hash,
+                          'crc32:abc')
+
+    def test_filesystem_move_hash_algorithm(self):
+        (source, _, _) = self.provideFilledDirectory("test")
+        destination = self.joinPath("test.copy")
+
+        hash_value = self.loop.run_until_complete(
+            client.command.filesystem_move(
+                source,
+                "dir",
+                destination,
+                "file",
+                self.backup_ending,
+                hash_algorithm="blake2b",
+            ))
+
+        self.assertTrue(hash_value.startswith("blake2b:"))
+        self.assertEqual(
+            client.shorthand.hash_directory(destination, algorithm="blake2b"),
+            hash_value)
+        self.assertNotEqual(
+            client.shorthand.hash_directory(destination, algorithm="sha256"),
+            hash_value)
+
+        self.loop.run_until_complete(
+            client.command.filesystem_restore(
+                source,
+                "dir",
+                destination,
+                "file",
+                self.backup_ending,
+                hash_value,
+            ))
+        self.assertDirsAreNotPresent(destination)
+
+    def test_hash_dir_parallel_error(self):
+        (path, _, _) = self.provideFilledDirectory(
+            "test", [("", "a"), ("", "b"), ("", "c")])
+
+        def checkpoint():
+            raise Cancelled()
+
+        self.assertRaises(
+            Cancelled,
+            client.shorthand.hash_directory,
+            path,
+            checkpoint,
+            2,
+        )
+
     def test_filesystem_move_source_not_exists_wrong_type_dir(self):
         (source, _, _) = self.provideFile("test.abc")
         destination = self.joinPath("test.abc.link")
@@ -0,0 +1,142 @@
+"""
+Unit tests for the module client.dispatcher.
+"""
+#pylint: disable=C0111, C0103
+import asyncio
+
+from utils import Command, Status
+
+from .testcases import EventLoopTestCase
+from client.dispatcher import Dispatcher
+from client.rpc import RpcRegistry, CONTROL
+
+
+class TestDispatcher(EventLoopTestCase):
+    def setUp(self):
+        self.registry = RpcRegistry()
+        self.gate = asyncio.Event()
+
+        @self.registry.method
+        async def block():
+            await self.gate.wait()
+            return 'done'
+
+        @self.registry.method
+        async def echo(value):
+            return value
+
+    def submit(self, dispatcher, *cmds):
+        """
+        Submits the commands inside of the event loop.
+        """
+
+        async def submit():
+            for cmd in cmds:
+                dispatcher.submit(cmd)
+
+        self.loop.run_until_complete(submit())
+
+    def collect(self, dispatcher, number):
+        """
+        Waits until `number` commands finished and returns their results.
+        """
+
+        async def collect():
+            results = []
+            while len(results) < number:
+                await asyncio.wait_for(dispatcher.wait(), 5)
+                entry = dispatcher.pop_finished()
+                while entry is not None:
+                    results.append(entry)
+                    entry = dispatcher.pop_finished()
+            return results
+
+        return self.loop.run_until_complete(collect())
+
+    def test_execute(self):
+        dispatcher = Dispatcher(registry=self.registry)
+        cmds = [Command('echo', value=idx) for idx in range(3)]
+        self.submit(dispatcher, *cmds)
+
+        results = self.collect(dispatcher, 3)
+        self.assertEqual([cmd.uuid for cmd in cmds],
+                         [uuid for (uuid, _, _) in results])
+        self.assertEqual([0, 1, 2],
+                         [result.payload['result'] for (_, result, _) in results])
+        self.assertEqual(0, len(dispatcher))
+        self.assertIsNone(dispatcher.pop_finished())
+
+    def test_queue(self):
+        dispatcher = Dispatcher(1, 1, registry=self.registry)
+        first = Command('block')
+        second = Command('echo', value=2)
+        self.submit(dispatcher, first)
+        self.submit(dispatcher, second)
+
+        self.assertIn(first.uuid, dispatcher.tasks)
+        self.assertIn(second.uuid, dispatcher.queued)
+
+        self.gate.set()
+        results = self.collect(dispatcher, 2)
+        self.assertEqual([first.uuid, second.uuid],
+                         [uuid for (uuid, _, _) in results])
+        self.assertEqual(2, results[1][1].payload['result'])
+
+    def test_reject(self):
+        dispatcher = Dispatcher(1, 0, registry=self.registry)
+        first = Command('block')
+        second = Command('echo', value=2)
+        self.submit(dispatcher, first)
+        self.submit(dispatcher, second)
+
+        (uuid, result, executed) = self.collect(dispatcher, 1)[0]
+        self.assertEqual(second.uuid, uuid)
+        self.assertEqual(Status.ID_ERR, result.status)
+        self.assertIn('busy', result.payload['result'])
+        self.assertFalse(executed)
+
+        self.gate.set()
+        self.assertEqual(first.uuid, self.collect(dispatcher, 1)[0][0])
+
+    def test_cancel(self):
+        dispatcher = Dispatcher(1, 1, registry=self.registry)
+        first = Command('block')
+        second = Command('echo', value=2)
+        self.submit(dispatcher, first)
+        self.submit(dispatcher, second)
+
+        # cancels the queued command
+        self.submit(dispatcher, second)
+        (uuid, result, executed) = self.collect(dispatcher, 1)[0]
+        self.assertEqual(second.uuid, uuid)
+        self.assertIn('cancelled', result.payload['result'])
+        self.assertFalse(executed)
+
+        # cancels the running command
+        self.submit(dispatcher, first)
+        (uuid, _, executed) = self.collect(dispatcher, 1)[0]
+        self.assertEqual(first.uuid, uuid)
+        self.assertTrue(executed)
+        self.assertEqual(0, len(dispatcher))
+
+    def test_invalid_limits(self):
+        self.assertRaises(ValueError, Dispatcher, 0)
+        self.assertRaises(ValueError, Dispatcher, 1, -1)
+
+    def test_control_lane_not_queued(self):
+        @self.registry.method(lane=CONTROL)
+        async def ping():
+            return 'pong'
+
+        dispatcher = Dispatcher(1, 0, registry=self.registry)
+        first = Command('block')
+        second = Command('ping')
+        self.submit(dispatcher, first, second)
+
+        (uuid, result, executed) = self.collect(dispatcher, 1)[0]
+        self.assertEqual(second.uuid, uuid)
+        self.assertEqual('pong', result.payload['result'])
+        self.assertTrue(executed)
+
+        self.gate.set()
+        self.assertEqual(first.uuid, self.collect(dispatcher, 1)[0][0])
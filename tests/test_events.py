@@ -0,0 +1,95 @@
+"""
+Unit tests for the module client.events.
+"""
+#pylint: disable=C0111, C0103
+import threading
+import unittest
+
+from client.events import Progress
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestProgress(unittest.TestCase):
+    def setUp(self):
+        self.reports = []
+        self.clock = Clock()
+        self.progress = Progress(
+            self.reports.append, interval=1.0, clock=self.clock)
+
+    def test_throttled(self):
+        self.progress.add_total(1000, 10)
+
+        for _ in range(5):
+            self.progress.advance(10)
+        self.assertEqual([], self.reports)
+
+        self.clock.now = 1.0
+        self.progress.advance(50, 1)
+        self.assertEqual(1, len(self.reports))
+        self.assertEqual({
+            'bytes': 100,
+            'total_bytes': 1000,
+            'files': 1,
+            'total_files': 10,
+            'throughput': 100.0,
+            'eta': 9.0,
+        }, self.reports[0])
+
+        # the interval starts again with the report
+        self.clock.now = 1.5
+        self.progress.advance(100)
+        self.assertEqual(1, len(self.reports))
+
+    def test_throughput_since_last_report(self):
+        self.progress.add_total(1000, 1)
+
+        self.clock.now = 1.0
+        self.progress.advance(100)
+        self.clock.now = 3.0
+        self.progress.advance(600)
+
+        self.assertEqual(2, len(self.reports))
+        self.assertEqual(300.0, self.reports[1]['throughput'])
+        self.assertEqual(1.0, self.reports[1]['eta'])
+
+    def test_no_eta_without_throughput(self):
+        self.progress.add_total(1000, 1)
+
+        self.clock.now = 1.0
+        self.progress.advance(0)
+        self.assertIsNone(self.reports[0]['eta'])
+
+    def test_finish(self):
+        self.progress.add_total(100, 2)
+        self.progress.advance(100, 2)
+        self.assertEqual([], self.reports)
+
+        self.progress.finish()
+        self.assertEqual(1, len(self.reports))
+        self.assertEqual(100, self.reports[0]['bytes'])
+        self.assertEqual(2, self.reports[0]['files'])
+        self.assertEqual(0.0, self.reports[0]['eta'])
+
+    def test_threads(self):
+        progress = Progress(self.reports.append, interval=0)
+
+        def advance():
+            for _ in range(1000):
+                progress.advance(1, 1)
+
+        threads = [threading.Thread(target=advance) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(4000, len(self.reports))
+        self.assertEqual(
+            list(range(1, 4001)), [report['bytes'] for report in self.reports])
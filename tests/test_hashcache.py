@@ -0,0 +1,122 @@
+"""
+Unit tests for the module client.hashcache.
+"""
+#pylint: disable=C0111, C0103
+import os
+import time
+
+from .testcases import FileSystemTestCase
+from client.hashcache import HashCache, HASH_CACHE
+import client.shorthand
+
+
+class TestHashCache(FileSystemTestCase):
+    def setUp(self):
+        super().setUp()
+        HASH_CACHE.clear()
+
+    def tearDown(self):
+        HASH_CACHE.clear()
+        super().tearDown()
+
+    def provideOldFile(self, rel_path, data=None):
+        (path, data, hash_value) = self.provideFile(rel_path, data)
+        old = time.time() - 60
+        os.utime(path, (old, old))
+        return (path, data, hash_value)
+
+    def test_get_put(self):
+        (path, _, _) = self.provideOldFile("test.txt")
+        cache = HashCache()
+        stat = os.stat(path)
+
+        self.assertIsNone(cache.get(stat, 'md5'))
+        cache.put(stat, 'md5', 'abc')
+        self.assertEqual('abc', cache.get(stat, 'md5'))
+        self.assertIsNone(cache.get(stat, 'sha256'))
+
+        # a modification changes the key
+        os.utime(path, (0, 0))
+        self.assertIsNone(cache.get(os.stat(path), 'md5'))
+
+    def test_rewrite_with_same_mtime(self):
+        (path, _, _) = self.provideOldFile("test.txt", "first")
+        cache = HashCache()
+        stat = os.stat(path)
+        cache.put(stat, 'md5', 'abc')
+        self.assertEqual('abc', cache.get(stat, 'md5'))
+
+        # like `cp -p`, the size and mtime do not change
+        with open(path, 'w') as fil:
+            fil.write('other')
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual(stat.st_mtime_ns, os.stat(path).st_mtime_ns)
+        self.assertIsNone(cache.get(os.stat(path), 'md5'))
+
+    def test_recently_modified_not_cached(self):
+        (path, _, _) = self.provideFile("test.txt")
+        cache = HashCache()
+        stat = os.stat(path)
+
+        cache.put(stat, 'md5', 'abc')
+        self.assertIsNone(cache.get(stat, 'md5'))
+        self.assertEqual(0, len(cache))
+
+    def test_max_size(self):
+        (first, _, _) = self.provideOldFile("first.txt")
+        (second, _, _) = self.provideOldFile("second.txt")
+        cache = HashCache(max_size=1)
+
+        cache.put(os.stat(first), 'md5', 'first')
+        cache.put(os.stat(second), 'md5', 'second')
+        self.assertEqual(1, len(cache))
+        self.assertIsNone(cache.get(os.stat(first), 'md5'))
+        self.assertEqual('second', cache.get(os.stat(second), 'md5'))
+
+    def test_persistence(self):
+        (path, _, _) = self.provideOldFile("test.txt")
+        cache_path = self.joinPath("hashes.json")
+
+        cache = HashCache()
+        cache.load(cache_path)
+        cache.put(os.stat(path), 'md5', 'abc')
+        cache.close()
+
+        cache = HashCache()
+        cache.load(cache_path)
+        self.assertEqual('abc', cache.get(os.stat(path), 'md5'))
+
+    def test_saved_after_sync_interval(self):
+        (path, _, _) = self.provideOldFile("test.txt")
+        cache_path = self.joinPath("hashes.json")
+
+        cache = HashCache(sync_interval=0)
+        cache.load(cache_path)
+        cache.put(os.stat(path), 'md5', 'abc')
+
+        cache = HashCache()
+        cache.load(cache_path)
+        self.assertEqual('abc', cache.get(os.stat(path), 'md5'))
+
+    def test_invalid_file(self):
+        cache_path = self.joinPath("hashes.json")
+        with open(cache_path, 'w') as cache_file:
+            cache_file.write('{"version": 1, "entries": [[1, 2')
+
+        cache = HashCache()
+        cache.load(cache_path)
+        self.assertEqual(0, len(cache))
+
+    def test_hash_file_uses_cache(self):
+        (path, _, hash_value) = self.provideOldFile("test.txt")
+
+        self.assertEqual(hash_value, client.shorthand.hash_file(path))
+        self.assertEqual(hash_value, HASH_CACHE.get(os.stat(path), 'md5'))
+
+        # the content is not read again for an unchanged file
+        HASH_CACHE.put(os.stat(path), 'md5', 'cached')
+        self.assertEqual('cached', client.shorthand.hash_file(path))
+
+        with open(path, 'a') as fil:
+            fil.write('changed')
+        self.assertNotEqual('cached', client.shorthand.hash_file(path))
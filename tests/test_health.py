@@ -0,0 +1,60 @@
+"""
+Unit tests for the module client.health.
+"""
+#pylint: disable=C0111, C0103
+import asyncio
+import os
+import time
+
+from .testcases import EventLoopTestCase
+from client.health import HealthMonitor
+from client.command import health
+
+
+class Receiver:
+    def __init__(self, tasks):
+        self.tasks = tasks
+
+
+class TestHealthMonitor(EventLoopTestCase):
+    def test_report_without_samples(self):
+        report = HealthMonitor().report()
+
+        self.assertIsNone(report['loop_lag'])
+        self.assertIsNone(report['max_loop_lag'])
+        self.assertEqual(0, report['in_flight'])
+        self.assertGreater(report['rss'], 0)
+        self.assertGreater(report['open_fds'], 0)
+        if os.name != 'nt':
+            self.assertEqual(3, len(report['load_average']))
+
+    def test_in_flight(self):
+        monitor = HealthMonitor()
+        monitor.receiver = Receiver({'a': None, 'b': None})
+        self.assertEqual(2, monitor.report()['in_flight'])
+
+    def test_loop_lag(self):
+        monitor = HealthMonitor(interval=0.05)
+
+        async def block():
+            await asyncio.sleep(0.01)
+            # blocks the event loop while the ticker sleeps
+            time.sleep(0.2)
+            await asyncio.sleep(0.1)
+
+        task = self.loop.create_task(monitor.run())
+        self.loop.run_until_complete(block())
+        task.cancel()
+        self.loop.run_until_complete(asyncio.wait([task]))
+
+        report = monitor.report()
+        self.assertGreaterEqual(report['max_loop_lag'], 0.1)
+        self.assertLess(report['loop_lag'], 0.1)
+
+    def test_health_rpc(self):
+        report = self.loop.run_until_complete(health())
+        self.assertIn('in_flight', report)
+        self.assertIn('running_programs', report)
+        self.assertIn('log_queues', report)
+        self.assertIn('copied_files', report)
+        self.assertIn('trash_pending', report)
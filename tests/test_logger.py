@@ -18,7 +18,7 @@ from uuid import uuid4
 from datetime import datetime
 
 from client import logger
-from client.logger import ClientLogger, RotatingFile
+from client.logger import ClientLogger, RotatingFile, TokenBucket
 
 
 class TestRotatingFile(TestCase):
@@ -88,6 +88,38 @@ class TestRotatingFile(TestCase):
         self.assertEqual(content_1 + content_2, file.read())
 
 
+class TestTokenBucket(TestCase):
+    def setUp(self):
+        self.now = 0.0
+
+    def clock(self):
+        return self.now
+
+    def test_take_up_to_capacity(self):
+        bucket = TokenBucket(100, 200, clock=self.clock)
+        self.assertEqual(150, bucket.take(150))
+        self.assertEqual(50, bucket.take(150))
+        self.assertEqual(0, bucket.take(150))
+
+    def test_take_refills(self):
+        bucket = TokenBucket(100, clock=self.clock)
+        self.assertEqual(100, bucket.take(1000))
+        self.now += 0.5
+        self.assertEqual(50, bucket.take(1000))
+        self.now += 10
+        self.assertEqual(100, bucket.take(1000))
+
+    def test_consume_debt(self):
+        bucket = TokenBucket(100, clock=self.clock)
+        self.assertEqual(0.0, bucket.consume(100))
+        self.assertAlmostEqual(2.0, bucket.consume(200))
+        self.now += 2
+        self.assertAlmostEqual(0.0, bucket.consume(0))
+
+    def test_invalid_rate(self):
+        self.assertRaises(ValueError, TokenBucket, 0)
+
+
 class TestLogger(TestCase):
     FOLDER = join(
         getcwd(),
@@ -165,3 +197,8 @@ class TestLogger(TestCase):
         self.assertIn(uuid, logger.LOGGER.program_loggers)
         self.assertEqual('localhost:8050', logger.LOGGER.url)
         logger.LOGGER.disable()
+
+    def test_rate_limit_off_by_default(self):
+        new_logger = ClientLogger()
+        self.assertEqual(0, new_logger.rate_limit)
+        self.assertEqual('summarize', new_logger.overflow)
@@ -0,0 +1,97 @@
+"""
+Unit tests for the module client.outbox.
+"""
+#pylint: disable=C0111, C0103
+import json
+import os
+
+from .testcases import FileSystemTestCase
+from client.outbox import Outbox
+
+
+def result(uuid):
+    return {'status': 'ok', 'payload': {'result': uuid}, 'uuid': uuid}
+
+
+class TestOutbox(FileSystemTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = self.joinPath('outbox.journal')
+
+    def lines(self):
+        with open(self.path) as journal:
+            return [json.loads(line) for line in journal]
+
+    def test_append_and_acknowledge(self):
+        outbox = Outbox(self.path)
+        outbox.append(result('a'))
+        outbox.append(result('b'))
+        outbox.append(result('c'))
+        outbox.acknowledge(['b', 'unknown'])
+
+        self.assertEqual([result('a'), result('c')], outbox.pending())
+        self.assertEqual(2, len(outbox))
+        outbox.close()
+
+        self.assertEqual([
+            {'result': result('a')},
+            {'result': result('b')},
+            {'result': result('c')},
+            {'ack': ['b']},
+        ], self.lines())
+
+    def test_sync(self):
+        outbox = Outbox(self.path)
+        outbox.append(result('a'))
+        outbox.sync()
+        self.assertEqual([{'result': result('a')}], self.lines())
+        outbox.close()
+
+    def test_reload(self):
+        outbox = Outbox(self.path)
+        outbox.append(result('a'))
+        outbox.append(result('b'))
+        outbox.acknowledge(['a'])
+        outbox.append(result('c'))
+        outbox.close()
+
+        outbox = Outbox(self.path)
+        self.assertEqual([result('b'), result('c')], outbox.pending())
+        outbox.close()
+
+        # the journal gets compacted on load
+        self.assertEqual([{
+            'result': result('b')
+        }, {
+            'result': result('c')
+        }], self.lines())
+
+    def test_reload_partial_line(self):
+        with open(self.path, 'w') as journal:
+            journal.write(json.dumps({'result': result('a')}) + '\n')
+            journal.write('{"result": {"sta')
+
+        outbox = Outbox(self.path)
+        self.assertEqual([result('a')], outbox.pending())
+        outbox.close()
+
+    def test_compact(self):
+        outbox = Outbox(self.path, compact_threshold=2)
+        outbox.append(result('a'))
+        outbox.append(result('b'))
+        outbox.append(result('c'))
+        outbox.acknowledge(['a'])
+        outbox.sync()
+        self.assertEqual(4, len(self.lines()))
+        outbox.acknowledge(['c'])
+
+        self.assertEqual([{'result': result('b')}], self.lines())
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+
+        outbox.append(result('d'))
+        outbox.close()
+        self.assertEqual([{
+            'result': result('b')
+        }, {
+            'result': result('d')
+        }], self.lines())
@@ -0,0 +1,519 @@
+"""
+Unit tests for the module client.receiver.
+"""
+#pylint: disable=C0111, C0103
+import asyncio
+import json
+import os
+import unittest
+
+from uuid import uuid4
+
+import websockets
+
+from utils import Command, Status
+
+from .testcases import EventLoopTestCase, FileSystemTestCase
+from client.receiver import RpcReceiver, parse_commands, split_commands
+from client.dispatcher import Dispatcher
+from client.rpc import RpcRegistry
+from client.events import EVENTS
+from client.outbox import Outbox
+from utils import ProtocolError
+
+
+class TestRpcReceiver(EventLoopTestCase):
+    PORT = 8752
+
+    def serve(self, messages, expected=None):
+        """
+        Starts a websocket server which sends the messages to the receiver and
+        collects all answers until the receiver sent `expected` (default:
+        `len(messages)`) answers.
+
+        Returns
+        -------
+            list of answers (parsed json)
+        """
+        answers = []
+        if expected is None:
+            expected = len(messages)
+        receiver = RpcReceiver('ws://127.0.0.1:{}/commands'.format(self.PORT))
+
+        async def handler(websocket, _path):
+            for message in messages:
+                await websocket.send(message)
+            while len(answers) < expected:
+                answers.append(json.loads(await websocket.recv()))
+            receiver.close()
+
+        async def run():
+            server = await websockets.serve(
+                handler, host='127.0.0.1', port=self.PORT)
+            EVENTS.receiver = receiver
+            try:
+                await asyncio.wait_for(receiver.run(), 10)
+            finally:
+                EVENTS.receiver = None
+                server.close()
+                await server.wait_closed()
+
+        self.loop.run_until_complete(run())
+        return answers
+
+    def test_online(self):
+        cmd = Command('online')
+        answers = self.serve([cmd.to_json()])
+
+        self.assertEqual(1, len(answers))
+        status = Status(**answers[0])
+        self.assertTrue(status.is_ok())
+        self.assertEqual(cmd.uuid, status.uuid)
+        self.assertEqual({'method': 'online', 'result': None}, status.payload)
+
+    def test_unknown_method(self):
+        cmd = Command('unknown')
+        answers = self.serve([cmd.to_json()])
+
+        status = Status(**answers[0])
+        self.assertTrue(status.is_err())
+        self.assertEqual(cmd.uuid, status.uuid)
+        self.assertIn('unknown function', status.payload['result'])
+
+    def test_invalid_arguments(self):
+        cmd = Command('get_log', target_uuid=42)
+        answers = self.serve(['no json', cmd.to_json()], 1)
+
+        status = Status(**answers[0])
+        self.assertTrue(status.is_err())
+        self.assertIn('target_uuid has to be str', status.payload['result'])
+
+    def test_batch(self):
+        cmds = [Command('online') for _ in range(3)]
+        answers = self.serve(
+            [json.dumps([dict(cmd) for cmd in cmds])], expected=1)
+
+        self.assertEqual(1, len(answers))
+        self.assertIsInstance(answers[0], list)
+        self.assertEqual(
+            set(cmd.uuid for cmd in cmds),
+            set(Status(**status).uuid for status in answers[0]),
+        )
+        for status in answers[0]:
+            self.assertTrue(Status(**status).is_ok())
+
+    def test_batch_with_invalid_entries(self):
+        cmds = [Command('online'), Command('online')]
+        invalid = {'method': 'online', 'uuid': 'invalid', 'arguments': 1}
+        data = [dict(cmds[0]), invalid, {'method': 'online'}, dict(cmds[1])]
+        answers = self.serve([json.dumps(data)], expected=1)
+
+        statuses = {
+            status.uuid: status
+            for status in (Status(**answer) for answer in answers[0])
+        }
+        self.assertEqual({cmds[0].uuid, cmds[1].uuid, 'invalid'},
+                         set(statuses))
+        self.assertTrue(statuses[cmds[0].uuid].is_ok())
+        self.assertTrue(statuses[cmds[1].uuid].is_ok())
+        self.assertTrue(statuses['invalid'].is_err())
+        self.assertEqual('online', statuses['invalid'].payload['method'])
+        self.assertIn('Args', statuses['invalid'].payload['result'])
+
+    def test_batch_and_single(self):
+        single = Command('online')
+        cmds = [Command('online'), Command('unknown')]
+        answers = self.serve([
+            json.dumps([dict(cmd) for cmd in cmds]),
+            single.to_json(),
+        ])
+
+        singles = [answer for answer in answers if isinstance(answer, dict)]
+        batches = [answer for answer in answers if isinstance(answer, list)]
+
+        self.assertEqual(1, len(singles))
+        self.assertEqual(single.uuid, Status(**singles[0]).uuid)
+        self.assertEqual(1, len(batches))
+        self.assertEqual(
+            set(cmd.uuid for cmd in cmds),
+            set(Status(**status).uuid for status in batches[0]),
+        )
+
+    def test_chain_steps_streamed(self):
+        cmd = Command(
+            'chain_execution',
+            commands=[{
+                'method': 'online',
+                'uuid': 'first',
+                'arguments': {},
+            }, {
+                'method': 'unknown',
+                'uuid': 'second',
+                'arguments': {},
+            }, {
+                'method': 'online',
+                'uuid': 'third',
+                'arguments': {},
+            }],
+            stream_steps=True)
+        answers = self.serve([cmd.to_json()], expected=4)
+
+        for answer in answers:
+            self.assertEqual(cmd.uuid, answer['uuid'])
+
+        events = [answer['payload'] for answer in answers[:3]]
+        self.assertEqual(['step'] * 3, [event['event'] for event in events])
+        self.assertEqual(['first', 'second', 'third'],
+                         [event['data']['uuid'] for event in events])
+        self.assertEqual(['ok', 'err', 'err'],
+                         [event['data']['status'] for event in events])
+
+        result = Status(**answers[3])
+        self.assertNotIn('event', result.payload)
+        self.assertEqual(3, len(result.payload['result']))
+
+    def test_chain_steps_not_streamed_by_default(self):
+        cmd = Command(
+            'chain_execution',
+            commands=[{
+                'method': 'online',
+                'uuid': 'first',
+                'arguments': {},
+            }])
+        answers = self.serve([cmd.to_json()])
+
+        result = Status(**answers[0])
+        self.assertNotIn('event', result.payload)
+        self.assertEqual('first', result.payload['result'][0]['uuid'])
+
+    def test_reconnect(self):
+        if os.name == 'nt':
+            prog = "C:\\Windows\\System32\\cmd.exe"
+            args = ["/c", "ping 127.0.0.1 -n 2 >nul"]
+        else:
+            prog = "/bin/sh"
+            args = ["-c", '"sleep 1"']
+
+        cmd = Command(
+            'execute',
+            pid=1,
+            own_uuid=uuid4().hex,
+            path=prog,
+            arguments=args,
+        )
+        receiver = RpcReceiver(
+            'ws://127.0.0.1:{}/commands'.format(self.PORT),
+            reconnect_delay=0.05,
+            max_reconnect_delay=0.2,
+        )
+        connected = asyncio.Queue()
+        answers = []
+
+        async def first_handler(websocket, _path):
+            await websocket.send(cmd.to_json())
+            connected.put_nowait(websocket)
+            # keep the connection open until the server is closed
+            try:
+                while True:
+                    await websocket.recv()
+            except websockets.exceptions.ConnectionClosed:
+                pass
+
+        async def second_handler(websocket, _path):
+            connected.put_nowait(websocket)
+            while len(answers) < 2:
+                answers.append(json.loads(await websocket.recv()))
+            receiver.close()
+
+        async def run():
+            run_task = self.loop.create_task(receiver.run())
+
+            server = await websockets.serve(
+                first_handler, host='127.0.0.1', port=self.PORT)
+            await asyncio.wait_for(connected.get(), 5)
+
+            # the master restarts while the command is running
+            server.close()
+            await server.wait_closed()
+            self.assertIn(cmd.uuid, receiver.tasks)
+
+            restarted = self.loop.time()
+            server = await websockets.serve(
+                second_handler, host='127.0.0.1', port=self.PORT)
+            await asyncio.wait_for(connected.get(), 5)
+            reconnect_time = self.loop.time() - restarted
+
+            try:
+                await asyncio.wait_for(run_task, 10)
+            finally:
+                server.close()
+                await server.wait_closed()
+
+            return reconnect_time
+
+        reconnect_time = self.loop.run_until_complete(run())
+        self.assertLess(reconnect_time, 1)
+
+        announce = Status(**answers[0])
+        self.assertEqual('connected', announce.payload['event'])
+        self.assertEqual([cmd.uuid], announce.payload['data']['running'])
+
+        result = Status(**answers[1])
+        self.assertEqual(cmd.uuid, result.uuid)
+        self.assertEqual({'method': 'execute', 'result': '0'}, result.payload)
+
+    def test_connect_retry(self):
+        receiver = RpcReceiver(
+            'ws://127.0.0.1:{}/commands'.format(self.PORT),
+            reconnect_delay=0.05,
+            max_reconnect_delay=0.1,
+        )
+
+        async def handler(_websocket, _path):
+            receiver.close()
+
+        async def run():
+            run_task = self.loop.create_task(receiver.run())
+            # no server is running for the first attempts
+            await asyncio.sleep(0.3)
+            self.assertFalse(run_task.done())
+
+            server = await websockets.serve(
+                handler, host='127.0.0.1', port=self.PORT)
+            try:
+                await asyncio.wait_for(run_task, 5)
+            finally:
+                server.close()
+                await server.wait_closed()
+
+        self.loop.run_until_complete(run())
+
+    def test_handshake_timeout_retry(self):
+        receiver = RpcReceiver(
+            'ws://127.0.0.1:{}/commands'.format(self.PORT),
+            reconnect_delay=0.05,
+            max_reconnect_delay=0.1,
+            open_timeout=0.1,
+        )
+        accepted = []
+
+        async def silent(reader, writer):
+            # accepts the connection, but never answers the handshake
+            accepted.append(writer)
+            await reader.read()
+            writer.close()
+
+        async def handler(_websocket, _path):
+            receiver.close()
+
+        async def run():
+            run_task = self.loop.create_task(receiver.run())
+            server = await asyncio.start_server(
+                silent, host='127.0.0.1', port=self.PORT)
+            await asyncio.sleep(0.5)
+            server.close()
+            await server.wait_closed()
+            for writer in accepted:
+                writer.close()
+            self.assertGreater(len(accepted), 1)
+            self.assertFalse(run_task.done())
+
+            server = await websockets.serve(
+                handler, host='127.0.0.1', port=self.PORT)
+            try:
+                await asyncio.wait_for(run_task, 5)
+            finally:
+                server.close()
+                await server.wait_closed()
+
+        self.loop.run_until_complete(run())
+
+
+class TestRpcReceiverOutbox(FileSystemTestCase):
+    PORT = 8753
+
+    def test_replay_and_acknowledge(self):
+        outbox = Outbox(self.joinPath('outbox.journal'))
+        old = Status(Status.ID_OK, {'method': 'online', 'result': None})
+        outbox.append(dict(old))
+
+        cmd = Command('online')
+        receiver = RpcReceiver(
+            'ws://127.0.0.1:{}/commands'.format(self.PORT), outbox=outbox)
+        answers = []
+
+        async def handler(websocket, _path):
+            answers.append(json.loads(await websocket.recv()))
+            await websocket.send(cmd.to_json())
+            answers.append(json.loads(await websocket.recv()))
+            self.assertEqual(2, len(outbox))
+
+            await websocket.send(
+                json.dumps({
+                    'ack': [answer['uuid'] for answer in answers]
+                }))
+            await asyncio.sleep(0.1)
+            receiver.close()
+
+        async def run():
+            server = await websockets.serve(
+                handler, host='127.0.0.1', port=self.PORT)
+            try:
+                await asyncio.wait_for(receiver.run(), 10)
+            finally:
+                server.close()
+                await server.wait_closed()
+
+        self.loop.run_until_complete(run())
+        outbox.close()
+
+        self.assertEqual(old.uuid, answers[0]['uuid'])
+        self.assertEqual(cmd.uuid, answers[1]['uuid'])
+        self.assertEqual(0, len(outbox))
+
+        outbox = Outbox(self.joinPath('outbox.journal'))
+        self.assertEqual([], outbox.pending())
+        outbox.close()
+
+
+class TestRpcReceiverCache(FileSystemTestCase):
+    PORT = 8754
+
+    def test_duplicate_answered_from_cache(self):
+        (source, _, _) = self.provideFile("test.abc")
+        destination = self.joinPath("test.abc.link")
+        with open(destination, 'w') as dest:
+            dest.write('destination')
+
+        cmd = Command(
+            'filesystem_move',
+            source_path=source,
+            source_type='file',
+            destination_path=destination,
+            destination_type='file',
+            backup_ending='_BACK',
+        )
+        receiver = RpcReceiver('ws://127.0.0.1:{}/commands'.format(self.PORT))
+        answers = []
+
+        async def handler(websocket, _path):
+            # the second move would fail, because the backup exists
+            for _ in range(2):
+                await websocket.send(cmd.to_json())
+                answers.append(json.loads(await websocket.recv()))
+            await websocket.send(json.dumps([dict(cmd)]))
+            answers.append(json.loads(await websocket.recv()))
+            receiver.close()
+
+        async def run():
+            server = await websockets.serve(
+                handler, host='127.0.0.1', port=self.PORT)
+            try:
+                await asyncio.wait_for(receiver.run(), 10)
+            finally:
+                server.close()
+                await server.wait_closed()
+
+        self.loop.run_until_complete(run())
+
+        self.assertTrue(Status(**answers[0]).is_ok())
+        self.assertEqual(answers[0], answers[1])
+        self.assertEqual([answers[0]], answers[2])
+        self.assertFilesArePresent("test.abc.link_BACK")
+
+    def test_retry_after_busy_executed(self):
+        registry = RpcRegistry()
+        gate = asyncio.Event()
+
+        @registry.method
+        async def block():
+            await gate.wait()
+            return 'done'
+
+        @registry.method
+        async def echo(value):
+            return value
+
+        receiver = RpcReceiver('ws://127.0.0.1:{}/commands'.format(self.PORT))
+        receiver.dispatcher = Dispatcher(1, 0, registry=registry)
+        first = Command('block')
+        second = Command('echo', value=2)
+        answers = []
+
+        async def handler(websocket, _path):
+            await websocket.send(first.to_json())
+            await websocket.send(second.to_json())
+            answers.append(json.loads(await websocket.recv()))
+
+            gate.set()
+            answers.append(json.loads(await websocket.recv()))
+
+            # the same command again, after the client is not busy anymore
+            await websocket.send(second.to_json())
+            answers.append(json.loads(await websocket.recv()))
+            receiver.close()
+
+        async def run():
+            server = await websockets.serve(
+                handler, host='127.0.0.1', port=self.PORT)
+            try:
+                await asyncio.wait_for(receiver.run(), 10)
+            finally:
+                server.close()
+                await server.wait_closed()
+
+        self.loop.run_until_complete(run())
+
+        self.assertEqual(second.uuid, answers[0]['uuid'])
+        self.assertIn('busy', answers[0]['payload']['result'])
+        self.assertEqual(first.uuid, answers[1]['uuid'])
+        self.assertTrue(Status(**answers[2]).is_ok())
+        self.assertEqual(2, answers[2]['payload']['result'])
+
+
+class TestParseCommands(unittest.TestCase):
+    def test_single(self):
+        cmd = Command('online')
+        (commands, batched) = parse_commands(cmd.to_json())
+        self.assertFalse(batched)
+        self.assertEqual([cmd], commands)
+        self.assertEqual(cmd.uuid, commands[0].uuid)
+
+    def test_list(self):
+        cmds = [Command('online'), Command('get_log', target_uuid='abc')]
+        (commands, batched) = parse_commands(
+            json.dumps([dict(cmd) for cmd in cmds]))
+        self.assertTrue(batched)
+        self.assertEqual(cmds, commands)
+
+    def test_timeout(self):
+        cmd = Command('online')
+        data = dict(cmd)
+        data['timeout'] = 2.5
+        (commands, _) = parse_commands(json.dumps(data))
+        self.assertEqual(2.5, commands[0].timeout)
+
+        (commands, _) = parse_commands(cmd.to_json())
+        self.assertIsNone(commands[0].timeout)
+
+        for timeout in [0, -1, 'a', True]:
+            data['timeout'] = timeout
+            self.assertRaises(ProtocolError, parse_commands, json.dumps(data))
+
+    def test_invalid(self):
+        self.assertRaises(ProtocolError, parse_commands, '[1]')
+        self.assertRaises(ProtocolError, parse_commands,
+                          '{"method": "online", "arguments": {}}')
+        self.assertRaises(ProtocolError, parse_commands,
+                          '{"method": 1, "uuid": "a", "arguments": {}}')
+
+    def test_split(self):
+        cmd = Command('online')
+        data = [1, dict(cmd), {'method': 'online'}]
+        (commands, invalid, batched) = split_commands(data)
+        self.assertTrue(batched)
+        self.assertEqual([cmd], commands)
+        self.assertEqual([1, {'method': 'online'}],
+                         [entry for (entry, _) in invalid])
+        for (_, err) in invalid:
+            self.assertIsInstance(err, ProtocolError)
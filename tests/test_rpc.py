@@ -0,0 +1,361 @@
+"""
+Unit tests for the module client.rpc.
+"""
+#pylint: disable=C0111, C0103
+import asyncio
+import threading
+import time
+import unittest
+
+from utils import Command, ProtocolError
+
+from client.rpc import RpcRegistry, OneOf, compile_check, compile_validator
+from client.rpc import CONTROL, DEFAULT, run_with_timeout
+from client.rpc import RPC
+
+
+class TestCompileCheck(unittest.TestCase):
+    def test_type(self):
+        check = compile_check('path', str)
+        check('abc')
+        self.assertRaisesRegex(ValueError, 'path has to be str', check, 1)
+
+    def test_tuple(self):
+        check = compile_check('backoff', (int, float))
+        check(1)
+        check(1.5)
+        self.assertRaisesRegex(ValueError, 'backoff has to be int or float',
+                               check, '1')
+
+    def test_list(self):
+        check = compile_check('arguments', [str])
+        check([])
+        check(['a', 'b'])
+        self.assertRaisesRegex(ValueError, 'arguments has to be list', check,
+                               'a b')
+        self.assertRaisesRegex(ValueError, 'element in arguments', check,
+                               ['a', 1])
+
+    def test_one_of(self):
+        check = compile_check('source_type', OneOf('file', 'dir'))
+        check('file')
+        self.assertRaisesRegex(ValueError, 'source_type has to be one of',
+                               check, 'none')
+
+    def test_unsupported(self):
+        self.assertRaises(ValueError, compile_check, 'value', 'str')
+        self.assertRaises(ValueError, compile_check, 'value', (str, 'int'))
+
+
+class TestCompileValidator(unittest.TestCase):
+    def test_positional_and_keyword(self):
+        def function(a, b: str, c: int = None):
+            pass
+
+        validate = compile_validator(function)
+        validate((1, 'b'), {})
+        validate((1, ), {'b': 'b', 'c': 2})
+        validate((1, 'b', None), {})
+        self.assertRaisesRegex(ValueError, 'b has to be str', validate,
+                               (1, 2), {})
+        self.assertRaisesRegex(ValueError, 'c has to be int', validate, (1, ),
+                               {
+                                   'b': 'b',
+                                   'c': 'c'
+                               })
+
+    def test_missing_arguments_are_ignored(self):
+        def function(a: int, b: str):
+            pass
+
+        validate = compile_validator(function)
+        validate((), {})
+        validate((1, ), {})
+
+
+class TestRpcRegistry(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.registry = RpcRegistry()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_get(self):
+        @self.registry.method
+        async def function(value: int):
+            return value + 1
+
+        self.assertIs(function, self.registry.get('function'))
+        self.assertIn('function', self.registry)
+        self.assertEqual(
+            2, self.loop.run_until_complete(
+                self.registry.get('function')(1)))
+
+    def test_get_unknown(self):
+        self.assertRaisesRegex(ProtocolError, "unknown function 'unknown'",
+                               self.registry.get, 'unknown')
+        self.assertRaises(ProtocolError, self.registry.get, None)
+
+    def test_unique_names(self):
+        async def function():
+            pass
+
+        self.registry.method(function)
+        self.assertRaises(ValueError, self.registry.method, function)
+
+    def test_no_coroutine(self):
+        def function():
+            pass
+
+        self.assertRaises(ValueError, self.registry.method, function)
+
+    def test_current_command(self):
+        @self.registry.method
+        async def function():
+            return self.registry.current_command().uuid
+
+        cmd = Command('function')
+        status = self.loop.run_until_complete(self.registry.execute(cmd))
+        self.assertEqual(cmd.uuid, status.payload['result'])
+        self.assertIsNone(self.registry.current_command())
+
+    def test_lanes(self):
+        @self.registry.method(lane=CONTROL)
+        async def control():
+            pass
+
+        self.registry.add_lane('blocking', 1)
+
+        @self.registry.method(lane='blocking')
+        def blocking():
+            pass
+
+        self.assertEqual(CONTROL, self.registry.lane('control'))
+        self.assertEqual('blocking', self.registry.lane('blocking'))
+        self.assertEqual(DEFAULT, self.registry.lane('unknown'))
+
+    def test_invalid_lanes(self):
+        def blocking():
+            pass
+
+        async def coroutine():
+            pass
+
+        self.assertRaises(ValueError, self.registry.method, blocking)
+        self.assertRaises(ValueError, self.registry.method(lane='unknown'),
+                          blocking)
+        self.assertRaises(ValueError, self.registry.add_lane, CONTROL, 1)
+
+        self.registry.add_lane('blocking', 1)
+        self.assertRaises(ValueError, self.registry.method(lane='blocking'),
+                          coroutine)
+
+    def test_blocking_lane(self):
+        self.registry.add_lane('blocking', 1)
+
+        @self.registry.method(lane='blocking')
+        def blocking(duration: float):
+            time.sleep(duration)
+            return (threading.current_thread().name,
+                    self.registry.current_command().uuid)
+
+        async def run():
+            cmd = Command('blocking', duration=0.3)
+            task = self.loop.create_task(self.registry.execute(cmd))
+
+            # the event loop is not blocked by the function
+            longest = 0
+            while not task.done():
+                start = self.loop.time()
+                await asyncio.sleep(0.01)
+                longest = max(longest, self.loop.time() - start)
+
+            return (cmd, task.result(), longest)
+
+        (cmd, status, longest) = self.loop.run_until_complete(run())
+        (thread, uuid) = status.payload['result']
+        self.assertTrue(thread.startswith('blocking'))
+        self.assertEqual(cmd.uuid, uuid)
+        self.assertLess(longest, 0.1)
+
+    def test_timeout(self):
+        @self.registry.method
+        async def sleep(duration: (int, float)):
+            await asyncio.sleep(duration)
+            return duration
+
+        cmd = Command('sleep', duration=5)
+        cmd.timeout = 0.05
+        status = self.loop.run_until_complete(self.registry.execute(cmd))
+        self.assertTrue(status.is_err())
+        self.assertIn('timed out after 0.05 seconds', status.payload['result'])
+
+        cmd = Command('sleep', duration=0)
+        cmd.timeout = 1
+        status = self.loop.run_until_complete(self.registry.execute(cmd))
+        self.assertTrue(status.is_ok())
+
+    def test_default_timeout(self):
+        @self.registry.method
+        async def sleep(duration: (int, float)):
+            await asyncio.sleep(duration)
+
+        self.registry.set_timeout('sleep', 0.05)
+        status = self.loop.run_until_complete(
+            self.registry.execute(Command('sleep', duration=5)))
+        self.assertIn('timed out', status.payload['result'])
+
+        # the timeout of the command is used first
+        cmd = Command('sleep', duration=0.1)
+        cmd.timeout = 1
+        self.assertEqual(1, self.registry.timeout(cmd))
+        status = self.loop.run_until_complete(self.registry.execute(cmd))
+        self.assertTrue(status.is_ok())
+
+        self.registry.set_timeout('sleep', None)
+        self.assertIsNone(self.registry.timeout(Command('sleep')))
+
+        self.assertRaises(ValueError, self.registry.set_timeout, 'sleep', 0)
+        self.assertRaises(ProtocolError, self.registry.set_timeout, 'unknown',
+                          1)
+
+    def test_timeout_cancellation_handled(self):
+        async def stubborn():
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                return 'handled'
+
+        self.assertRaises(TimeoutError, self.loop.run_until_complete,
+                          run_with_timeout(stubborn(), 0.05))
+
+    def test_invalid_timeout_not_started(self):
+        started = []
+
+        async def function():
+            started.append(True)
+
+        for timeout in ['soon', -1, 0, True]:
+            self.assertRaises(ValueError, self.loop.run_until_complete,
+                              run_with_timeout(function(), timeout))
+        self.assertEqual([], started)
+
+    def test_timeout_task_cancelled_with_caller(self):
+        stopped = asyncio.Event()
+
+        async def function():
+            try:
+                await asyncio.sleep(5)
+            finally:
+                stopped.set()
+
+        async def run():
+            caller = asyncio.ensure_future(run_with_timeout(function(), 10))
+            await asyncio.sleep(0.01)
+            caller.cancel()
+            await asyncio.wait({caller})
+            return stopped.is_set()
+
+        # the task does not outlive the cancelled command
+        self.assertTrue(self.loop.run_until_complete(run()))
+
+    def test_cancel_with_and_without_timeout(self):
+        @self.registry.method
+        async def stoppable():
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                return 'stopped'
+
+        async def cancel(cmd):
+            task = asyncio.ensure_future(self.registry.execute(cmd))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            return await task
+
+        for timeout in [None, 10]:
+            cmd = Command('stoppable')
+            cmd.timeout = timeout
+            status = self.loop.run_until_complete(cancel(cmd))
+            self.assertTrue(status.is_ok())
+            self.assertEqual('stopped', status.payload['result'])
+
+    def test_blocking_lane_checkpoint(self):
+        self.registry.add_lane('blocking', 1)
+        stopped = threading.Event()
+
+        @self.registry.method(lane='blocking')
+        def blocking():
+            try:
+                while True:
+                    self.registry.checkpoint()
+                    time.sleep(0.01)
+            finally:
+                stopped.set()
+
+        cmd = Command('blocking')
+        cmd.timeout = 0.1
+        status = self.loop.run_until_complete(self.registry.execute(cmd))
+        self.assertIn('timed out', status.payload['result'])
+        self.assertTrue(stopped.is_set())
+
+        # outside of a command the checkpoint does nothing
+        self.registry.checkpoint()
+
+    def test_blocking_lane_run_coroutine(self):
+        self.registry.add_lane('blocking', 1)
+        threads = []
+
+        async def on_loop(value):
+            threads.append(threading.current_thread())
+            return value
+
+        @self.registry.method(lane='blocking')
+        def blocking():
+            return self.registry.run_coroutine(on_loop(42)).result(timeout=5)
+
+        status = self.loop.run_until_complete(
+            self.registry.execute(Command('blocking')))
+        self.assertEqual(42, status.payload['result'])
+        self.assertEqual([threading.main_thread()], threads)
+
+        # outside of a blocking function there is no loop to run on
+        self.assertRaises(RuntimeError, self.registry.run_coroutine,
+                          on_loop(0))
+
+    def test_validation_on_call(self):
+        @self.registry.method
+        async def function(value: int):
+            return value
+
+        self.assertRaisesRegex(ValueError, 'value has to be int',
+                               self.loop.run_until_complete, function('1'))
+
+    def test_missing_argument(self):
+        @self.registry.method
+        async def function(value: int):
+            return value
+
+        self.assertRaisesRegex(
+            TypeError, "missing 1 required positional argument: 'value'",
+            self.loop.run_until_complete, function())
+
+    def test_clear(self):
+        @self.registry.method
+        async def function():
+            pass
+
+        self.registry.clear()
+        self.assertNotIn('function', self.registry)
+        self.assertEqual([], list(self.registry))
+
+    def test_client_methods_registered(self):
+        import client.command  #pylint: disable=W0612
+        for name in [
+                'online', 'enable_logging', 'disable_logging', 'execute',
+                'get_log', 'chain_execution', 'filesystem_move',
+                'filesystem_restore', 'filesystem_hash', 'filesystem_tree',
+                'shutdown'
+        ]:
+            self.assertIn(name, RPC)
@@ -0,0 +1,78 @@
+"""
+Unit tests for the module client.trash.
+"""
+#pylint: disable=C0111, C0103
+import os
+
+from .testcases import FileSystemTestCase
+from client.trash import Trash
+
+
+class TestTrash(FileSystemTestCase):
+    def test_discard_directory(self):
+        (directory, _, _) = self.provideFilledDirectory(
+            "directory", [("sub", "first.txt"), ("", "second.txt")])
+        root = self.joinPath("trash")
+        trash = Trash(root)
+
+        trash.discard(directory)
+        self.assertFalse(os.path.lexists(directory))
+
+        trash.join()
+        self.assertEqual([], os.listdir(root))
+        self.assertEqual(0, trash.pending)
+
+    def test_discard_read_only_directory(self):
+        (directory, _, _) = self.provideFilledDirectory(
+            "directory", [("sub", "first.txt"), ("sub/deep", "second.txt")])
+        os.chmod(os.path.join(directory, "sub", "deep"), 0o555)
+        os.chmod(os.path.join(directory, "sub"), 0o555)
+        trash = Trash()
+
+        trash.discard(directory)
+        trash.join()
+        self.assertEqual([], os.listdir(self.working_dir))
+
+    def test_discard_file(self):
+        (path, _, _) = self.provideFile("test.txt")
+        trash = Trash()
+
+        trash.discard(path)
+        self.assertFalse(os.path.lexists(path))
+
+        # the trash next to the file is removed after the purge
+        trash.join()
+        self.assertEqual([], os.listdir(self.working_dir))
+
+    def test_discard_link(self):
+        (directory, _, _) = self.provideFilledDirectory(
+            "directory", [("", "test.txt")])
+        link = self.joinPath("link")
+        os.symlink(directory, link)
+        trash = Trash()
+
+        trash.discard(link)
+        trash.join()
+        self.assertFalse(os.path.lexists(link))
+        self.assertTrue(os.listdir(directory))
+        self.assertFalse(os.path.exists(self.joinPath(Trash.TRASH_NAME)))
+
+    def test_directory(self):
+        (path, _, _) = self.provideFile("test.txt")
+
+        self.assertEqual(
+            self.joinPath(Trash.TRASH_NAME),
+            Trash().directory(path))
+        self.assertEqual(
+            self.joinPath("trash"),
+            Trash(self.joinPath("trash")).directory(path))
+
+    def test_purge_leftovers(self):
+        root = self.provideDirectory("trash")
+        self.provideFilledDirectory("trash/leftover", [("sub", "test.txt")])
+        self.provideFile("trash/leftover.txt")
+        trash = Trash(root)
+
+        trash.purge(root)
+        trash.join()
+        self.assertEqual([], os.listdir(root))
@@ -14,6 +14,7 @@ import time
 
 from client import shorthand
 from client.logger import LOGGER
+from client.trash import TRASH
 
 
 def random_string(minimum, maximum):
@@ -95,6 +96,8 @@ class FileSystemTestCase(EventLoopTestCase):
                 "Can not delete test folder (which was create before) because it does not exist anymore. "
             )
 
+        # the trash deletes files within the test folder in the background
+        TRASH.join()
         shutil.rmtree(self.working_dir)
 
     def filesInDir(self):